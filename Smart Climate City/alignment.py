@@ -0,0 +1,277 @@
+"""
+Traffic x Air Quality Alignment for Project EcoFlow
+Joins 15-minute traffic with the air quality of the nearest sensors, so the
+decision engine can be evaluated on real historical pairs. Both sides are
+laid out on one regular 15-minute grid; air quality is joined as-of (last
+reading at or before the slot, within a tolerance) with binary searches,
+and a traffic device whose nearest sensor has a gap falls back to the next
+nearest one. Panels are cached in the columnar cache by input hash.
+"""
+
+import hashlib
+import numpy as np
+import pandas as pd
+from config import (
+    AQ_POLLUTANTS,
+    ALIGN_TOLERANCE_MINUTES,
+    ALIGN_NEIGHBOURS,
+    ALIGN_MAX_DISTANCE_KM
+)
+from metrics import timed, increment
+
+SLOT = np.timedelta64(15, 'm').astype('timedelta64[ns]').astype(np.int64)
+TRAFFIC_COLUMNS = ('total_traffic', 'tr1', 'tr2')
+
+
+def _naive_ns(values):
+    """Timestamps as int64 nanoseconds of local wall time (tz dropped, as in aq_model)."""
+    values = pd.to_datetime(pd.Series(values))
+    if values.dt.tz is not None:
+        values = values.dt.tz_localize(None)
+    return values.to_numpy('datetime64[ns]').astype(np.int64)
+
+
+def nearest_sensors(locations, traffic_devices, aq_devices, k=ALIGN_NEIGHBOURS, max_distance_km=ALIGN_MAX_DISTANCE_KM):
+    """
+    The k nearest air quality sensors for every traffic device.
+
+    Parameters:
+    - locations: DataFrame with imei, latitude, longitude (get_device_locations())
+    - traffic_devices: Traffic device IMEIs
+    - aq_devices: Air quality device IMEIs
+    - k: Candidates per traffic device
+    - max_distance_km: Farther sensors are dropped
+
+    Returns:
+    - DataFrame with imei, rank (0 = nearest), aq_imei, distance_km
+    """
+    from spatial import _nearest, EARTH_RADIUS_KM
+
+    located = locations.dropna(subset=['latitude', 'longitude']).drop_duplicates('imei')
+    located = located.set_index(located['imei'].astype(str))
+    traffic = [d for d in map(str, traffic_devices) if d in located.index]
+    sensors = [d for d in map(str, aq_devices) if d in located.index]
+    if len(traffic) < len(traffic_devices):
+        increment('alignment_unlocated_devices', amount=len(traffic_devices) - len(traffic))
+    if not traffic or not sensors:
+        return pd.DataFrame(columns=['imei', 'rank', 'aq_imei', 'distance_km'])
+
+    # Local equirectangular projection (km), as in spatial.PollutionSurface
+    lat0, lon0 = np.radians(located['latitude'].mean()), np.radians(located['longitude'].mean())
+
+    def project(ids):
+        lat = np.radians(located.loc[ids, 'latitude'].to_numpy(dtype=float))
+        lon = np.radians(located.loc[ids, 'longitude'].to_numpy(dtype=float))
+        return np.column_stack([EARTH_RADIUS_KM * (lon - lon0) * np.cos(lat0), EARTH_RADIUS_KM * (lat - lat0)])
+
+    distances, indices = _nearest(project(sensors), project(traffic), k)
+    n, k = indices.shape
+    mapping = pd.DataFrame({
+        'imei': np.repeat(traffic, k),
+        'rank': np.tile(np.arange(k), n),
+        'aq_imei': np.asarray(sensors)[indices.ravel()],
+        'distance_km': distances.ravel()
+    })
+    return mapping[mapping['distance_km'] <= max_distance_km].reset_index(drop=True)
+
+
+def asof_positions(source_ns, target_ns, tolerance_ns):
+    """
+    As-of join on sorted arrays: for every target time, the position of the
+    last source time at or before it, or -1 if there is none within
+    `tolerance_ns`.
+    """
+    positions = np.searchsorted(source_ns, target_ns, side='right') - 1
+    found = positions >= 0
+    age = target_ns - source_ns[np.maximum(positions, 0)]
+    positions[~found | (age > tolerance_ns)] = -1
+    return positions
+
+
+def _grid_matrix(ids, times_ns, frame, columns, devices, start_ns, n_slots):
+    """Exact 15-minute slots -> (devices, slots) matrices, one per column (NaN where missing)."""
+    row = pd.Index(devices).get_indexer(ids)
+    slot = (times_ns - start_ns) // SLOT
+    keep = (row >= 0) & (slot >= 0) & (slot < n_slots)
+    matrices = {}
+    for column in columns:
+        matrix = np.full((len(devices), n_slots), np.nan)
+        matrix[row[keep], slot[keep]] = frame[column].to_numpy(dtype=float)[keep]
+        matrices[column] = matrix
+    return matrices
+
+
+def align_panel(traffic, air_quality, locations, devices=None, start=None, end=None,
+                tolerance_minutes=ALIGN_TOLERANCE_MINUTES, k=ALIGN_NEIGHBOURS,
+                max_distance_km=ALIGN_MAX_DISTANCE_KM):
+    """
+    Build an aligned 15-minute traffic x air quality panel.
+
+    Parameters:
+    - traffic: 15-minute traffic (imei, ds_15min, total_traffic, tr1, tr2), e.g.
+      get_fleet_traffic_15min() or preprocessing.clean_traffic() output
+    - air_quality: 15-minute air quality (imei, ds_15min, p10, p02), e.g. get_air_quality_data()
+    - locations: Device locations (imei, latitude, longitude)
+    - devices: Traffic devices to include (default: all)
+    - start, end: Panel range [start, end) (default: the traffic range)
+    - tolerance_minutes: Maximum age of a joined air quality reading
+    - k, max_distance_km: Candidate sensors per traffic device
+
+    Returns:
+    - DataFrame with one row per traffic device and 15-minute slot that has
+      traffic: imei, ds_15min, total_traffic, tr1, tr2, aq_imei, distance_km,
+      p10, p02, aq_age_minutes (air quality columns NaN where no sensor had a
+      reading within the tolerance)
+    """
+    pollutants = list(AQ_POLLUTANTS.values())
+    traffic_ids = traffic['imei'].astype(str).to_numpy()
+    traffic_ns = _naive_ns(traffic['ds_15min'])
+    if devices is None:
+        devices = sorted(set(traffic_ids))
+    devices = [str(d) for d in devices]
+    start_ns = _naive_ns([start])[0] // SLOT * SLOT if start is not None else traffic_ns.min() // SLOT * SLOT
+    end_ns = _naive_ns([end])[0] if end is not None else traffic_ns.max() + SLOT
+    n_slots = max(int(-(-(end_ns - start_ns) // SLOT)), 0)
+    slots_ns = start_ns + SLOT * np.arange(n_slots, dtype=np.int64)
+
+    with timed('alignment.panel', devices=len(devices), slots=n_slots):
+        matrices = _grid_matrix(traffic_ids, traffic_ns, traffic, TRAFFIC_COLUMNS, devices, start_ns, n_slots)
+
+        # As-of air quality per sensor on the grid: one binary search per sensor
+        aq_ids = air_quality['imei'].astype(str).to_numpy()
+        aq_ns = _naive_ns(air_quality['ds_15min'])
+        order = np.lexsort((aq_ns, aq_ids))
+        aq_ids, aq_ns = aq_ids[order], aq_ns[order]
+        aq_values = {p: air_quality[p].to_numpy(dtype=float)[order] for p in pollutants}
+        sensors, first = np.unique(aq_ids, return_index=True)
+        bounds = np.append(first, len(aq_ids))
+
+        sensor_values = {p: np.full((len(sensors), n_slots), np.nan) for p in pollutants}
+        sensor_age = np.full((len(sensors), n_slots), np.nan)
+        tolerance_ns = int(tolerance_minutes) * 60 * 10**9
+        for s in range(len(sensors)):
+            lo, hi = bounds[s], bounds[s + 1]
+            # Rows without PM10 do not count as a reading
+            present = np.flatnonzero(np.isfinite(aq_values[pollutants[0]][lo:hi])) + lo
+            positions = asof_positions(aq_ns[present], slots_ns, tolerance_ns)
+            hit = positions >= 0
+            rows = present[positions[hit]]
+            for p in pollutants:
+                sensor_values[p][s, hit] = aq_values[p][rows]
+            sensor_age[s, hit] = (slots_ns[hit] - aq_ns[rows]) / 6e10
+
+        # Candidate sensors per device, nearest first; -1 pads missing candidates
+        mapping = nearest_sensors(locations, devices, sensors, k, max_distance_km)
+        n_candidates = int(mapping['rank'].max()) + 1 if len(mapping) else 0
+        candidates = np.full((len(devices), max(n_candidates, 1)), -1)
+        distances = np.full(candidates.shape, np.nan)
+        if len(mapping):
+            row = pd.Index(devices).get_indexer(mapping['imei'])
+            candidates[row, mapping['rank']] = pd.Index(sensors).get_indexer(mapping['aq_imei'])
+            distances[row, mapping['rank']] = mapping['distance_km'].to_numpy()
+
+        # First candidate with a reading, per device and slot
+        padded = np.vstack([sensor_values[pollutants[0]], np.full((1, n_slots), np.nan)])
+        available = np.isfinite(padded[candidates])  # (devices, candidates, slots)
+        choice = available.argmax(axis=1)
+        has_aq = available.any(axis=1)
+        chosen = np.take_along_axis(candidates, choice, axis=1)
+        chosen[~has_aq] = -1
+        increment('alignment_fallback_slots', amount=int((has_aq & (choice > 0)).sum()))
+
+        keep = np.isfinite(matrices['total_traffic'])
+        device_row, slot = np.nonzero(keep)
+        sensor = chosen[device_row, slot]
+        panel = pd.DataFrame({
+            'imei': np.asarray(devices, dtype=object)[device_row],
+            'ds_15min': pd.to_datetime(slots_ns[slot]),
+            **{c: matrices[c][device_row, slot] for c in TRAFFIC_COLUMNS},
+            'aq_imei': np.append(sensors.astype(object), None)[sensor],
+            'distance_km': np.where(sensor >= 0, distances[device_row, choice[device_row, slot]], np.nan)
+        })
+        for p in pollutants:
+            panel[p] = np.append(sensor_values[p], np.full((1, n_slots), np.nan), axis=0)[sensor, slot]
+        panel['aq_age_minutes'] = np.append(sensor_age, np.full((1, n_slots), np.nan), axis=0)[sensor, slot]
+    increment('alignment_rows', amount=len(panel))
+    return panel
+
+
+def panel_key(traffic, air_quality, locations, **params):
+    """Content hash of the three inputs plus the alignment parameters."""
+    from preprocessing import input_hash
+
+    digest = hashlib.sha1()
+    for frame in (traffic, air_quality, locations[['imei', 'latitude', 'longitude']]):
+        digest.update(input_hash(frame).encode())
+    digest.update(repr(sorted((k, str(v)) for k, v in params.items())).encode())
+    return digest.hexdigest()[:20]
+
+
+def load_aligned_panel(traffic, air_quality, locations, cache=True, **params):
+    """
+    align_panel() served from the columnar cache when the same inputs and
+    parameters were aligned before.
+
+    Parameters:
+    - traffic, air_quality, locations: As for align_panel()
+    - cache: Read and write the columnar cache
+    - params: Passed through to align_panel()
+
+    Returns:
+    - Aligned panel DataFrame
+    """
+    if not cache:
+        return align_panel(traffic, air_quality, locations, **params)
+
+    from columnar_cache import load_columns, save_columns
+
+    name = f"aligned_{panel_key(traffic, air_quality, locations, **params)}"
+    panel = load_columns(name)
+    if panel is not None:
+        panel['imei'] = panel['imei'].astype(str)
+        panel['aq_imei'] = panel['aq_imei'].astype(object).where(panel['aq_imei'] != 'None', None)
+        return panel
+
+    panel = align_panel(traffic, air_quality, locations, **params)
+    save_columns(name, panel)
+    return panel
+
+
+if __name__ == "__main__":
+    """
+    Align the extracted traffic with the extracted air quality and report coverage
+    """
+    import os
+    import time
+    from config import TRAINING_DATA_MONTHS, AQ_DATA_MONTHS
+
+    print("=" * 70)
+    print("🔗 PROJECT ECOFLOW - TRAFFIC x AIR QUALITY ALIGNMENT")
+    print("=" * 70)
+
+    paths = {
+        'traffic': f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv',
+        'air_quality': f'data_cache/air_quality_{AQ_DATA_MONTHS}m.csv',
+        'locations': 'data_cache/device_locations.csv'
+    }
+    missing = [path for path in paths.values() if not os.path.exists(path)]
+    if missing:
+        print(f"\n❌ Data not found: {', '.join(missing)}")
+        print("⚠️  Run data_extraction.py first to extract the data")
+        exit(1)
+
+    from preprocessing import load_clean_traffic
+
+    traffic = load_clean_traffic(pd.read_csv(paths['traffic']))
+    air_quality = pd.read_csv(paths['air_quality'])
+    locations = pd.read_csv(paths['locations'], dtype={'imei': str})
+
+    for attempt in ('build', 'cached'):
+        start = time.perf_counter()
+        panel = load_aligned_panel(traffic, air_quality, locations)
+        print(f"\n✅ {attempt}: {len(panel):,} rows in {time.perf_counter() - start:.2f}s")
+
+    matched = panel['p10'].notna()
+    print(f"\n📊 Slots with air quality: {matched.mean():.1%}")
+    if matched.any():
+        print(panel.loc[matched].groupby(['imei', 'aq_imei'])['distance_km'].agg(['first', 'size']).to_string())
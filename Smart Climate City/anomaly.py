@@ -0,0 +1,448 @@
+"""
+Sensor Anomaly Detection for Project EcoFlow
+Streaming checks on incoming tr1/tr2 readings per device: gaps (dropouts),
+flatlines (stuck counters), spikes against a robust per-hour median/MAD,
+implausible values, and 15-minute totals outside the forecast band.
+State per device is constant-size, events go to a compact log, and flagged
+15-minute intervals can be excluded from training.
+"""
+
+import json
+import os
+from collections import deque
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    ANOMALY_GAP_MINUTES,
+    ANOMALY_FLATLINE_READINGS,
+    ANOMALY_ZERO_RUN_MINUTES,
+    ANOMALY_SPIKE_Z,
+    ANOMALY_SPIKE_FLOOR,
+    ANOMALY_WARMUP_READINGS,
+    ANOMALY_LEARNING_RATE,
+    ANOMALY_MAX_PER_MINUTE,
+    ANOMALY_LOG_PATH,
+    ANOMALY_MAX_EVENTS
+)
+from metrics import timed, increment
+
+CHANNELS = ('tr1', 'tr2')
+SLOT = timedelta(minutes=15)
+MAD_TO_SIGMA = 1.4826
+
+
+def _new_channel_state():
+    return {
+        'value': None,          # Last value (flatline detection)
+        'run': 0,               # Consecutive identical readings
+        'run_start': None,
+        'median': [0.0] * 24,   # Running median per hour of day
+        'mad': [1.0] * 24,      # Running median absolute deviation per hour of day
+        'count': [0] * 24,
+        'open': {}              # kind -> open event (flatline, spike)
+    }
+
+
+class SensorMonitor:
+    """
+    Streaming detector over raw readings. Feed readings in time order per
+    device with process(); each call is O(1).
+
+    The running median and MAD use stochastic-approximation updates
+    (median += step * sign(x - median)), which need no window buffer and
+    are insensitive to the outliers they are meant to catch.
+    """
+
+    def __init__(self, log_path=ANOMALY_LOG_PATH, max_events=ANOMALY_MAX_EVENTS):
+        self.log_path = log_path
+        self.states = {}                        # (device, channel) -> state
+        self.last_time = {}                     # device -> timestamp of last reading
+        self.events = deque(maxlen=max_events)  # Recent events (open and closed)
+
+    # ------------------------------------------------------------------
+    # Event log
+    # ------------------------------------------------------------------
+    def _open(self, device, channel, kind, start, end, value):
+        event = {'device': str(device), 'channel': channel, 'kind': kind,
+                 'start': start, 'end': end, 'value': value, 'count': 1}
+        self.events.append(event)
+        increment('anomalies', kind=kind)
+        return event
+
+    def _close(self, event):
+        """Persist a finished event as one JSON line."""
+        if not self.log_path:
+            return
+        record = dict(event, start=str(event['start']), end=str(event['end']))
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(record, default=float) + '\n')
+
+    def flush(self):
+        """Close all open events (e.g. at the end of a batch replay)."""
+        for state in self.states.values():
+            for event in state['open'].values():
+                self._close(event)
+            state['open'].clear()
+
+    # ------------------------------------------------------------------
+    # Detection
+    # ------------------------------------------------------------------
+    def process(self, device, timestamp, values):
+        """
+        Check one reading.
+
+        Parameters:
+        - device: Device identifier
+        - timestamp: Reading time (datetime)
+        - values: dict of channel -> vehicles counted (e.g. {'tr1': 4, 'tr2': 7})
+
+        Returns:
+        - list of events opened by this reading
+        """
+        new_events = []
+        last = self.last_time.get(device)
+        if last is not None:
+            if timestamp <= last:
+                return new_events  # Duplicate or out-of-order reading
+            if timestamp - last > timedelta(minutes=ANOMALY_GAP_MINUTES):
+                event = self._open(device, None, 'gap', last, timestamp, None)
+                self._close(event)
+                new_events.append(event)
+        self.last_time[device] = timestamp
+
+        for channel, value in values.items():
+            if value is None or value != value:  # None or NaN
+                continue
+            key = (device, channel)
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = _new_channel_state()
+            new_events += self._check_channel(device, channel, state, timestamp, float(value))
+        return new_events
+
+    def _check_channel(self, device, channel, state, timestamp, value):
+        new_events = []
+        opened = state['open']
+
+        # Flatline: identical readings (zeros are normal at night, so they need far longer runs)
+        if value == state['value']:
+            state['run'] += 1
+        else:
+            if 'flatline' in opened:
+                self._close(opened.pop('flatline'))
+            state['value'], state['run'], state['run_start'] = value, 1, timestamp
+        stuck = (timestamp - state['run_start'] >= timedelta(minutes=ANOMALY_ZERO_RUN_MINUTES)
+                 if value == 0 else state['run'] >= ANOMALY_FLATLINE_READINGS)
+        if stuck:
+            if 'flatline' in opened:
+                opened['flatline']['end'] = timestamp
+                opened['flatline']['count'] += 1
+            else:
+                opened['flatline'] = self._open(device, channel, 'flatline', state['run_start'], timestamp, value)
+                new_events.append(opened['flatline'])
+
+        # Spikes against the running median/MAD for this hour of day
+        hour = timestamp.hour
+        median, mad, count = state['median'][hour], state['mad'][hour], state['count'][hour]
+        if value < 0 or value > ANOMALY_MAX_PER_MINUTE:
+            kind = 'implausible'
+        elif count >= ANOMALY_WARMUP_READINGS and \
+                abs(value - median) > ANOMALY_SPIKE_Z * (MAD_TO_SIGMA * mad + ANOMALY_SPIKE_FLOOR):
+            kind = 'spike'
+        else:
+            kind = None
+
+        if kind is not None:
+            event = opened.get(kind)
+            if event is not None:
+                # Consecutive outliers collapse into one event
+                event['end'] = timestamp
+                event['count'] += 1
+                event['value'] = max(event['value'], value)
+            else:
+                opened[kind] = self._open(device, channel, kind, timestamp, timestamp, value)
+                new_events.append(opened[kind])
+        else:
+            for done in ('spike', 'implausible'):
+                if done in opened:
+                    self._close(opened.pop(done))
+
+        if kind != 'implausible':
+            step = ANOMALY_LEARNING_RATE * max(mad, 1.0)
+            median += step if value > median else -step if value < median else 0.0
+            deviation = abs(value - median)
+            mad += step if deviation > mad else -step if deviation < mad else 0.0
+            state['median'][hour], state['mad'][hour] = median, max(mad, 0.0)
+            state['count'][hour] = count + 1
+        return new_events
+
+    def check_slot(self, device, series, slot, actual, lower, upper):
+        """
+        Compare a completed 15-minute total with the forecast band.
+
+        Returns:
+        - The 'out_of_band' event, or None if the value is inside the band
+        """
+        if lower <= actual <= upper:
+            return None
+        event = self._open(device, series, 'out_of_band', slot, slot + SLOT, float(actual))
+        self._close(event)
+        return event
+
+    def process_frame(self, df, device_column='imei'):
+        """
+        Check a frame of raw readings (timestamp, tr1, tr2[, imei]) in time
+        order, with the same events and end state as process() per row.
+        Duplicates, gaps, flatlines and implausible values are found with
+        array operations; only the running median/MAD behind the spike check
+        is a recursion, walked per device, channel and hour of day.
+
+        Returns:
+        - list of events opened
+        """
+        if df is None or len(df) == 0:
+            return []
+        timestamps = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
+        order = np.argsort(timestamps.to_numpy(), kind='stable')
+        times = timestamps.to_numpy()[order].astype('datetime64[us]')
+        devices = (df[device_column].astype(str).to_numpy()[order] if device_column in df.columns
+                   else np.full(len(df), 'unknown'))
+        columns = [(c, df[c].to_numpy(dtype=float)[order]) for c in CHANNELS if c in df.columns]
+
+        # Events are collected as (row, channel rank, step, tie, action, event) and
+        # replayed in the order process() would have opened and closed them
+        actions, new_states = [], []
+        with timed('anomaly.process', rows=len(df)):
+            codes, names = pd.factorize(devices)
+            by_device = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[by_device], np.arange(len(names) + 1))
+            for d, device in enumerate(names):
+                rows = self._frame_gaps(device, by_device[bounds[d]:bounds[d + 1]], times, actions)
+                for rank, (channel, column) in enumerate(columns):
+                    values = column[rows]
+                    valid = ~np.isnan(values)
+                    if not valid.any():
+                        continue
+                    key = (device, channel)
+                    state = self.states.get(key)
+                    if state is None:
+                        state = _new_channel_state()
+                        new_states.append((rows[valid][0], rank, key, state))
+                    channel_rows = (rows[valid], rank)
+                    self._frame_flatline(device, channel, state, channel_rows, times, values[valid], actions)
+                    self._frame_outliers(device, channel, state, channel_rows, times, values[valid], actions)
+
+            for _, _, key, state in sorted(new_states, key=lambda item: item[:2]):
+                self.states[key] = state
+            events = []
+            for *_, action, event in sorted(actions, key=lambda item: item[:4]):
+                if action == 'open':
+                    self.events.append(event)
+                    increment('anomalies', kind=event['kind'])
+                    events.append(event)
+                else:
+                    self._close(event)
+        return events
+
+    def _frame_gaps(self, device, rows, times, actions):
+        """Drop duplicate/out-of-order rows of one device and record dropouts."""
+        t = times[rows]
+        last = self.last_time.get(device)
+        floor = np.datetime64(last, 'us') if last is not None else t[0] - np.timedelta64(1, 'us')
+        keep = t > np.concatenate([[floor], np.maximum(t[:-1], floor)])
+        rows, t = rows[keep], t[keep]
+        if len(rows) == 0:
+            return rows
+
+        starts = [last] + t[:-1].tolist()
+        gaps = np.flatnonzero(np.diff(np.concatenate([[floor], t])) > np.timedelta64(ANOMALY_GAP_MINUTES, 'm'))
+        for j in gaps.tolist():
+            if starts[j] is None:
+                continue
+            event = {'device': str(device), 'channel': None, 'kind': 'gap',
+                     'start': starts[j], 'end': t[j].item(), 'value': None, 'count': 1}
+            actions.append((rows[j], -1, 0, 0, 'open', event))
+            actions.append((rows[j], -1, 0, 1, 'close', event))
+        self.last_time[device] = t[-1].item()
+        return rows
+
+    def _frame_flatline(self, device, channel, state, channel_rows, times, values, actions):
+        """Runs of identical readings for one device/channel (see _check_channel)."""
+        rows, rank = channel_rows
+        t = times[rows]
+        n = len(values)
+        opened = state['open']
+
+        changed = np.empty(n, dtype=bool)
+        changed[0] = state['value'] is None or values[0] != state['value']
+        changed[1:] = values[1:] != values[:-1]
+        segment = np.cumsum(changed)  # Segment 0 continues the run from the previous call
+        first = np.maximum.accumulate(np.where(changed, np.arange(n), 0))
+        run = np.arange(n) - first + 1 + np.where(segment == 0, state['run'], 0)
+        run_start = t[first]
+        if not changed[0]:
+            run_start[segment == 0] = np.datetime64(state['run_start'], 'us')
+        stuck = np.where(values == 0, t - run_start >= np.timedelta64(ANOMALY_ZERO_RUN_MINUTES, 'm'),
+                         run >= ANOMALY_FLATLINE_READINGS)
+
+        starts = np.flatnonzero(changed)
+        if changed[0] and 'flatline' in opened:
+            actions.append((rows[0], rank, 0, 0, 'close', opened.pop('flatline')))
+        stuck_idx = np.flatnonzero(stuck)
+        for members in np.split(stuck_idx, np.flatnonzero(np.diff(segment[stuck_idx])) + 1):
+            if len(members) == 0:
+                continue
+            head, tail = members[0], members[-1]
+            if segment[head] == 0 and 'flatline' in opened:
+                event = opened.pop('flatline')
+                event['end'] = t[tail].item()
+                event['count'] += len(members)
+            else:
+                event = {'device': str(device), 'channel': channel, 'kind': 'flatline',
+                         'start': state['run_start'] if segment[head] == 0 else run_start[head].item(),
+                         'end': t[tail].item(), 'value': float(values[head]), 'count': len(members)}
+                actions.append((rows[head], rank, 1, 0, 'open', event))
+            following = starts[starts > tail]
+            if len(following):
+                actions.append((rows[following[0]], rank, 0, 0, 'close', event))
+            else:
+                opened['flatline'] = event
+
+        if segment[-1] != 0:
+            state['run_start'] = run_start[-1].item()
+        state['value'], state['run'] = float(values[-1]), int(run[-1])
+
+    def _frame_outliers(self, device, channel, state, channel_rows, times, values, actions):
+        """Spikes and implausible values for one device/channel (see _check_channel)."""
+        rows, rank = channel_rows
+        t = times[rows]
+        n = len(values)
+        opened = state['open']
+
+        implausible = (values < 0) | (values > ANOMALY_MAX_PER_MINUTE)
+        spike = np.zeros(n, dtype=bool)
+        hours = t.astype('datetime64[h]').astype(np.int64) % 24
+        usable = np.flatnonzero(~implausible)
+        by_hour = usable[np.argsort(hours[usable], kind='stable')]
+        bounds = np.searchsorted(hours[by_hour], np.arange(25))
+        readings = values.tolist()
+        rate, z, floor, warmup = ANOMALY_LEARNING_RATE, ANOMALY_SPIKE_Z, ANOMALY_SPIKE_FLOOR, ANOMALY_WARMUP_READINGS
+        for hour in range(24):
+            median, mad, count = state['median'][hour], state['mad'][hour], state['count'][hour]
+            for j in by_hour[bounds[hour]:bounds[hour + 1]].tolist():
+                value = readings[j]
+                if count >= warmup and abs(value - median) > z * (MAD_TO_SIGMA * mad + floor):
+                    spike[j] = True
+                step = rate * (mad if mad > 1.0 else 1.0)
+                median += step if value > median else -step if value < median else 0.0
+                deviation = abs(value - median)
+                mad += step if deviation > mad else -step if deviation < mad else 0.0
+                if mad < 0.0:
+                    mad = 0.0
+                count += 1
+            state['median'][hour], state['mad'][hour], state['count'][hour] = median, mad, count
+
+        kinds = np.where(implausible, 2, np.where(spike, 1, 0))
+        if kinds[0] == 0:
+            for tie, done in enumerate(('spike', 'implausible')):
+                if done in opened:
+                    actions.append((rows[0], rank, 2, tie, 'close', opened.pop(done)))
+
+        # Consecutive outliers collapse into one event per kind until a normal reading
+        flagged = np.flatnonzero(kinds)
+        for episode in np.split(flagged, np.flatnonzero(np.diff(flagged) > 1) + 1):
+            if len(episode) == 0:
+                continue
+            current = {}
+            if episode[0] == 0:
+                current = {kind: opened.pop(kind) for kind in ('spike', 'implausible') if kind in opened}
+            for code, kind in ((1, 'spike'), (2, 'implausible')):
+                members = episode[kinds[episode] == code]
+                if len(members) == 0:
+                    continue
+                peak = float(values[members].max())
+                event = current.get(kind)
+                if event is not None:
+                    event['end'] = t[members[-1]].item()
+                    event['count'] += len(members)
+                    event['value'] = max(event['value'], peak)
+                else:
+                    current[kind] = event = {
+                        'device': str(device), 'channel': channel, 'kind': kind, 'start': t[members[0]].item(),
+                        'end': t[members[-1]].item(), 'value': peak, 'count': len(members)
+                    }
+                    actions.append((rows[members[0]], rank, 2, 0, 'open', event))
+            if episode[-1] + 1 < n:
+                for tie, done in enumerate(('spike', 'implausible')):
+                    if done in current:
+                        actions.append((rows[episode[-1] + 1], rank, 2, tie, 'close', current[done]))
+            else:
+                opened.update(current)
+
+    def recent_events(self, device=None):
+        """Recent events as a DataFrame (optionally for one device)."""
+        events = [e for e in self.events if device is None or e['device'] == str(device)]
+        return pd.DataFrame(events, columns=['device', 'channel', 'kind', 'start', 'end', 'value', 'count'])
+
+
+def flagged_slots(events, device=None):
+    """
+    15-minute slots touched by anomaly events.
+
+    Parameters:
+    - events: Iterable of event dicts
+    - device: Only consider events for this device (None = all)
+
+    Returns:
+    - pandas DatetimeIndex of flagged slot starts
+    """
+    slots = []
+    for event in events:
+        if device is not None and event['device'] != str(device):
+            continue
+        start = pd.Timestamp(event['start']).floor('15min')
+        end = pd.Timestamp(event['end'])
+        # Gap boundaries are flagged too: those slots only hold partial counts
+        slots.append(pd.date_range(start, max(start, end.floor('15min')), freq='15min'))
+    if not slots:
+        return pd.DatetimeIndex([])
+    return slots[0].append(slots[1:]).unique()
+
+
+def exclude_flagged(df_15min, events, device=None, ds_column='ds_15min'):
+    """
+    Drop 15-minute rows that overlap anomaly events.
+
+    Returns:
+    - (filtered DataFrame, number of rows removed)
+    """
+    flagged = flagged_slots(events, device=device)
+    mask = pd.to_datetime(df_15min[ds_column]).isin(flagged)
+    return df_15min[~mask.to_numpy()], int(mask.sum())
+
+
+if __name__ == "__main__":
+    """
+    Replay the extracted training data through the detector
+    """
+    from config import TRAINING_DATA_MONTHS
+
+    print("=" * 70)
+    print("🚨 PROJECT ECOFLOW - SENSOR ANOMALY SCAN")
+    print("=" * 70)
+
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Training data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the training data")
+        exit(1)
+
+    monitor = SensorMonitor()
+    events = monitor.process_frame(pd.read_csv(data_path))
+    monitor.flush()
+    summary = monitor.recent_events().groupby(['kind', 'channel'], dropna=False)['count'].agg(['size', 'sum'])
+    print(f"\n📊 {len(events)} events ({len(flagged_slots(events))} flagged 15-minute intervals):")
+    print(summary.rename(columns={'size': 'events', 'sum': 'readings'}).to_string())
+    print(f"\n💾 Event log: {ANOMALY_LOG_PATH}")
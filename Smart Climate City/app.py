@@ -8,9 +8,20 @@ import pandas as pd
 import os
 from datetime import datetime, timedelta
 from logic import SmartIntersection, calculate_health_impact
-from model import TrafficPredictor
-from config import HEILBRONN_COORDS, MODEL_PATH, TRAINING_DATA_MONTHS
-import psycopg2
+from signal_timing import webster_timing
+from config import (
+    HEILBRONN_COORDS,
+    MODEL_PATH,
+    BASELINE_MODEL_PATH,
+    FORECAST_TABLE_PATH,
+    AQ_FORECAST_TABLE_PATH,
+    ALIGN_MAX_DISTANCE_KM,
+    TRAINING_DATA_MONTHS,
+    NOWCAST_ENABLED,
+    SPATIAL_GRID_RESOLUTION_M,
+    COLUMNAR_CACHE_PATH
+)
+import metrics
 
 # ============================================================================
 # PAGE CONFIGURATION
@@ -291,17 +302,111 @@ def load_traffic_model(_model_version=None):
     Load the trained Prophet model.
     _model_version parameter is used to bust cache when model is retrained.
     """
+    metrics.cache_miss('traffic_model')
+    # Imported lazily: unpickling the models loads Prophet, which is only
+    # needed when the precomputed forecast table can't answer
+    from model import TrafficPredictor
     predictor = TrafficPredictor()
     if predictor.load_model(MODEL_PATH):
         return predictor
     return None
 
+@st.cache_resource(show_spinner=False)
+def load_baseline_model(_model_version=None):
+    """
+    Load the NumPy seasonal baseline, training it from the cached CSV if no
+    saved baseline exists (takes milliseconds, no Prophet required).
+    _model_version parameter is used to bust cache when model is retrained.
+    """
+    metrics.cache_miss('baseline_model')
+    from baseline import SeasonalBaselinePredictor
+    baseline = SeasonalBaselinePredictor()
+    if baseline.load_model(BASELINE_MODEL_PATH):
+        return baseline
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if os.path.exists(data_path) and baseline.train(data_path):
+        return baseline
+    return None
+
+@st.cache_resource(show_spinner=False)
+def load_forecast_table(_table_version=None):
+    """
+    Load the precomputed forecast table (no Prophet import needed).
+    _table_version parameter is used to bust cache when the table is rebuilt.
+    """
+    metrics.cache_miss('forecast_table')
+    from forecast_table import ForecastTable
+    table = ForecastTable()
+    if table.load(FORECAST_TABLE_PATH):
+        return table
+    return None
+
+@st.cache_resource(show_spinner=False)
+def load_pollution_surface(_stats_version=None):
+    """
+    PM10 surface interpolated from the per-location air quality averages.
+    Grid geometry and KD-tree neighbours are built once per stats file.
+    _stats_version parameter is used to bust cache when the stats are re-extracted.
+    """
+    metrics.cache_miss('pollution_surface')
+    stats_path = 'data_cache/air_quality_stats.csv'
+    if not os.path.exists(stats_path):
+        return None
+    from spatial import surface_from_stats
+    return surface_from_stats(pd.read_csv(stats_path))
+
+@st.cache_resource(show_spinner=False)
+def load_rollups(_rollup_version=None):
+    """
+    Multi-resolution traffic rollups for the history chart (levels are
+    memory-mapped from the columnar cache on first use).
+    _rollup_version parameter is used to bust cache when the rollups are rebuilt.
+    """
+    metrics.cache_miss('rollups')
+    from rollups import RollupStore
+    return RollupStore()
+
+@st.cache_resource(show_spinner=False)
+def load_aq_forecaster(_table_version=None):
+    """
+    PM10/PM2.5 forecast table, the air quality device closest to the
+    intersection (from the extracted device locations) and its distance in km.
+    Sensors beyond ALIGN_MAX_DISTANCE_KM - or any sensor, when locations are
+    unknown - say nothing about the air at the intersection, so the device
+    is None then.
+    _table_version parameter is used to bust cache when the table is rebuilt.
+    """
+    metrics.cache_miss('aq_forecaster')
+    import numpy as np
+    from aq_model import AirQualityForecaster
+    from spatial import EARTH_RADIUS_KM
+    forecaster = AirQualityForecaster()
+    if not forecaster.load(AQ_FORECAST_TABLE_PATH) or not forecaster.devices:
+        return None, None, None
+    locations_path = 'data_cache/device_locations.csv'
+    if not os.path.exists(locations_path):
+        return forecaster, None, None
+    locations = pd.read_csv(locations_path, dtype={'imei': str}).dropna(subset=['latitude', 'longitude'])
+    locations = locations[locations['imei'].isin(forecaster.devices)]
+    if len(locations) == 0:
+        return forecaster, None, None
+    lat, lon = np.radians(locations['latitude'].to_numpy()), np.radians(locations['longitude'].to_numpy())
+    lat0, lon0 = np.radians(HEILBRONN_COORDS['latitude']), np.radians(HEILBRONN_COORDS['longitude'])
+    # Haversine: the extracted sensors can sit in another country, not just across town
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2
+    distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+    nearest = int(np.argmin(distance_km))
+    if distance_km[nearest] > ALIGN_MAX_DISTANCE_KM:
+        return forecaster, None, float(distance_km[nearest])
+    return forecaster, locations['imei'].iloc[nearest], float(distance_km[nearest])
+
 @st.cache_data(ttl=3600)  # Cache for 1 hour (stats don't change often)
 def get_traffic_statistics():
     """
     Analyze historical traffic data to extract statistics like rush hour times,
     average traffic by hour, peak times, etc.
     """
+    metrics.cache_miss('traffic_statistics')
     try:
         data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
         if not os.path.exists(data_path):
@@ -380,9 +485,51 @@ def get_traffic_statistics():
             'weekend_avg': weekend_avg
         }
     except Exception as e:
+        metrics.increment('errors', stage='app.traffic_statistics')
         print(f"Error calculating statistics: {e}")
         return None
 
+@st.cache_resource(show_spinner=False)
+def load_nowcaster():
+    """
+    Shared nowcast state (residuals of recent slots), kept for the lifetime
+    of the server so each poll only fetches new readings.
+    """
+    metrics.cache_miss('nowcaster')
+    from nowcast import ResidualNowcaster
+    return ResidualNowcaster()
+
+@st.cache_resource(show_spinner=False)
+def load_sensor_monitor():
+    """
+    Shared streaming anomaly detector for the incoming traffic feed.
+    """
+    metrics.cache_miss('sensor_monitor')
+    from anomaly import SensorMonitor
+    return SensorMonitor()
+
+@st.cache_data(ttl=900, show_spinner=False)
+def poll_traffic_feed(current_15min_key, _forecaster, device_imei):
+    """
+    Feed the nowcaster from the incremental traffic feed, once per 15-minute
+    window (a slot only completes at the quarter-hour anyway).
+    Readings pass the anomaly detector first; flagged slots are skipped.
+    Returns the number of slots consumed.
+    """
+    metrics.cache_miss('traffic_feed')
+    metrics.cache_lookup('sensor_monitor')
+    return load_nowcaster().poll(_forecaster, device_imei, monitor=load_sensor_monitor())
+
+def apply_nowcast(prediction, forecaster, current_15min_key):
+    """Correct a base prediction with the latest measured traffic (O(1) per request)."""
+    if not NOWCAST_ENABLED or not prediction or forecaster is None:
+        return prediction
+    device_imei = str(forecaster.device_imei)
+    metrics.cache_lookup('traffic_feed')
+    poll_traffic_feed(current_15min_key, forecaster, device_imei)
+    metrics.cache_lookup('nowcaster')
+    return load_nowcaster().correct(prediction, device_imei)
+
 @st.cache_data(ttl=900)  # Cache for 15 minutes (900 seconds) for faster updates
 def get_cached_predictions(current_15min_key, minutes_ahead, model_version=None):
     """
@@ -391,13 +538,35 @@ def get_cached_predictions(current_15min_key, minutes_ahead, model_version=None)
     minutes_ahead: How many minutes ahead to predict (used as part of cache key).
     model_version helps bust cache when model is retrained.
     """
+    metrics.cache_miss('predictions')
     # Use model file modification time as version to bust cache on retrain
     import os
     model_version = os.path.getmtime(MODEL_PATH) if os.path.exists(MODEL_PATH) else 0
+
+    # Fast path: serve from the forecast table if it was built from the current model
+    if os.path.exists(FORECAST_TABLE_PATH) and os.path.getmtime(FORECAST_TABLE_PATH) >= model_version:
+        metrics.cache_lookup('forecast_table')
+        table = load_forecast_table(_table_version=os.path.getmtime(FORECAST_TABLE_PATH))
+        if table:
+            prediction = table.get_current_prediction(include_directions=True, minutes_ahead=minutes_ahead)
+            if prediction:
+                return apply_nowcast(prediction, table, current_15min_key)
+
+    metrics.cache_lookup('traffic_model')
     predictor = load_traffic_model(_model_version=model_version)
     if predictor:
         # Always try to include directions if available
-        return predictor.get_current_prediction(include_directions=True, minutes_ahead=minutes_ahead)
+        prediction = predictor.get_current_prediction(include_directions=True, minutes_ahead=minutes_ahead)
+        if prediction:
+            return apply_nowcast(prediction, predictor, current_15min_key)
+
+    # Prophet unavailable or failed: fall back to the NumPy seasonal baseline
+    metrics.increment('fallbacks', path='seasonal_baseline')
+    metrics.cache_lookup('baseline_model')
+    baseline = load_baseline_model(_model_version=model_version)
+    if baseline:
+        prediction = baseline.get_current_prediction(include_directions=True, minutes_ahead=minutes_ahead)
+        return apply_nowcast(prediction, baseline, current_15min_key)
     return None
 
 # ============================================================================
@@ -507,6 +676,7 @@ if os.path.exists(MODEL_PATH):
         # Only make predictions if the selected time is in the future
         if prediction_minutes_ahead >= 0:
             with st.spinner("🤖 Loading AI predictions..."):
+                metrics.cache_lookup('predictions')
                 current_pred = get_cached_predictions(current_15min_key, prediction_minutes_ahead, model_version=model_version)
         else:
             current_pred = None
@@ -679,6 +849,16 @@ if os.path.exists(MODEL_PATH):
                 if direction_ratio > 2:
                     st.warning(f"⚠️ **Direction Imbalance Detected**: One direction has {direction_ratio:.1f}x more traffic than the other. Consider adjusting light timing to balance flow and reduce congestion.")
 
+                # Webster signal plan for the forecast directional flows
+                plan = webster_timing(tr1_per_min * 60, tr2_per_min * 60)
+                plan_text = (f"🚦 **Recommended signal plan**: cycle {plan['cycle']:.0f}s | "
+                             f"Direction 1 green {plan['green_1']:.0f}s | Direction 2 green {plan['green_2']:.0f}s | "
+                             f"Degree of saturation {plan['saturation_1']:.2f} / {plan['saturation_2']:.2f}")
+                if plan['oversaturated']:
+                    st.warning(plan_text + " - demand exceeds junction capacity, running the maximum cycle")
+                else:
+                    st.info(plan_text)
+
             # Show success message
             if has_directions:
                 st.success(
@@ -692,9 +872,11 @@ if os.path.exists(MODEL_PATH):
                 )
             st.markdown("---")
         else:
+            metrics.increment('fallbacks', path='no_prediction')
             st.warning("⚠️ AI model loaded but could not generate predictions.")
             st.markdown("---")
     except Exception as e:
+        metrics.increment('errors', stage='app.predictions')
         st.warning(f"⚠️ Could not load AI predictions: {str(e)[:100]}")
         st.markdown("---")
 else:
@@ -708,6 +890,7 @@ if os.path.exists(MODEL_PATH):
     st.markdown("---")
     st.markdown("### 📊 Traffic Statistics & Patterns")
 
+    metrics.cache_lookup('traffic_statistics')
     stats = get_traffic_statistics()
 
     if stats:
@@ -769,6 +952,28 @@ if os.path.exists(MODEL_PATH):
     else:
         st.info("📊 Statistics will be available once data is loaded.")
 
+# ----------------------------------------------------------------------------
+# TRAFFIC HISTORY (multi-resolution rollups)
+# ----------------------------------------------------------------------------
+rollup_manifest = os.path.join(COLUMNAR_CACHE_PATH, 'traffic_rollup_15min', 'manifest.json')
+if os.path.exists(rollup_manifest):
+    metrics.cache_lookup('rollups')
+    rollup_store = load_rollups(os.path.getmtime(rollup_manifest))
+    history_range = st.select_slider(
+        "📉 Traffic history range",
+        options=['1 hour', '1 day', '1 week', '1 month', '1 year'],
+        value='1 week'
+    )
+    span = {'1 hour': timedelta(hours=1), '1 day': timedelta(days=1), '1 week': timedelta(weeks=1),
+            '1 month': timedelta(days=30), '1 year': timedelta(days=365)}[history_range]
+    history_device = rollup_store.devices()[0]
+    history_end = rollup_store.time_range(history_device)[1]
+    history = rollup_store.query(history_device, history_end - span, history_end)
+    if history is not None and len(history) > 0:
+        st.line_chart(history.set_index('ds')[['min', 'mean', 'max']], use_container_width=True)
+        st.caption(f"Vehicles per 15 minutes - {history.attrs['level']} rollup, {len(history)} points "
+                   f"(min/max envelope preserves peaks)")
+
 # ============================================================================
 # FUTURE SYSTEM DEMONSTRATION VIDEO
 # ============================================================================
@@ -885,7 +1090,15 @@ with col1:
 
     # Instantiate the logic engine
     intersection = SmartIntersection("Heilbronn Center", capacity_threshold=capacity_threshold)
-    status = intersection.decide(sim_traffic, sim_aqi)
+
+    # Predicted exceedances reroute before PM10 becomes hazardous
+    predicted_aqi, aq_forecaster, aq_device, aq_distance_km = None, None, None, None
+    if os.path.exists(AQ_FORECAST_TABLE_PATH):
+        aq_forecaster, aq_device, aq_distance_km = load_aq_forecaster(
+            _table_version=os.path.getmtime(AQ_FORECAST_TABLE_PATH))
+        if aq_device is not None:
+            predicted_aqi = aq_forecaster.peak_pm10(aq_device)
+    status = intersection.decide(sim_traffic, sim_aqi, predicted_aqi=predicted_aqi)
     action = intersection.get_action_description()
 
     # Display status with appropriate styling
@@ -897,7 +1110,7 @@ with col1:
             <p style="font-size: 1.2rem; margin: 0.5rem 0; color: #ffffff; font-weight: 500;">{action}</p>
             <hr style="border-color: rgba(255,255,255,0.4); margin: 1rem 0;">
             <p style="color: #ffffff; margin: 0.5rem 0;"><strong>Green Light:</strong> {intersection.green_light_duration}s</p>
-            <p style="color: #ffffff; margin: 0.5rem 0;"><strong>Reason:</strong> Air pollution has reached hazardous levels</p>
+            <p style="color: #ffffff; margin: 0.5rem 0;"><strong>Reason:</strong> {intersection.decision_history[-1]['reason']}</p>
             <p style="color: #ffffff; margin: 0.5rem 0;"><strong>Action:</strong> Digital road signs directing traffic to alternate routes</p>
         </div>
         """, unsafe_allow_html=True)
@@ -952,6 +1165,14 @@ with col2:
         delta=f"{aqi_delta:+.0f} to limit",
         delta_color="normal"
     )
+    if predicted_aqi is not None:
+        st.caption(f"🔮 PM10 forecast peak (next hour, sensor {aq_device}, {aq_distance_km:.1f} km away): "
+                   f"{predicted_aqi:.1f} µg/m³")
+    elif aq_distance_km is not None:
+        st.caption(f"🔮 PM10 forecast not used: the nearest air quality sensor is {aq_distance_km:.0f} km away "
+                   f"(another city, limit {ALIGN_MAX_DISTANCE_KM:.0f} km)")
+    elif aq_forecaster is not None:
+        st.caption("🔮 PM10 forecast not used: air quality sensor locations are unknown")
 
     # Health impact indicator
     st.markdown(f"""
@@ -979,6 +1200,7 @@ def get_german_sensor_location():
     Get the actual GPS coordinates of the German sensor from the database.
     Falls back to known location coordinates if GPS not available in database.
     """
+    metrics.cache_miss('sensor_location')
     GERMAN_IMEI = "865583044299336"
 
     # Known coordinates for locations mentioned in database
@@ -987,9 +1209,24 @@ def get_german_sensor_location():
         'longitude': 9.6806
     }
 
+    try:
+        # Imported lazily - the DB driver is only needed on a cache miss
+        import psycopg2
+    except ImportError:
+        # Database driver not installed
+        metrics.increment('fallbacks', path='sensor_location_db_unavailable')
+        return {
+            'latitude': HEILBRONN_COORDS['latitude'],
+            'longitude': HEILBRONN_COORDS['longitude'],
+            'friendly_name': None,
+            'location_name': None,
+            'source': 'fallback'
+        }
+
     try:
         from config import DB_CONFIG
-        conn = psycopg2.connect(**DB_CONFIG)
+        with metrics.timed('db.connect'):
+            conn = psycopg2.connect(**DB_CONFIG)
 
         query = """
         SELECT
@@ -1003,7 +1240,8 @@ def get_german_sensor_location():
         WHERE imei = %s
         """
 
-        df = pd.read_sql(query, conn, params=(GERMAN_IMEI,))
+        with metrics.timed('db.query', query='sensor_location'):
+            df = pd.read_sql(query, conn, params=(GERMAN_IMEI,))
         conn.close()
 
         if len(df) > 0:
@@ -1029,6 +1267,7 @@ def get_german_sensor_location():
                 return location
             else:
                 # Device found but no location info
+                metrics.increment('fallbacks', path='sensor_location_no_gps')
                 return {
                     'latitude': HEILBRONN_COORDS['latitude'],
                     'longitude': HEILBRONN_COORDS['longitude'],
@@ -1038,6 +1277,7 @@ def get_german_sensor_location():
                 }
         else:
             # Device not found
+            metrics.increment('fallbacks', path='sensor_location_not_found')
             return {
                 'latitude': HEILBRONN_COORDS['latitude'],
                 'longitude': HEILBRONN_COORDS['longitude'],
@@ -1045,8 +1285,9 @@ def get_german_sensor_location():
                 'location_name': None,
                 'source': 'fallback'
             }
-    except (psycopg2.OperationalError, psycopg2.Error, ImportError):
+    except (psycopg2.OperationalError, psycopg2.Error):
         # Database not available or connection failed
+        metrics.increment('fallbacks', path='sensor_location_db_unavailable')
         return {
             'latitude': HEILBRONN_COORDS['latitude'],
             'longitude': HEILBRONN_COORDS['longitude'],
@@ -1054,8 +1295,10 @@ def get_german_sensor_location():
             'location_name': None,
             'source': 'fallback'
         }
-    except Exception:
+    except Exception as e:
         # Any other error
+        metrics.increment('errors', stage='app.sensor_location')
+        print(f"Error getting sensor location: {e}")
         return {
             'latitude': HEILBRONN_COORDS['latitude'],
             'longitude': HEILBRONN_COORDS['longitude'],
@@ -1074,6 +1317,7 @@ col_map1, col_map2 = st.columns([2, 1])
 
 with col_map1:
     # Get the actual German sensor location
+    metrics.cache_lookup('sensor_location')
     sensor_location = get_german_sensor_location()
 
     map_df = pd.DataFrame({
@@ -1111,6 +1355,74 @@ with col_map2:
     else:
         st.warning("⚠️ Using approximate location (database unavailable)")
 
+
+# ----------------------------------------------------------------------------
+# PM10 SURFACE (Italian air quality sensors)
+# ----------------------------------------------------------------------------
+stats_path = 'data_cache/air_quality_stats.csv'
+metrics.cache_lookup('pollution_surface')
+surface = load_pollution_surface(os.path.getmtime(stats_path) if os.path.exists(stats_path) else None)
+if surface is not None:
+    st.markdown("### 🌫️ PM10 Surface")
+    layer = surface.layer('latest')
+    st.map(layer, latitude='lat', longitude='lon', color='color', size=SPATIAL_GRID_RESOLUTION_M / 2, zoom=11)
+    st.caption(f"Inverse-distance interpolation of {len(surface.sensor_ids)} sensors "
+               f"({surface.shape[0]} x {surface.shape[1]} grid, {SPATIAL_GRID_RESOLUTION_M} m cells)")
+
+    from health import exposure_for_surface, load_population, LEVELS
+    exposure = exposure_for_surface(surface).report(surface.windows['latest']['values']).iloc[0]
+    weighting = "residents" if load_population() is not None else "city area"
+    shares = " | ".join(f"{level} {exposure[level] / exposure['covered']:.0%}"
+                        for level in LEVELS if exposure['covered'] > 0 and exposure[level] > 0)
+    st.caption(f"Share of {weighting} per health band: {shares} "
+               f"(weighted mean PM10 {exposure['population_weighted']:.1f} µg/m³)")
+
+# ============================================================================
+# DIAGNOSTICS PANEL
+# ============================================================================
+# Rendered last so it includes the timings recorded during this rerun
+with st.sidebar.expander("🩺 Diagnostics", expanded=False):
+    stage_rows = metrics.stage_summary()
+    if stage_rows:
+        st.markdown("**Stage latency**")
+        st.dataframe(
+            pd.DataFrame(stage_rows)[['stage', 'count', 'errors', 'avg_ms', 'p50_ms', 'p95_ms', 'max_ms']].round(2),
+            hide_index=True,
+            use_container_width=True
+        )
+    else:
+        st.caption("No timings recorded yet.")
+
+    cache_rows = metrics.cache_stats()
+    if cache_rows:
+        st.markdown("**Cache hit rate**")
+        st.dataframe(
+            pd.DataFrame([
+                {'cache': name, 'requests': entry['requests'], 'hits': entry['hits'],
+                 'misses': entry['misses'], 'hit_rate': f"{entry['hit_rate']:.0%}"}
+                for name, entry in sorted(cache_rows.items())
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+
+    if NOWCAST_ENABLED:
+        metrics.cache_lookup('sensor_monitor')
+        events = load_sensor_monitor().recent_events()
+        if len(events) > 0:
+            st.markdown("**Sensor anomalies**")
+            st.dataframe(events.tail(20).iloc[::-1], hide_index=True, use_container_width=True)
+
+    prometheus_text = metrics.to_prometheus()
+    st.download_button(
+        "⬇️ Prometheus metrics",
+        data=prometheus_text,
+        file_name="ecoflow_metrics.prom",
+        mime="text/plain"
+    )
+
+metrics.write_prometheus()
+
 # ============================================================================
 # FOOTER
 # ============================================================================
@@ -0,0 +1,385 @@
+"""
+Air Quality Forecasting for Project EcoFlow
+PM10 and PM2.5 forecasts per air quality device, with temperature and
+humidity as Prophet regressors. Devices are trained in a process pool and
+materialized into one fleet forecast table, so the decision layer can check
+predicted exceedances 15-60 minutes ahead for every sensor with a single
+array lookup - instead of reacting once the air is already hazardous.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    AQ_POLLUTANTS,
+    AQ_REGRESSORS,
+    AQ_PROPHET_PARAMS,
+    AQ_FIT_MODE,
+    AQ_REGRESSOR_PROFILE_DAYS,
+    AQ_MIN_TRAINING_DAYS,
+    AQ_FORECAST_TABLE_PATH,
+    AQ_FORECAST_TABLE_DAYS,
+    AQ_FORECAST_HORIZONS,
+    AQ_WORKERS,
+    EMERGENCY_PM10_THRESHOLD,
+    EMERGENCY_PM25_THRESHOLD,
+    INTERVAL_METHOD
+)
+from metrics import timed, increment
+from intervals import ResidualIntervals, SAMPLING_METHODS
+
+SLOT_MINUTES = 15
+SLOT = timedelta(minutes=SLOT_MINUTES)
+COLUMNS = ('yhat', 'yhat_lower', 'yhat_upper')
+THRESHOLDS = {'pm10': EMERGENCY_PM10_THRESHOLD, 'pm25': EMERGENCY_PM25_THRESHOLD}
+
+_worker_frames = None
+
+
+def prepare_device_frame(df):
+    """
+    Regular 15-minute frame for one device with gap-filled regressors.
+    Pollutant gaps stay NaN (Prophet skips them); regressor gaps are
+    interpolated over short stretches, then filled from the hour-of-day mean.
+
+    Parameters:
+    - df: Rows of get_air_quality_data() for one device
+
+    Returns:
+    - DataFrame with ds, the pollutant columns and the regressor columns
+    """
+    frame = df.assign(ds=pd.to_datetime(df['ds_15min']).dt.tz_localize(None))
+    frame = frame.groupby('ds')[[*AQ_POLLUTANTS.values(), *AQ_REGRESSORS]].mean()
+    frame = frame.reindex(pd.date_range(frame.index.min(), frame.index.max(), freq='15min'))
+    frame.index.name = 'ds'
+
+    hour = frame.index.hour
+    for column in AQ_REGRESSORS:
+        filled = frame[column].interpolate(limit=8, limit_area='inside')
+        profile = filled.groupby(hour).mean()
+        filled = filled.fillna(pd.Series(profile.reindex(hour).to_numpy(), index=frame.index))
+        frame[column] = filled.fillna(filled.mean() if filled.notna().any() else 0.0)
+    return frame.reset_index()
+
+
+def regressor_profile(history, ds):
+    """
+    Future regressor values: hour-of-day means over the last
+    AQ_REGRESSOR_PROFILE_DAYS days (no weather forecast is available).
+
+    Parameters:
+    - history: Frame from prepare_device_frame()
+    - ds: Timestamps to fill
+
+    Returns:
+    - DataFrame with ds and the regressor columns
+    """
+    recent = history[history['ds'] > history['ds'].max() - timedelta(days=AQ_REGRESSOR_PROFILE_DAYS)]
+    ds = pd.DatetimeIndex(ds)
+    future = pd.DataFrame({'ds': ds})
+    for column in AQ_REGRESSORS:
+        profile = recent.groupby(recent['ds'].dt.hour)[column].mean().reindex(range(24))
+        profile = profile.fillna(recent[column].mean())
+        future[column] = profile.to_numpy()[ds.hour]
+    return future
+
+
+def fit_device(history, mode=None):
+    """
+    Fit one model per pollutant on log1p concentrations (keeps forecasts
+    positive and tames the heavy right tail of PM readings).
+
+    Parameters:
+    - history: Frame from prepare_device_frame()
+    - mode: Fit mode from FIT_MODES (default: AQ_FIT_MODE)
+
+    Returns:
+    - dict of pollutant -> (Prophet model, ResidualIntervals)
+    """
+    from model import fit_prophet
+
+    fitted = {}
+    for pollutant, column in AQ_POLLUTANTS.items():
+        train = history[['ds', *AQ_REGRESSORS]].assign(y=np.log1p(history[column].clip(lower=0)))
+        train = train.dropna(subset=['y'])
+        model = fit_prophet(train, params=AQ_PROPHET_PARAMS, series=pollutant, mode=mode or AQ_FIT_MODE,
+                            regressors=AQ_REGRESSORS)
+        model.uncertainty_samples = 0  # Bands come from the in-sample residuals
+
+        method = 'residual' if INTERVAL_METHOD in SAMPLING_METHODS else INTERVAL_METHOD
+        in_sample = model.predict(train[['ds', *AQ_REGRESSORS]])
+        intervals = ResidualIntervals(method=method).fit(train['ds'], train['y'], in_sample['yhat'])
+        fitted[pollutant] = (model, intervals)
+    return fitted
+
+
+def forecast_device(fitted, history, ds):
+    """
+    Forecast every pollutant of one device on a grid of timestamps.
+
+    Returns:
+    - dict of pollutant -> dict of yhat/yhat_lower/yhat_upper arrays (µg/m³)
+    """
+    future = regressor_profile(history, ds)
+    result = {}
+    for pollutant, (model, intervals) in fitted.items():
+        with timed('prophet.predict', series=pollutant):
+            yhat = model.predict(future)['yhat'].to_numpy()
+        lower, upper = intervals.apply(future['ds'], yhat)
+        result[pollutant] = {
+            'yhat': np.expm1(yhat).clip(min=0),
+            'yhat_lower': np.expm1(lower).clip(min=0),
+            'yhat_upper': np.expm1(upper).clip(min=0)
+        }
+    return result
+
+
+def _init_worker(frames):
+    """Give each pool worker the per-device frames once, not per task."""
+    global _worker_frames
+    _worker_frames = frames
+
+
+def _build_device(task):
+    """
+    Fit one device and materialize its forecast grid.
+    Only the arrays travel back to the parent - never the Prophet models.
+
+    Returns:
+    - (imei, dict of arrays or None, fit seconds, error message or None)
+    """
+    imei, start_value, periods, mode = task
+    history = _worker_frames[imei]
+    started = time.perf_counter()
+    try:
+        fitted = fit_device(history, mode=mode)
+        ds = pd.date_range(pd.Timestamp(start_value), periods=periods, freq=SLOT)
+        return imei, forecast_device(fitted, history, ds), time.perf_counter() - started, None
+    except Exception as e:
+        return imei, None, time.perf_counter() - started, str(e)
+
+
+def build_aq_forecast_table(frame, days=AQ_FORECAST_TABLE_DAYS, workers=AQ_WORKERS, mode=None):
+    """
+    Train every air quality device and materialize one fleet forecast table.
+
+    Parameters:
+    - frame: Output of get_air_quality_data() (all devices)
+    - days: Number of days to materialize
+    - workers: Process pool size (1 = run in this process)
+    - mode: Fit mode from FIT_MODES (default: AQ_FIT_MODE)
+
+    Returns:
+    - dict of arrays for forecast_table.save_forecast_table(); pollutant
+      arrays have shape (devices, slots)
+    """
+    frames = {}
+    for imei, group in frame.groupby(frame['imei'].astype(str)):
+        history = prepare_device_frame(group)
+        usable = history[AQ_POLLUTANTS['pm10']].notna().sum() * SLOT_MINUTES / (24 * 60)
+        if usable < AQ_MIN_TRAINING_DAYS:
+            increment('fallbacks', path='aq_insufficient_history')
+            print(f"   ⚠️  {imei}: only {usable:.1f} days of data, skipped")
+            continue
+        frames[imei] = history
+    if not frames:
+        raise ValueError("No air quality device has enough history to train")
+
+    # One shared grid for the fleet, starting after the newest reading
+    start = max(history['ds'].max() for history in frames.values()) + SLOT
+    periods = days * 24 * 60 // SLOT_MINUTES
+    tasks = [(imei, start.value, periods, mode) for imei in
+             sorted(frames, key=lambda imei: len(frames[imei]), reverse=True)]  # Largest first
+
+    print(f"\n🌫️  Training {len(tasks)} air quality devices ({len(AQ_POLLUTANTS)} pollutants each)...")
+    with timed('aq.build', devices=len(tasks)):
+        if workers == 1:
+            _init_worker(frames)
+            results = [_build_device(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(frames,)) as pool:
+                results = list(pool.map(_build_device, tasks, chunksize=1))
+
+    devices = []
+    arrays = {f'{p}_{c}': [] for p in AQ_POLLUTANTS for c in COLUMNS}
+    for imei, forecast, seconds, error in results:
+        if forecast is None:
+            increment('errors', stage='aq.fit')
+            print(f"   ❌ {imei}: {error}")
+            continue
+        devices.append(imei)
+        for pollutant in AQ_POLLUTANTS:
+            for column in COLUMNS:
+                arrays[f'{pollutant}_{column}'].append(forecast[pollutant][column].astype(np.float32))
+        print(f"   ✅ {imei}: {seconds:.1f}s, avg PM10 {forecast['pm10']['yhat'].mean():.1f} µg/m³")
+
+    table = {
+        'start': np.int64(start.value),
+        'slot_minutes': np.int64(SLOT_MINUTES),
+        'devices': np.array(devices),
+        'created': np.array(datetime.now().isoformat())
+    }
+    for key, rows in arrays.items():
+        table[key] = np.vstack(rows) if rows else np.empty((0, periods), dtype=np.float32)
+    return table
+
+
+class AirQualityForecaster:
+    """
+    Read-only view over the fleet air quality forecast table.
+    Lookups for any number of devices and horizons are one fancy index.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.slot = SLOT
+        self.devices = []
+        self.index = {}
+        self.values = {}
+        self.periods = 0
+        self.trained = False
+
+    def load(self, path=AQ_FORECAST_TABLE_PATH):
+        """
+        Load the fleet forecast table.
+
+        Returns:
+        - True if loaded, False otherwise
+        """
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with timed('aq_table.load'), np.load(path) as data:
+                self.start = pd.Timestamp(int(data['start']))
+                self.slot = timedelta(minutes=int(data['slot_minutes']))
+                self.devices = [str(d) for d in data['devices']]
+                self.values = {key: data[key] for key in data.files if key.startswith(tuple(AQ_POLLUTANTS))}
+            self.index = {device: i for i, device in enumerate(self.devices)}
+            self.periods = self.values['pm10_yhat'].shape[1]
+            self.trained = True
+            return True
+        except Exception as e:
+            increment('errors', stage='aq_table.load')
+            print(f"❌ Error loading air quality forecast table: {e}")
+            return False
+
+    def forecast_frame(self, pollutant, device, future):
+        """
+        Look up one device and pollutant for a frame of timestamps.
+
+        Returns:
+        - DataFrame with ds, yhat, yhat_lower, yhat_upper (NaN outside the table)
+        """
+        ds = pd.to_datetime(future['ds']).reset_index(drop=True)
+        idx = np.rint((ds - self.start) / self.slot).to_numpy()
+        valid = (idx >= 0) & (idx < self.periods)
+        safe = np.where(valid, idx, 0).astype(np.int64)
+        row = self.index[str(device)]
+        forecast = pd.DataFrame({'ds': ds})
+        for column in COLUMNS:
+            forecast[column] = np.where(valid, self.values[f'{pollutant}_{column}'][row, safe], np.nan)
+        return forecast
+
+    def predict_batch(self, minutes_ahead=AQ_FORECAST_HORIZONS, devices=None, now=None):
+        """
+        Forecasts for many devices and horizons at once.
+
+        Parameters:
+        - minutes_ahead: Iterable of horizons in minutes
+        - devices: Device IMEIs (default: every device in the table)
+        - now: Reference time (default: now)
+
+        Returns:
+        - DataFrame with device, minutes_ahead, ds and <pollutant>[_lower|_upper]
+          columns in µg/m³ (NaN where the horizon falls outside the table)
+        """
+        if not self.trained:
+            return None
+        now = pd.Timestamp(now or datetime.now()).replace(second=0, microsecond=0)
+        devices = self.devices if devices is None else [str(d) for d in devices]
+        horizons = np.asarray(list(minutes_ahead), dtype=np.int64)
+
+        with timed('aq_table.batch', devices=len(devices)):
+            known = np.array([d in self.index for d in devices], dtype=bool)
+            rows = np.array([self.index.get(d, 0) for d in devices], dtype=np.int64)
+            targets = now + pd.to_timedelta(horizons, unit='m')
+            idx = np.rint((targets - self.start) / self.slot).to_numpy().astype(np.int64)
+            valid = known[:, None] & ((idx >= 0) & (idx < self.periods))[None, :]
+            safe_idx = np.clip(idx, 0, self.periods - 1)
+
+            result = pd.DataFrame({
+                'device': np.repeat(devices, len(horizons)),
+                'minutes_ahead': np.tile(horizons, len(devices)),
+                'ds': np.tile((self.start + pd.to_timedelta(safe_idx * self.slot)).to_numpy(), len(devices))
+            })
+            for pollutant in AQ_POLLUTANTS:
+                for column, suffix in zip(COLUMNS, ('', '_lower', '_upper')):
+                    values = self.values[f'{pollutant}_{column}'][rows[:, None], safe_idx[None, :]]
+                    result[f'{pollutant}{suffix}'] = np.where(valid, values, np.nan).ravel()
+        return result
+
+    def predicted_exceedances(self, minutes_ahead=AQ_FORECAST_HORIZONS, devices=None, now=None):
+        """
+        Per-device peak forecast over the horizons and the first horizon at
+        which a pollutant is predicted above its emergency threshold.
+
+        Returns:
+        - DataFrame indexed by device with peak_<pollutant>, first_exceedance_minutes
+          (NaN if none) and exceeds
+        """
+        batch = self.predict_batch(minutes_ahead, devices=devices, now=now)
+        if batch is None:
+            return None
+        over = np.zeros(len(batch), dtype=bool)
+        for pollutant, threshold in THRESHOLDS.items():
+            over |= (batch[pollutant] > threshold).to_numpy()
+        batch['exceedance_minutes'] = np.where(over, batch['minutes_ahead'], np.nan)
+
+        grouped = batch.groupby('device', sort=False)
+        summary = grouped[list(AQ_POLLUTANTS)].max().add_prefix('peak_')
+        summary['first_exceedance_minutes'] = grouped['exceedance_minutes'].min()
+        summary['exceeds'] = summary['first_exceedance_minutes'].notna()
+        increment('aq_predicted_exceedances', amount=int(summary['exceeds'].sum()))
+        return summary
+
+    def peak_pm10(self, device, minutes_ahead=AQ_FORECAST_HORIZONS, now=None):
+        """
+        Highest PM10 forecast for one device over the horizons - the value
+        SmartIntersection.decide() takes as predicted_aqi (None if unknown).
+        """
+        if not self.trained or str(device) not in self.index:
+            return None
+        peak = self.predict_batch(minutes_ahead, devices=[device], now=now)['pm10'].max()
+        return None if pd.isna(peak) else float(peak)
+
+
+if __name__ == "__main__":
+    """
+    Train every air quality device and build the fleet forecast table
+    """
+    from config import AQ_DATA_MONTHS
+    from forecast_table import save_forecast_table
+
+    print("=" * 70)
+    print("🌫️  PROJECT ECOFLOW - AIR QUALITY FORECAST")
+    print("=" * 70)
+
+    data_path = f'data_cache/air_quality_{AQ_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Air quality data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the air quality data")
+        exit(1)
+
+    save_forecast_table(build_aq_forecast_table(pd.read_csv(data_path)), AQ_FORECAST_TABLE_PATH)
+
+    forecaster = AirQualityForecaster()
+    forecaster.load()
+    exceedances = forecaster.predicted_exceedances()
+    print(f"\n🔮 Predicted exceedances in the next {max(AQ_FORECAST_HORIZONS)} minutes: "
+          f"{int(exceedances['exceeds'].sum())} of {len(exceedances)} devices")
+    print(exceedances.to_string(float_format=lambda v: f"{v:.1f}"))
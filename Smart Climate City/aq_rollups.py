@@ -0,0 +1,321 @@
+"""
+Incremental Air Quality Rollups for Project EcoFlow
+Keeps per-device hourly and daily partial aggregates (sum, count, min, max)
+of PM10, PM2.5, temperature and humidity in a local SQLite store. Each
+refresh folds in only readings newer than the device's own watermark, so
+a sensor that uploads late is not skipped past; any window (1h,
+24h, 7d, 30d) and the WHO 24-hour means are answered by combining partials
+instead of re-scanning a month of airqsensordata.
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    AQ_ROLLUP_PATH,
+    AQ_ROLLUP_INITIAL_DAYS,
+    AQ_ROLLUP_HOURLY_RETENTION_DAYS,
+    AQ_ROLLUP_DAILY_RETENTION_DAYS,
+    WHO_PM10_LIMIT,
+    WHO_PM25_LIMIT
+)
+from metrics import timed, increment
+
+CHANNELS = ('p10', 'p02', 'tmp', 'hum')
+PARTS = ('sum', 'count', 'min', 'max')
+PARTIAL_COLUMNS = [f'{c}_{p}' for c in CHANNELS for p in PARTS]
+LEVELS = {'hourly': 3600, 'daily': 86400}
+MERGE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}  # How partials combine
+
+
+def _epoch(timestamps):
+    """Naive timestamps -> integer seconds since the epoch."""
+    return (pd.to_datetime(timestamps).to_numpy().astype('datetime64[s]').astype(np.int64))
+
+
+def partials_from_readings(df):
+    """
+    Hourly partials from raw readings (timestamp, imei, p10, p02, tmp, hum) -
+    the same shape get_air_quality_partials() returns from the database.
+    """
+    ds = pd.to_datetime(df['timestamp'])
+    if ds.dt.tz is not None:
+        ds = ds.dt.tz_localize(None)
+    keys = [df['imei'].astype(str).rename('imei'), ds.dt.floor('h').rename('hour')]
+    grouped = df[list(CHANNELS)].groupby(keys)
+    partials = pd.concat([grouped.agg(part).add_suffix(f'_{part}') for part in PARTS], axis=1)
+    partials['last_timestamp'] = ds.groupby(keys).max()
+    return partials[PARTIAL_COLUMNS + ['last_timestamp']].reset_index()
+
+
+class AirQualityRollups:
+    """
+    Local store of mergeable partial aggregates.
+    Sums and counts add, minima and maxima take the min/max, so a partial
+    for the hour in progress is simply merged again on the next refresh.
+    """
+
+    def __init__(self, path=AQ_ROLLUP_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = ', '.join(f'{c} REAL' for c in PARTIAL_COLUMNS)
+        with self.conn:
+            for level in LEVELS:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {level} "
+                                  f"(imei TEXT, bucket INTEGER, {columns}, PRIMARY KEY (imei, bucket))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS watermarks (imei TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS devices "
+                              "(imei TEXT PRIMARY KEY, location_name TEXT, latitude REAL, longitude REAL)")
+
+    # ------------------------------------------------------------------
+    # Folding
+    # ------------------------------------------------------------------
+    def watermark(self, device=None):
+        """
+        Timestamp of the newest reading folded in (None if empty).
+
+        Parameters:
+        - device: Only this device's readings (None = newest of all devices)
+        """
+        if device is not None:
+            row = self.conn.execute("SELECT value FROM watermarks WHERE imei = ?", (str(device),)).fetchone()
+            return None if row is None else pd.Timestamp(row[0])
+        marks = [value for (value,) in self.conn.execute(
+            "SELECT MAX(value) FROM watermarks UNION ALL SELECT value FROM state WHERE key = 'watermark'")
+            if value is not None]
+        return pd.Timestamp(max(marks)) if marks else None
+
+    def device_watermarks(self):
+        """dict of imei -> timestamp of its newest reading folded in."""
+        return {imei: pd.Timestamp(value) for imei, value in self.conn.execute("SELECT imei, value FROM watermarks")}
+
+    def fold(self, partials):
+        """
+        Merge hourly partials into the hourly and daily tables.
+
+        Parameters:
+        - partials: DataFrame from get_air_quality_partials() or partials_from_readings()
+
+        Returns:
+        - Number of hourly partials folded in
+        """
+        if partials is None or len(partials) == 0:
+            return 0
+        partials = partials.copy()
+        hours = pd.to_datetime(partials['hour'])
+        if hours.dt.tz is not None:
+            hours = hours.dt.tz_localize(None)
+        partials['imei'] = partials['imei'].astype(str)
+
+        merge = ', '.join(
+            f"{c} = {c} + excluded.{c}" if c.endswith(('_sum', '_count')) else
+            f"{c} = {'MIN' if c.endswith('_min') else 'MAX'}(COALESCE({c}, excluded.{c}), COALESCE(excluded.{c}, {c}))"
+            for c in PARTIAL_COLUMNS
+        )
+        placeholders = ', '.join('?' * (len(PARTIAL_COLUMNS) + 2))
+
+        with timed('aq_rollups.fold', rows=len(partials)), self.conn:
+            for level, seconds in LEVELS.items():
+                frame = partials.assign(bucket=_epoch(hours) // seconds * seconds)
+                if level != 'hourly':
+                    frame = frame.groupby(['imei', 'bucket'])[PARTIAL_COLUMNS].agg(
+                        {c: MERGE[c.rsplit('_', 1)[1]] for c in PARTIAL_COLUMNS}).reset_index()
+                frame = frame[['imei', 'bucket'] + PARTIAL_COLUMNS]
+                for c in PARTIAL_COLUMNS:
+                    if c.endswith(('_sum', '_count')):
+                        frame[c] = frame[c].fillna(0)
+                rows = frame.astype(object).where(frame.notna(), None)
+                self.conn.executemany(
+                    f"INSERT INTO {level} (imei, bucket, {', '.join(PARTIAL_COLUMNS)}) VALUES ({placeholders}) "
+                    f"ON CONFLICT (imei, bucket) DO UPDATE SET {merge}",
+                    rows.itertuples(index=False, name=None)
+                )
+
+            last = pd.to_datetime(partials['last_timestamp'])
+            if last.dt.tz is not None:
+                last = last.dt.tz_localize(None)
+            newest = last.groupby(partials['imei']).max()
+            self.conn.executemany(
+                "INSERT INTO watermarks VALUES (?, ?) ON CONFLICT (imei) DO UPDATE SET value = "
+                "MAX(value, excluded.value)",
+                [(imei, ts.isoformat()) for imei, ts in newest.items()]
+            )
+            self._prune(newest.max())
+
+        increment('aq_rollup_partials', amount=len(partials))
+        return len(partials)
+
+    def _prune(self, now):
+        for level, days in (('hourly', AQ_ROLLUP_HOURLY_RETENTION_DAYS), ('daily', AQ_ROLLUP_DAILY_RETENTION_DAYS)):
+            cutoff = int(_epoch([now - timedelta(days=days)])[0])
+            self.conn.execute(f"DELETE FROM {level} WHERE bucket < ?", (cutoff,))
+
+    def refresh(self):
+        """
+        Fold in each device's readings newer than its own watermark (devices
+        seen for the first time load AQ_ROLLUP_INITIAL_DAYS of history) and
+        update the device locations.
+
+        Returns:
+        - Number of hourly partials folded in (None if the database is unreachable)
+        """
+        from data_extraction import get_air_quality_partials, get_device_locations
+
+        # Stores from before per-device watermarks keep their global one for devices without their own
+        row = self.conn.execute("SELECT value FROM state WHERE key = 'watermark'").fetchone()
+        since = pd.Timestamp(row[0]) if row else datetime.now() - timedelta(days=AQ_ROLLUP_INITIAL_DAYS)
+        partials = get_air_quality_partials(since, device_since=self.device_watermarks())
+        if partials is None:
+            increment('fallbacks', path='aq_rollups_db_unavailable')
+            return None
+        locations = get_device_locations()
+        if locations is not None:
+            rows = locations[['imei', 'location_name', 'latitude', 'longitude']].assign(
+                imei=locations['imei'].astype(str))
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?)",
+                                      rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None))
+        return self.fold(partials)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def _partials(self, start, end):
+        """
+        Partials covering [start, end): daily buckets for whole days inside
+        the window, hourly buckets for the ragged edges.
+        """
+        start_s, end_s = int(_epoch([start])[0]) // 3600 * 3600, int(_epoch([end])[0])
+        first_day = -(-start_s // 86400) * 86400
+        last_day = end_s // 86400 * 86400
+        columns = ', '.join(['imei'] + PARTIAL_COLUMNS)
+        if last_day - first_day >= 86400:
+            query = (f"SELECT {columns} FROM daily WHERE bucket >= :first AND bucket < :last "
+                     f"UNION ALL SELECT {columns} FROM hourly WHERE bucket >= :start AND bucket < :end "
+                     f"AND (bucket < :first OR bucket >= :last)")
+        else:
+            query = f"SELECT {columns} FROM hourly WHERE bucket >= :start AND bucket < :end"
+        params = {'start': start_s, 'end': end_s, 'first': first_day, 'last': last_day}
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def window(self, hours, now=None):
+        """
+        Aggregates per device over the last `hours` hours.
+
+        Returns:
+        - DataFrame indexed by imei with <column>_mean/_min/_max and readings
+        """
+        end = pd.Timestamp(now or self.watermark() or datetime.now()).floor('h') + timedelta(hours=1)
+        with timed('aq_rollups.window', hours=hours):
+            partials = self._partials(end - timedelta(hours=hours), end)
+            grouped = partials.groupby('imei')
+            sums = grouped[[f'{c}_sum' for c in CHANNELS]].sum().to_numpy()
+            counts = grouped[[f'{c}_count' for c in CHANNELS]].sum().to_numpy()
+            result = pd.DataFrame(index=grouped.size().index)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.where(counts > 0, sums / counts, np.nan)
+            for i, c in enumerate(CHANNELS):
+                result[f'{c}_mean'] = means[:, i]
+                result[f'{c}_min'] = grouped[f'{c}_min'].min()
+                result[f'{c}_max'] = grouped[f'{c}_max'].max()
+            result['readings'] = counts[:, 0].astype(np.int64)
+        return result
+
+    def statistics(self, hours=30 * 24, now=None):
+        """
+        Drop-in replacement for get_air_quality_statistics(), answered from
+        the rollups (same columns plus imei, sorted by average PM10).
+        """
+        stats = self.window(hours, now=now)
+        devices = pd.read_sql_query("SELECT * FROM devices", self.conn).set_index('imei')
+        stats = stats.join(devices, how='inner' if len(devices) else 'left')
+        result = pd.DataFrame({
+            'location_name': stats.get('location_name'),
+            'latitude': stats.get('latitude'),
+            'longitude': stats.get('longitude'),
+            'reading_count': stats['readings'],
+            'avg_pm10': stats['p10_mean'],
+            'max_pm10': stats['p10_max'],
+            'avg_pm25': stats['p02_mean'],
+            'max_pm25': stats['p02_max'],
+            'avg_temp': stats['tmp_mean'],
+            'avg_humidity': stats['hum_mean']
+        })
+        return result[result['avg_pm10'].notna()].sort_values('avg_pm10', ascending=False).reset_index()
+
+    def who_status(self, now=None):
+        """
+        Rolling 24-hour means against the WHO daily limits (24 hourly partials
+        per device, so this is cheap enough to run on every refresh).
+
+        Returns:
+        - DataFrame indexed by imei with pm10_24h, pm25_24h, pm10_exceeds, pm25_exceeds
+        """
+        day = self.window(24, now=now)
+        return pd.DataFrame({
+            'pm10_24h': day['p10_mean'],
+            'pm25_24h': day['p02_mean'],
+            'pm10_exceeds': day['p10_mean'] > WHO_PM10_LIMIT,
+            'pm25_exceeds': day['p02_mean'] > WHO_PM25_LIMIT
+        })
+
+    def exceedance_days(self, days=30, now=None):
+        """
+        Days in the last `days` whose daily mean exceeded the WHO limits
+        (from the daily partials only).
+
+        Returns:
+        - DataFrame indexed by imei with pm10_days, pm25_days, days_observed
+        """
+        end = pd.Timestamp(now or self.watermark() or datetime.now()).floor('D') + timedelta(days=1)
+        start = int(_epoch([end - timedelta(days=days)])[0])
+        daily = pd.read_sql_query(
+            "SELECT imei, p10_sum, p10_count, p02_sum, p02_count FROM daily WHERE bucket >= ? AND bucket < ?",
+            self.conn, params=(start, int(_epoch([end])[0]))
+        )
+        with np.errstate(invalid='ignore', divide='ignore'):
+            daily['pm10_exceeds'] = daily['p10_sum'] / daily['p10_count'] > WHO_PM10_LIMIT
+            daily['pm25_exceeds'] = daily['p02_sum'] / daily['p02_count'] > WHO_PM25_LIMIT
+        grouped = daily.groupby('imei')
+        return pd.DataFrame({
+            'pm10_days': grouped['pm10_exceeds'].sum(),
+            'pm25_days': grouped['pm25_exceeds'].sum(),
+            'days_observed': grouped.size()
+        })
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    """
+    Refresh the rollups and print the WHO status per device
+    """
+    print("=" * 70)
+    print("🌫️  PROJECT ECOFLOW - AIR QUALITY ROLLUPS")
+    print("=" * 70)
+
+    rollups = AirQualityRollups()
+    folded = rollups.refresh()
+    if folded is None:
+        print("\n❌ Database unavailable - showing the rollups already stored")
+    else:
+        print(f"\n✅ Folded {folded:,} hourly partials (watermark: {rollups.watermark()})")
+
+    stats = rollups.statistics()
+    if len(stats) == 0:
+        print("⚠️  No air quality data in the rollup store yet")
+        exit(1)
+    os.makedirs('data_cache', exist_ok=True)
+    stats.drop(columns='imei').to_csv('data_cache/air_quality_stats.csv', index=False)
+    print(f"💾 {len(stats)} locations saved to: data_cache/air_quality_stats.csv")
+
+    status = rollups.who_status()
+    print(f"\n📊 WHO 24-hour means: {int(status['pm10_exceeds'].sum())} devices over the PM10 limit, "
+          f"{int(status['pm25_exceeds'].sum())} over the PM2.5 limit")
+    print(status.round(1).to_string())
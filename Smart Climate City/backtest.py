@@ -0,0 +1,336 @@
+"""
+Backtesting Engine for Project EcoFlow
+Rolling-origin evaluation of the traffic models: fits one model per cutoff
+in a process pool (fitted models cached on disk), then scores MAE, MAPE and
+interval coverage per forecast horizon for total, TR1 and TR2
+"""
+
+import hashlib
+import os
+import pickle
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    BACKTEST_INITIAL_DAYS,
+    BACKTEST_PERIOD_DAYS,
+    BACKTEST_HORIZON_HOURS,
+    BACKTEST_WORKERS,
+    BACKTEST_CACHE_PATH,
+    BACKTEST_RESULTS_PATH,
+    PROPHET_PARAMS,
+    INTERVAL_METHOD,
+    INTERVAL_WIDTH,
+    INTERVAL_SAMPLES,
+    TRAINING_MODE,
+    FIT_MODES,
+    TRAINING_DATA_MONTHS
+)
+from metrics import timed
+from model import fit_prophet, fit_prophet_intervals, prophet_forecast
+
+SERIES_COLUMNS = {'total': 'total_traffic', 'tr1': 'tr1', 'tr2': 'tr2'}
+SLOT = timedelta(minutes=15)
+
+# Set once per worker process by _init_worker (avoids re-pickling the data per task)
+_worker_frame = None
+
+
+def generate_cutoffs(ds, initial_days=BACKTEST_INITIAL_DAYS, period_days=BACKTEST_PERIOD_DAYS,
+                     horizon_hours=BACKTEST_HORIZON_HOURS):
+    """
+    Rolling-origin cutoffs: the first after `initial_days` of history, then
+    every `period_days`, leaving a full horizon of data after the last one.
+
+    Parameters:
+    - ds: Timestamps of the 15-minute series
+
+    Returns:
+    - list of pandas Timestamps
+    """
+    start, end = pd.Timestamp(ds.min()), pd.Timestamp(ds.max())
+    first = start + timedelta(days=initial_days)
+    last = end - timedelta(hours=horizon_hours)
+    if first > last:
+        return []
+    return list(pd.date_range(first, last, freq=timedelta(days=period_days)))
+
+
+def data_fingerprint(frame):
+    """Content hash of the 15-minute training frame (part of the cache key)."""
+    digest = hashlib.sha1()
+    digest.update(frame['ds_15min'].to_numpy(dtype='datetime64[ns]').tobytes())
+    for column in SERIES_COLUMNS.values():
+        if column in frame.columns:
+            digest.update(frame[column].to_numpy(dtype=float).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _cache_path(cache_dir, fingerprint, kind, series, cutoff, params, mode):
+    key = hashlib.sha1(repr((fingerprint, kind, series, str(cutoff), sorted(params.items()),
+                             INTERVAL_METHOD, INTERVAL_WIDTH, INTERVAL_SAMPLES, mode,
+                             FIT_MODES[mode])).encode()).hexdigest()[:20]
+    return os.path.join(cache_dir, f"{kind}_{series}_{key}.pkl")
+
+
+def _fit(kind, train, params, series, mode):
+    """Fit one model on a ds/y frame (picklable, so it can be cached)."""
+    if kind == 'prophet':
+        model = fit_prophet(train, params=params, series=series, mode=mode)
+        intervals = fit_prophet_intervals(model, series=series)
+        return (model, intervals)
+    from baseline import SeasonalBaseline
+    return SeasonalBaseline().fit(train)
+
+
+def _forecast(kind, fitted, future, series):
+    if kind == 'prophet':
+        model, intervals = fitted
+        return prophet_forecast(model, intervals, future, series=series)
+    return fitted.predict(future)
+
+
+def _init_worker(frame):
+    global _worker_frame
+    _worker_frame = frame
+
+
+def _run_task(task):
+    """
+    Fit (or load from cache) one model at one cutoff and forecast the horizon.
+
+    Returns:
+    - dict with the task key, fit time (0 if cached) and yhat/lower/upper/actual
+      arrays on the horizon grid
+    """
+    kind, series, cutoff, horizon_slots, params, mode, cache_path = task
+    frame = _worker_frame
+    column = SERIES_COLUMNS[series]
+
+    fitted = None
+    fit_seconds = 0.0
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            fitted = pickle.load(f)
+    if fitted is None:
+        history = frame[frame['ds_15min'] <= cutoff]
+        train = pd.DataFrame({'ds': history['ds_15min'], 'y': history[column]}).dropna()
+        start = time.perf_counter()
+        fitted = _fit(kind, train, params, series, mode)
+        fit_seconds = time.perf_counter() - start
+        if cache_path:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(fitted, f)
+            os.replace(tmp_path, cache_path)
+
+    # Score on a regular grid so horizon h always means h x 15 minutes
+    grid = pd.date_range(cutoff + SLOT, periods=horizon_slots, freq=SLOT)
+    forecast = _forecast(kind, fitted, pd.DataFrame({'ds': grid}), series)
+    actual = frame.set_index('ds_15min')[column].reindex(grid).to_numpy(dtype=float)
+    return {
+        'kind': kind,
+        'series': series,
+        'cutoff': cutoff,
+        'fit_seconds': fit_seconds,
+        'yhat': forecast['yhat'].to_numpy(dtype=float),
+        'yhat_lower': forecast['yhat_lower'].to_numpy(dtype=float),
+        'yhat_upper': forecast['yhat_upper'].to_numpy(dtype=float),
+        'actual': actual
+    }
+
+
+def score(results):
+    """
+    Per-horizon MAE, MAPE and coverage, aggregated over cutoffs.
+
+    Parameters:
+    - results: list of dicts from _run_task
+
+    Returns:
+    - DataFrame with model, series, horizon_minutes, mae, mape, coverage, n
+    """
+    rows = []
+    groups = {}
+    for result in results:
+        groups.setdefault((result['kind'], result['series']), []).append(result)
+
+    for (kind, series), group in sorted(groups.items()):
+        actual = np.vstack([r['actual'] for r in group])      # cutoffs x horizon
+        yhat = np.vstack([r['yhat'] for r in group])
+        lower = np.vstack([r['yhat_lower'] for r in group])
+        upper = np.vstack([r['yhat_upper'] for r in group])
+
+        observed = np.isfinite(actual)
+        error = np.where(observed, np.abs(yhat - actual), np.nan)
+        # MAPE is undefined for empty intervals (night-time zeros)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ape = np.where(observed & (actual > 0), error / actual, np.nan)
+        covered = np.where(observed, (actual >= lower) & (actual <= upper), np.nan)
+
+        n = observed.sum(axis=0)
+        with warnings.catch_warnings():
+            # All-NaN horizons (missing data) are reported as NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mae = np.nanmean(error, axis=0)
+            mape = np.nanmean(ape, axis=0)
+            coverage = np.nanmean(covered, axis=0)
+
+        for h in range(actual.shape[1]):
+            rows.append({
+                'model': kind,
+                'series': series,
+                'horizon_minutes': (h + 1) * 15,
+                'mae': mae[h],
+                'mape': mape[h],
+                'coverage': coverage[h],
+                'n': int(n[h])
+            })
+    return pd.DataFrame(rows)
+
+
+def run_backtest(frame, kinds=('prophet',), series=('total', 'tr1', 'tr2'), params=None,
+                 horizon_hours=BACKTEST_HORIZON_HOURS, cutoffs=None, workers=BACKTEST_WORKERS,
+                 cache_dir=BACKTEST_CACHE_PATH, mode=None):
+    """
+    Run a rolling-origin backtest.
+
+    Parameters:
+    - frame: Clean 15-minute frame from preprocessing.load_clean_traffic()
+    - kinds: Model kinds to evaluate ('prophet', 'baseline')
+    - series: Series to evaluate ('total', 'tr1', 'tr2')
+    - params: Prophet parameter overrides (defaults: PROPHET_PARAMS)
+    - horizon_hours: Forecast horizon scored after each cutoff
+    - cutoffs: Explicit cutoffs (default: generate_cutoffs())
+    - workers: Process pool size (None = all cores, 1 = run inline)
+    - cache_dir: Directory for fitted models per cutoff (None disables caching)
+    - mode: Prophet fit mode from FIT_MODES (default: TRAINING_MODE)
+
+    Returns:
+    - (summary DataFrame from score(), list of raw results)
+    """
+    params = {**PROPHET_PARAMS, **(params or {})}
+    mode = mode or TRAINING_MODE
+    if cutoffs is None:
+        cutoffs = generate_cutoffs(frame['ds_15min'], horizon_hours=horizon_hours)
+    horizon_slots = int(horizon_hours * 4)
+    series = [s for s in series if SERIES_COLUMNS[s] in frame.columns]
+
+    fingerprint = data_fingerprint(frame)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    tasks = []
+    for kind in kinds:
+        for name in series:
+            for cutoff in cutoffs:
+                path = _cache_path(cache_dir, fingerprint, kind, name, cutoff, params, mode) if cache_dir else None
+                tasks.append((kind, name, cutoff, horizon_slots, params, mode, path))
+
+    print(f"\n🧪 Backtesting {len(tasks)} fits ({len(cutoffs)} cutoffs x {len(series)} series x {len(kinds)} models)...")
+    with timed('backtest.run', tasks=len(tasks)):
+        if workers == 1:
+            _init_worker(frame)
+            results = [_run_task(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(frame,)) as pool:
+                # Largest training sets first so the pool drains evenly
+                order = sorted(range(len(tasks)), key=lambda i: tasks[i][2], reverse=True)
+                ordered = pool.map(_run_task, [tasks[i] for i in order], chunksize=1)
+                results = [None] * len(tasks)
+                for i, result in zip(order, ordered):
+                    results[i] = result
+
+    return score(results), results
+
+
+def compare_fit_modes(frame, modes=None, series=('total',), cutoffs=None, workers=BACKTEST_WORKERS):
+    """
+    Time versus accuracy of each Prophet fit mode over the same cutoffs.
+    Runs uncached so every fit is actually timed.
+
+    Parameters:
+    - frame: Clean 15-minute frame from preprocessing.load_clean_traffic()
+    - modes: Fit modes to compare (default: all of FIT_MODES)
+    - series: Series to fit per cutoff
+    - cutoffs: Explicit cutoffs (default: generate_cutoffs())
+    - workers: Process pool size
+
+    Returns:
+    - DataFrame with mode, fit_seconds (mean per fit), mae, mape, coverage
+    """
+    rows = []
+    for mode in modes or FIT_MODES:
+        summary, results = run_backtest(frame, kinds=('prophet',), series=series, cutoffs=cutoffs,
+                                        workers=workers, cache_dir=None, mode=mode)
+        rows.append({
+            'mode': mode,
+            'fit_seconds': np.mean([r['fit_seconds'] for r in results]),
+            'mae': summary['mae'].mean(),
+            'mape': summary['mape'].mean(),
+            'coverage': summary['coverage'].mean()
+        })
+    report = pd.DataFrame(rows)
+    baseline = report['fit_seconds'].iloc[0]
+    report['speedup'] = baseline / report['fit_seconds']
+    return report
+
+
+def save_results(summary, results, path=BACKTEST_RESULTS_PATH):
+    """
+    Write the per-horizon summary as CSV and the raw forecasts as a compact
+    .npz next to it (float32 arrays, one row per model/series/cutoff).
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    summary.to_csv(path, index=False)
+
+    raw_path = os.path.splitext(path)[0] + '.npz'
+    np.savez_compressed(
+        raw_path,
+        model=np.array([r['kind'] for r in results]),
+        series=np.array([r['series'] for r in results]),
+        cutoff=np.array([np.datetime64(r['cutoff'], 'm') for r in results]),
+        **{key: np.vstack([r[key] for r in results]).astype(np.float32)
+           for key in ('yhat', 'yhat_lower', 'yhat_upper', 'actual')}
+    )
+    print(f"💾 Backtest summary saved to: {path}")
+    print(f"💾 Raw forecasts saved to: {raw_path}")
+
+
+if __name__ == "__main__":
+    """
+    Backtest Prophet and the seasonal baseline on the extracted training data
+    """
+    import sys
+    from preprocessing import load_clean_traffic
+
+    print("=" * 70)
+    print("🧪 PROJECT ECOFLOW - BACKTEST")
+    print("=" * 70)
+
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Training data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the training data")
+        exit(1)
+
+    frame = load_clean_traffic(pd.read_csv(data_path))
+
+    if sys.argv[1:] == ['--fit-modes']:
+        report = compare_fit_modes(frame)
+        print("\n⏱️  Fit time vs accuracy (mean over cutoffs and 15min-24h horizons):")
+        print(report.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        exit(0)
+
+    kinds = tuple(sys.argv[1:]) or ('prophet', 'baseline')
+    summary, results = run_backtest(frame, kinds=kinds)
+    save_results(summary, results)
+
+    # Headline numbers at common horizons
+    headline = summary[summary['horizon_minutes'].isin([15, 60, 240, 1440])]
+    print("\n📊 Accuracy by horizon:")
+    print(headline.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
@@ -0,0 +1,411 @@
+"""
+Seasonal Baseline Forecaster for Project EcoFlow
+A NumPy-only alternative to Prophet: day-of-week x 15-minute-slot profile (or
+harmonic regression) with an optional linear trend and empirical quantile
+bounds. Fits in milliseconds per device, so it serves as the fallback when
+Prophet is unavailable and as a first-tier model for large fleets
+"""
+
+import os
+import pickle
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    BASELINE_MODEL_PATH,
+    BASELINE_METHOD,
+    BASELINE_TREND,
+    BASELINE_HARMONICS,
+    BASELINE_INTERVAL_WIDTH,
+    TRAINING_DATA_MONTHS
+)
+from metrics import timed, increment
+from model import format_prediction, MAX_REASONABLE_15MIN
+from intervals import ResidualIntervals
+
+SLOTS_PER_DAY = 96
+SLOTS_PER_WEEK = 7 * SLOTS_PER_DAY
+
+
+def _calendar(ds):
+    """
+    Vectorized calendar features for an array of timestamps.
+
+    Returns:
+    - (minutes since epoch, slot of day 0-95, slot of week 0-671)
+    """
+    minutes = np.asarray(ds, dtype='datetime64[m]').astype(np.int64)
+    day = minutes // 1440
+    slot_of_day = (minutes % 1440) // 15
+    day_of_week = (day + 3) % 7  # 1970-01-01 was a Thursday; Monday = 0
+    return minutes, slot_of_day, day_of_week * SLOTS_PER_DAY + slot_of_day
+
+
+def _group_means(values, groups, size):
+    """Mean of values per group index (NaN for empty groups)."""
+    sums = np.bincount(groups, weights=values, minlength=size)
+    counts = np.bincount(groups, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+class SeasonalBaseline:
+    """
+    Single-series seasonal model with the minimal Prophet surface used in this
+    project: fit(df) with ds/y columns and predict(df) returning
+    ds, yhat, yhat_lower, yhat_upper.
+    """
+
+    def __init__(self, method=BASELINE_METHOD, trend=BASELINE_TREND,
+                 harmonics=BASELINE_HARMONICS, interval_width=BASELINE_INTERVAL_WIDTH):
+        """
+        Parameters:
+        - method: 'profile' (day-of-week x slot means) or 'harmonic' (Fourier regression)
+        - trend: Fit an additional linear trend
+        - harmonics: Fourier orders, e.g. {'daily': 8, 'weekly': 3} (harmonic method)
+        - interval_width: Coverage of the empirical bounds (0.8 = 10th-90th percentile)
+        """
+        if method not in ('profile', 'harmonic'):
+            raise ValueError(f"Unknown baseline method: {method}")
+        self.method = method
+        self.trend = trend
+        self.harmonics = dict(harmonics)
+        self.interval_width = interval_width
+        self.origin = None
+        self.history_end = None
+        self.season = None          # profile: 672 slot means
+        self.coef = None            # harmonic: regression coefficients
+        self.trend_coef = (0.0, 0.0)
+        self.intervals = None       # empirical residual quantiles per slot of day
+
+    def _design(self, minutes):
+        """Harmonic design matrix (intercept + daily and weekly Fourier terms)."""
+        days = (minutes - self.origin) / 1440.0
+        columns = [np.ones_like(days)]
+        for k in range(1, self.harmonics.get('daily', 0) + 1):
+            columns += [np.sin(2 * np.pi * k * days), np.cos(2 * np.pi * k * days)]
+        for k in range(1, self.harmonics.get('weekly', 0) + 1):
+            columns += [np.sin(2 * np.pi * k * days / 7), np.cos(2 * np.pi * k * days / 7)]
+        return np.column_stack(columns)
+
+    def _seasonal(self, minutes, slot_of_week):
+        if self.method == 'profile':
+            return self.season[slot_of_week]
+        return self._design(minutes) @ self.coef
+
+    def _trend(self, minutes):
+        days = (minutes - self.origin) / 1440.0
+        return self.trend_coef[0] + self.trend_coef[1] * days
+
+    def _fit_seasonal(self, minutes, slot_of_day, slot_of_week, y):
+        if self.method == 'profile':
+            season = _group_means(y, slot_of_week, SLOTS_PER_WEEK)
+            # Slots never observed: same time of day averaged over all weekdays
+            by_time_of_day = _group_means(y, slot_of_day, SLOTS_PER_DAY)
+            season = np.where(np.isnan(season), np.tile(by_time_of_day, 7), season)
+            self.season = np.where(np.isnan(season), y.mean(), season)
+        else:
+            self.coef, *_ = np.linalg.lstsq(self._design(minutes), y, rcond=None)
+
+    def fit(self, df):
+        """
+        Fit the model.
+
+        Parameters:
+        - df: DataFrame with 'ds' (datetime) and 'y' (value) columns; NaN y rows are ignored
+
+        Returns:
+        - self
+        """
+        y = df['y'].to_numpy(dtype=float)
+        valid = np.isfinite(y)
+        if not valid.any():
+            raise ValueError("No finite values to fit")
+        minutes, slot_of_day, slot_of_week = _calendar(df['ds'].to_numpy()[valid])
+        y = y[valid]
+
+        self.origin = minutes.min()
+        self.history_end = pd.Timestamp(minutes.max(), unit='m')
+        self.trend_coef = (0.0, 0.0)
+
+        # Alternate seasonal and trend estimation (two passes are plenty)
+        self._fit_seasonal(minutes, slot_of_day, slot_of_week, y)
+        if self.trend:
+            days = (minutes - self.origin) / 1440.0
+            for _ in range(2):
+                residual = y - self._seasonal(minutes, slot_of_week)
+                slope, intercept = np.polyfit(days, residual, 1)
+                self.trend_coef = (intercept, slope)
+                self._fit_seasonal(minutes, slot_of_day, slot_of_week, y - self._trend(minutes))
+
+        # Empirical bounds: residual quantiles per time of day
+        fitted = self._seasonal(minutes, slot_of_week) + self._trend(minutes)
+        self.intervals = ResidualIntervals('residual', self.interval_width).fit(
+            minutes.astype('datetime64[m]'), y, fitted
+        )
+        return self
+
+    def predict(self, df):
+        """
+        Predict for the timestamps in df['ds'].
+
+        Returns:
+        - DataFrame with ds, yhat, yhat_lower, yhat_upper
+        """
+        minutes, _, slot_of_week = _calendar(df['ds'].to_numpy())
+        yhat = self._seasonal(minutes, slot_of_week) + self._trend(minutes)
+        yhat_lower, yhat_upper = self.intervals.apply(df['ds'].to_numpy(), yhat)
+        return pd.DataFrame({
+            'ds': df['ds'].to_numpy(),
+            'yhat': yhat,
+            'yhat_lower': yhat_lower,
+            'yhat_upper': yhat_upper
+        })
+
+
+class SeasonalBaselinePredictor:
+    """
+    Drop-in replacement for TrafficPredictor backed by SeasonalBaseline models
+    for total traffic and each direction.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.model_tr1 = None
+        self.model_tr2 = None
+        self.trained = False
+        self.device_imei = None
+        self.use_directions = False
+        self.cap_15min = None  # Data-derived prediction cap (vehicles per 15 minutes)
+
+    def train(self, traffic_data_path, train_directions=True):
+        """
+        Train baseline models on historical traffic data.
+
+        Parameters:
+        - traffic_data_path: Path to CSV file with traffic data (from data_extraction.py)
+        - train_directions: If True, also train TR1 and TR2 models
+
+        Returns:
+        - True if training successful, False otherwise
+        """
+        try:
+            print(f"\n📂 Loading data from: {traffic_data_path}")
+            df = pd.read_csv(traffic_data_path)
+            self.device_imei = df['imei'].iloc[0] if 'imei' in df.columns else 'unknown'
+            from preprocessing import load_clean_traffic
+            return self.train_frame(load_clean_traffic(df), train_directions=train_directions)
+        except Exception as e:
+            increment('errors', stage='baseline.train')
+            print(f"❌ Error training baseline model: {e}")
+            return False
+
+    def train_frame(self, df_15min, train_directions=True):
+        """
+        Train on a clean 15-minute frame (preprocessing.load_clean_traffic()).
+
+        Returns:
+        - True if training successful
+        """
+        from preprocessing import data_derived_cap
+
+        ds = df_15min['ds_15min']
+        self.cap_15min = data_derived_cap(df_15min, ceiling=MAX_REASONABLE_15MIN)
+        with timed('baseline.fit', series='total'):
+            self.model = SeasonalBaseline().fit(pd.DataFrame({'ds': ds, 'y': df_15min['total_traffic']}))
+        self.trained = True
+
+        if train_directions and 'tr1' in df_15min.columns and 'tr2' in df_15min.columns:
+            with timed('baseline.fit', series='tr1'):
+                self.model_tr1 = SeasonalBaseline().fit(pd.DataFrame({'ds': ds, 'y': df_15min['tr1']}))
+            with timed('baseline.fit', series='tr2'):
+                self.model_tr2 = SeasonalBaseline().fit(pd.DataFrame({'ds': ds, 'y': df_15min['tr2']}))
+            self.use_directions = True
+
+        print(f"✅ Seasonal baseline trained on {df_15min['total_traffic'].notna().sum():,} 15-minute intervals "
+              f"({'with' if self.use_directions else 'without'} direction models)")
+        return True
+
+    def training_end(self):
+        """Return the timestamp of the last training interval."""
+        return self.model.history_end
+
+    def forecast_frame(self, series, future):
+        """
+        Run one series' model over a frame of timestamps.
+
+        Parameters:
+        - series: 'total', 'tr1' or 'tr2'
+        - future: DataFrame with a 'ds' column
+
+        Returns:
+        - DataFrame with ds, yhat, yhat_lower, yhat_upper
+        """
+        model = {'total': self.model, 'tr1': self.model_tr1, 'tr2': self.model_tr2}[series]
+        with timed('baseline.predict', series=series):
+            return model.predict(future)
+
+    def predict(self, hours_ahead=24):
+        """
+        Predict traffic volume for the N hours after the end of the training data.
+
+        Returns:
+        - pandas DataFrame with predictions (ds, yhat, yhat_lower, yhat_upper)
+        """
+        if not self.trained or self.model is None:
+            print("❌ Model not trained! Call train() first or load a saved model.")
+            return None
+
+        ds = pd.date_range(self.training_end() + timedelta(minutes=15), periods=hours_ahead * 4, freq='15min')
+        with timed('baseline.predict', series='total'):
+            return self.model.predict(pd.DataFrame({'ds': ds}))
+
+    def get_current_prediction(self, include_directions=False, minutes_ahead=15):
+        """
+        Get prediction for the next N minutes.
+
+        Parameters:
+        - include_directions: If True, also predict TR1 and TR2 separately
+        - minutes_ahead: Number of minutes to predict ahead (default 15 minutes)
+
+        Returns:
+        - Dictionary with prediction details (same keys as TrafficPredictor)
+        """
+        if not self.trained or self.model is None:
+            print("❌ Model not trained! Call train() first or load a saved model.")
+            return None
+
+        target_time = (datetime.now() + timedelta(minutes=minutes_ahead)).replace(second=0, microsecond=0)
+        future = pd.DataFrame({'ds': [pd.Timestamp(target_time).round('15min')]})
+
+        def row(model, series):
+            with timed('baseline.predict', series=series):
+                forecast = model.predict(future).iloc[0]
+            return forecast['yhat'], forecast['yhat_lower'], forecast['yhat_upper']
+
+        with_directions = (include_directions or self.use_directions) and self.model_tr1 is not None and self.model_tr2 is not None
+        return format_prediction(
+            future['ds'].iloc[0],
+            row(self.model, 'total'),
+            minutes_ahead,
+            tr1=row(self.model_tr1, 'tr1') if with_directions else None,
+            tr2=row(self.model_tr2, 'tr2') if with_directions else None,
+            cap=self.cap_15min
+        )
+
+    def save_model(self, path=BASELINE_MODEL_PATH):
+        """
+        Save all baseline models to a single file.
+
+        Parameters:
+        - path: File path to save the models
+        """
+        if not self.trained or self.model is None:
+            print("❌ No trained model to save!")
+            return False
+
+        try:
+            with open(path, 'wb') as f:
+                pickle.dump({
+                    'model': self.model,
+                    'model_tr1': self.model_tr1,
+                    'model_tr2': self.model_tr2,
+                    'device_imei': self.device_imei,
+                    'training_date': datetime.now(),
+                    'use_directions': self.use_directions,
+                    'cap_15min': self.cap_15min
+                }, f)
+            print(f"💾 Seasonal baseline saved to: {path}")
+            return True
+        except Exception as e:
+            increment('errors', stage='baseline.save')
+            print(f"❌ Error saving baseline: {e}")
+            return False
+
+    def load_model(self, path=BASELINE_MODEL_PATH):
+        """
+        Load baseline models from disk.
+
+        Parameters:
+        - path: File path to load the models from
+        """
+        if not os.path.exists(path):
+            print(f"❌ Model file not found: {path}")
+            return False
+
+        try:
+            with open(path, 'rb') as f, timed('model.load', series='baseline'):
+                data = pickle.load(f)
+            self.model = data['model']
+            self.model_tr1 = data.get('model_tr1')
+            self.model_tr2 = data.get('model_tr2')
+            self.device_imei = data.get('device_imei', 'unknown')
+            self.use_directions = data.get('use_directions', False)
+            self.cap_15min = data.get('cap_15min')  # Older pickles: fixed cap
+            self.trained = True
+            print(f"✅ Seasonal baseline loaded from: {path}")
+            return True
+        except Exception as e:
+            increment('errors', stage='baseline.load')
+            print(f"❌ Error loading baseline model: {e}")
+            return False
+
+
+def fit_fleet_predictors(df_15min, id_column='imei'):
+    """
+    One SeasonalBaselinePredictor (total, TR1, TR2 and data-derived cap) per
+    device from a long frame of 15-minute aggregates, e.g. the fleet extract.
+
+    Returns:
+    - dict: device id (str) -> trained SeasonalBaselinePredictor
+    """
+    predictors = {}
+    with timed('baseline.fit_fleet_predictors'):
+        for device, group in df_15min.groupby(id_column, sort=False):
+            predictor = SeasonalBaselinePredictor()
+            predictor.device_imei = str(device)
+            if predictor.train_frame(group.sort_values('ds_15min')):
+                predictors[str(device)] = predictor
+    return predictors
+
+
+if __name__ == "__main__":
+    """
+    Train the seasonal baseline and compare it against the last week of data
+    """
+    import time
+
+    print("=" * 70)
+    print("📐 PROJECT ECOFLOW - SEASONAL BASELINE")
+    print("=" * 70)
+
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Training data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the training data")
+        exit(1)
+
+    from preprocessing import load_clean_traffic
+    df_15min = load_clean_traffic(pd.read_csv(data_path))
+
+    # Holdout check: fit on everything but the last 7 days
+    cutoff = df_15min['ds_15min'].max() - timedelta(days=7)
+    train_part = df_15min[df_15min['ds_15min'] <= cutoff]
+    test_part = df_15min[df_15min['ds_15min'] > cutoff]
+    start = time.perf_counter()
+    holdout = SeasonalBaseline().fit(pd.DataFrame({'ds': train_part['ds_15min'], 'y': train_part['total_traffic']}))
+    fit_seconds = time.perf_counter() - start
+    forecast = holdout.predict(pd.DataFrame({'ds': test_part['ds_15min']}))
+    actual = test_part['total_traffic'].to_numpy()
+    observed = np.isfinite(actual)  # Slots left out by the cleaning are not scored
+    actual = actual[observed]
+    mae = np.mean(np.abs(forecast['yhat'].to_numpy()[observed] - actual))
+    coverage = np.mean((actual >= forecast['yhat_lower'].to_numpy()[observed]) &
+                       (actual <= forecast['yhat_upper'].to_numpy()[observed]))
+    print(f"\n📊 7-day holdout: MAE {mae:.1f} vehicles/15min, "
+          f"interval coverage {coverage:.0%}, fit time {fit_seconds * 1000:.1f} ms")
+
+    predictor = SeasonalBaselinePredictor()
+    if predictor.train(data_path):
+        predictor.save_model()
+        print(f"\n🔮 Next 15 minutes: {predictor.get_current_prediction(include_directions=True)}")
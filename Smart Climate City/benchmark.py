@@ -0,0 +1,121 @@
+"""
+Benchmark Script for Project EcoFlow
+Profiles cold-start import time of each entry point and the cost of serving
+a prediction, so startup regressions are caught before they reach the dashboard
+"""
+
+import json
+import subprocess
+import sys
+import time
+from config import IMPORT_TIME_BUDGET_SECONDS, FORECAST_TABLE_PATH
+
+# Modules the dashboard and CLI tools import at startup
+ENTRY_POINTS = ['config', 'metrics', 'logic', 'model', 'forecast_table', 'data_extraction',
+                'aq_model', 'spatial', 'rollups', 'alignment', 'replay', 'signal_timing', 'green_wave',
+                'pipeline', 'fleet']
+
+# Dependencies that must only be loaded on first real use
+HEAVY_MODULES = ['prophet', 'cmdstanpy', 'matplotlib', 'psycopg2']
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{'seconds': elapsed, 'heavy': heavy}}))
+"""
+
+
+def profile_import(module, top=5):
+    """
+    Import a module in a fresh interpreter and measure its cold-start cost.
+
+    Parameters:
+    - module: Module name to import
+    - top: Number of slowest transitive imports to report (from -X importtime)
+
+    Returns:
+    - dict with 'seconds', 'heavy' (heavy modules pulled in) and 'slowest'
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    slowest = []
+    for line in proc.stderr.splitlines():
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        slowest.append((int(parts[1]) / 1e6, parts[2].strip()))
+    result['slowest'] = sorted(slowest, reverse=True)[:top]
+    return result
+
+
+def check_import_times(budget=IMPORT_TIME_BUDGET_SECONDS):
+    """
+    Profile every entry point against the cold-start budget.
+
+    Returns:
+    - True if every module imports within budget without loading heavy dependencies
+    """
+    ok = True
+    print(f"\n⏱️  Cold-start imports (budget: {budget:.2f}s each)")
+    for module in ENTRY_POINTS:
+        result = profile_import(module)
+        passed = result['seconds'] <= budget and not result['heavy']
+        ok = ok and passed
+        icon = "✅" if passed else "❌"
+        print(f"   {icon} {module:<16} {result['seconds']:.3f}s")
+        if result['heavy']:
+            print(f"      ⚠️  Loaded heavy dependencies eagerly: {', '.join(result['heavy'])}")
+        if not passed:
+            for seconds, name in result['slowest']:
+                print(f"      {seconds:.3f}s  {name}")
+    return ok
+
+
+def benchmark_forecast_table(iterations=1000):
+    """
+    Time prediction lookups against the materialized forecast table.
+
+    Returns:
+    - Average lookup time in seconds, or None if no table exists
+    """
+    from forecast_table import ForecastTable
+
+    table = ForecastTable()
+    if not table.load(FORECAST_TABLE_PATH):
+        print(f"\n⚠️  No forecast table at {FORECAST_TABLE_PATH} - skipping lookup benchmark")
+        return None
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        table.get_current_prediction(include_directions=True, minutes_ahead=15 * (i % 96))
+    average = (time.perf_counter() - start) / iterations
+    print(f"\n🔮 Forecast table lookup: {average * 1e6:.1f} µs per prediction")
+    return average
+
+
+if __name__ == "__main__":
+    """
+    Run the benchmarks and exit non-zero if the startup budget is exceeded
+    """
+    print("=" * 70)
+    print("⏱️  PROJECT ECOFLOW - BENCHMARK")
+    print("=" * 70)
+
+    imports_ok = check_import_times()
+    benchmark_forecast_table()
+
+    print("\n" + "=" * 70)
+    print("✅ BENCHMARK PASSED" if imports_ok else "❌ STARTUP BUDGET EXCEEDED")
+    print("=" * 70)
+    sys.exit(0 if imports_ok else 1)
@@ -0,0 +1,110 @@
+"""
+Columnar Data Cache for Project EcoFlow
+Stores extracted frames as one .npy file per column plus a small JSON
+manifest. Readers memory-map only the columns they need, so loading a
+year of 15-minute rollups for the dashboard costs milliseconds instead of
+a CSV parse. Strings are stored as integer codes with a category list and
+datetimes as int64 nanoseconds.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from config import COLUMNAR_CACHE_PATH
+from metrics import timed, increment
+
+MANIFEST = 'manifest.json'
+
+
+def dataset_path(name, root=COLUMNAR_CACHE_PATH):
+    return os.path.join(root, name)
+
+
+def save_columns(name, df, root=COLUMNAR_CACHE_PATH, **meta):
+    """
+    Write a DataFrame as a columnar dataset (atomically: the new directory
+    replaces the old one only once it is complete).
+
+    Parameters:
+    - name: Dataset name (directory under root)
+    - df: DataFrame to store (numeric, datetime, bool or string columns)
+    - meta: Extra JSON-serializable metadata kept in the manifest
+
+    Returns:
+    - Path of the dataset directory
+    """
+    path = dataset_path(name, root)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = {}
+    with timed('columnar.save', dataset=name):
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                values = series.dt.tz_localize(None) if series.dt.tz is not None else series
+                np.save(os.path.join(tmp_path, f'{column}.npy'), values.to_numpy('datetime64[ns]').astype(np.int64))
+                columns[column] = {'kind': 'datetime'}
+            elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+                np.save(os.path.join(tmp_path, f'{column}.npy'), series.to_numpy())
+                columns[column] = {'kind': 'numeric'}
+            else:
+                codes, categories = pd.factorize(series.astype(str), sort=True)
+                np.save(os.path.join(tmp_path, f'{column}.npy'), codes.astype(np.int32))
+                columns[column] = {'kind': 'category', 'categories': categories.tolist()}
+
+        manifest = {'rows': len(df), 'columns': columns, 'created': datetime.now().isoformat(), **meta}
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+
+        old_path = f"{path}.{os.getpid()}.old"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def load_manifest(name, root=COLUMNAR_CACHE_PATH):
+    """Manifest of a dataset, or None if it is not cached."""
+    manifest_path = os.path.join(dataset_path(name, root), MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load_columns(name, columns=None, root=COLUMNAR_CACHE_PATH):
+    """
+    Load a columnar dataset (numeric columns are memory-mapped).
+
+    Parameters:
+    - name: Dataset name
+    - columns: Columns to load (default: all)
+
+    Returns:
+    - DataFrame, or None if the dataset is not cached
+    """
+    manifest = load_manifest(name, root)
+    if manifest is None:
+        increment('cache_misses', cache=f'columnar_{name}')
+        return None
+
+    path = dataset_path(name, root)
+    data = {}
+    with timed('columnar.load', dataset=name):
+        for column in columns or list(manifest['columns']):
+            info = manifest['columns'][column]
+            values = np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+            if info['kind'] == 'datetime':
+                data[column] = pd.to_datetime(np.asarray(values))
+            elif info['kind'] == 'category':
+                data[column] = pd.Categorical.from_codes(np.asarray(values), categories=info['categories'])
+            else:
+                data[column] = values
+    increment('cache_hits', cache=f'columnar_{name}')
+    return pd.DataFrame(data)
@@ -66,6 +66,8 @@ HEILBRONN_COORDS = {
 # ============================================================================
 # Number of months to extract for training (full year for better accuracy)
 TRAINING_DATA_MONTHS = 12
+# Column-per-file cache of extracted rollups (columnar_cache.py)
+COLUMNAR_CACHE_PATH = 'data_cache/columnar/'
 
 # ============================================================================
 # MODEL SETTINGS
@@ -74,3 +76,266 @@ MODEL_PATH = 'trained_model.pkl'
 MODEL_TR1_PATH = 'trained_model_tr1.pkl'  # Direction 1 model
 MODEL_TR2_PATH = 'trained_model_tr2.pkl'  # Direction 2 model
 DATA_CACHE_PATH = 'data_cache/'
+
+# Prophet configuration shared by the total, TR1 and TR2 models
+PROPHET_PARAMS = {
+    'daily_seasonality': True,
+    'weekly_seasonality': True,
+    'yearly_seasonality': 'auto',
+    'seasonality_mode': 'multiplicative',
+    'changepoint_prior_scale': 0.05
+}
+
+# Fit modes (trade training time for accuracy; compare with `python backtest.py --fit-modes`)
+# - optimizer: Stan optimize() settings passed to Prophet.fit; the tol_rel_* values
+#   are multiples of machine epsilon, so larger values stop the optimizer earlier
+# - resolution: 'hourly' fits hourly totals and splits them back to 15-minute slots
+TRAINING_MODE = 'full'
+FIT_MODES = {
+    'full': {'resolution': '15min', 'optimizer': {}},
+    'fast': {
+        'resolution': '15min',
+        'optimizer': {'algorithm': 'LBFGS', 'iter': 1000, 'tol_rel_obj': 1e8, 'tol_rel_grad': 1e9}
+    },
+    'hourly': {
+        'resolution': 'hourly',
+        'optimizer': {'algorithm': 'LBFGS', 'iter': 1000, 'tol_rel_obj': 1e8, 'tol_rel_grad': 1e9}
+    }
+}
+
+# NumPy seasonal baseline (fallback when Prophet is unavailable, first tier for fleets)
+BASELINE_MODEL_PATH = 'baseline_model.pkl'
+BASELINE_METHOD = 'profile'  # 'profile' (day-of-week x slot means) or 'harmonic'
+BASELINE_TREND = False  # Linear trend extrapolates poorly over the 2-year selector
+BASELINE_HARMONICS = {'daily': 8, 'weekly': 3}  # Fourier orders for 'harmonic'
+BASELINE_INTERVAL_WIDTH = 0.8  # Same default coverage as Prophet
+
+# Prediction intervals:
+# - 'residual': empirical residual quantiles per time of day, fitted once at training
+# - 'analytic': normal approximation from the training residuals
+# - 'sampled':  Prophet Monte Carlo with a reduced sample count (INTERVAL_SAMPLES)
+# - 'prophet':  Prophet's default 1000-sample simulation on every predict call
+INTERVAL_METHOD = 'residual'
+INTERVAL_WIDTH = 0.8  # Prophet's default interval_width
+INTERVAL_SAMPLES = 100
+
+# Precomputed forecast table (served without importing Prophet)
+FORECAST_TABLE_PATH = 'forecast_table.npz'
+FORECAST_TABLE_DAYS = 730  # Matches the dashboard's 2-year date selector
+
+# ============================================================================
+# BACKTEST SETTINGS
+# ============================================================================
+# Rolling-origin evaluation: first cutoff after INITIAL_DAYS, then every PERIOD_DAYS
+BACKTEST_INITIAL_DAYS = 90
+BACKTEST_PERIOD_DAYS = 7
+BACKTEST_HORIZON_HOURS = 24
+BACKTEST_WORKERS = None  # Process pool size (None = all cores, 1 = inline)
+BACKTEST_CACHE_PATH = 'data_cache/backtest/'  # Fitted models per cutoff
+BACKTEST_RESULTS_PATH = 'data_cache/backtest_results.csv'
+
+# ============================================================================
+# TUNING SETTINGS
+# ============================================================================
+# Prophet settings searched per device and direction (merged over PROPHET_PARAMS)
+TUNING_PARAM_GRID = {
+    'seasonality_mode': ['additive', 'multiplicative'],
+    'changepoint_prior_scale': [0.005, 0.05, 0.2, 0.5],
+    'seasonality_prior_scale': [1.0, 10.0],
+    'daily_seasonality': [True, 20],  # True = Prophet's 4 Fourier terms
+    'weekly_seasonality': [True, 6],
+    'yearly_seasonality': ['auto', False]
+}
+TUNING_MAX_CANDIDATES = 27  # Random sample of the grid (None = full grid)
+TUNING_HOLDOUT_DAYS = 14
+TUNING_RUNG_DAYS = (28, 91, None)  # Training history per halving rung (None = all)
+TUNING_ETA = 3  # Keep the best third after each rung
+TUNING_WORKERS = None  # Process pool size (None = all cores)
+TUNING_CACHE_PATH = 'data_cache/tuning_cache.json'
+TUNING_SEED = 42
+
+# Per-device model configuration written by tuning.py
+MODEL_REGISTRY_PATH = 'model_registry.json'
+
+# ============================================================================
+# NOWCAST SETTINGS
+# ============================================================================
+# Short-horizon correction of the base forecast from the latest measured traffic
+NOWCAST_ENABLED = True
+NOWCAST_HALFLIFE_SLOTS = 8  # Memory of the residual autocorrelation estimate (2 hours)
+NOWCAST_MAX_HORIZON_MINUTES = 120  # No correction further ahead than this
+NOWCAST_MAX_AGE_MINUTES = 45  # Drop the correction if the feed has stalled
+NOWCAST_MAX_PHI = 0.95  # Cap on the AR(1) coefficient
+NOWCAST_MIN_READINGS = 12  # 1-minute readings needed for a slot to count as complete
+NOWCAST_FEED_LOOKBACK_MINUTES = 120  # History fetched on the first poll
+
+# ============================================================================
+# GLOBAL MODEL SETTINGS
+# ============================================================================
+# One ridge regression across all devices (alternative to per-device Prophet)
+GLOBAL_MODEL_PATH = 'global_model.pkl'
+GLOBAL_HORIZONS = (1, 2, 4, 8, 16, 32, 48, 96)  # 15-minute slots ahead (15min to 24h)
+GLOBAL_RIDGE = 1e-3  # L2 penalty (scaled by the number of training rows)
+GLOBAL_MAX_TRAIN_ROWS = 200000  # Rows sampled per horizon, independent of fleet size
+GLOBAL_EMBEDDING_HARMONICS = 3  # Fourier order of the device profile embedding
+
+# ============================================================================
+# SENSOR ANOMALY SETTINGS
+# ============================================================================
+ANOMALY_GAP_MINUTES = 30  # No reading for longer than this = dropout
+ANOMALY_FLATLINE_READINGS = 10  # Identical non-zero readings in a row = stuck counter
+ANOMALY_ZERO_RUN_MINUTES = 240  # Zeros are normal at night; only flag long runs
+ANOMALY_SPIKE_Z = 6.0  # Robust z-score (median/MAD) for spikes
+ANOMALY_SPIKE_FLOOR = 2.0  # Vehicles added to the MAD scale (quiet hours have MAD ~ 0)
+ANOMALY_WARMUP_READINGS = 30  # Readings per hour of day before spikes are flagged
+ANOMALY_LEARNING_RATE = 0.05  # Step size of the running median/MAD
+ANOMALY_MAX_PER_MINUTE = 75  # Physically implausible above this (MAX_REASONABLE_15MIN / 15)
+ANOMALY_LOG_PATH = 'data_cache/anomaly_events.jsonl'
+ANOMALY_MAX_EVENTS = 1000  # Recent events kept in memory for the dashboard
+ANOMALY_EXCLUDE_FROM_TRAINING = True  # Drop flagged 15-minute intervals before fitting
+
+# ============================================================================
+# PREPROCESSING SETTINGS
+# ============================================================================
+PREPROCESS_CACHE_PATH = 'data_cache/clean/'  # Cleaned 15-minute frames, keyed by input hash
+PREPROCESS_CAP_PERCENTILE = 99.9  # Readings above this per-device percentile are outliers
+PREPROCESS_CAP_HEADROOM = 1.5  # Cap = percentile x headroom (rush hours stay untouched)
+PREPROCESS_MIN_COVERAGE = 0.5  # Buckets with fewer expected readings are dropped, not scaled up
+
+# ============================================================================
+# AIR QUALITY FORECAST SETTINGS
+# ============================================================================
+AQ_DATA_MONTHS = 3  # History per air-quality device used for training
+AQ_POLLUTANTS = {'pm10': 'p10', 'pm25': 'p02'}  # Forecast series -> airqsensordata column
+AQ_REGRESSORS = ('tmp', 'hum')  # Weather columns added as Prophet regressors
+AQ_PROPHET_PARAMS = {
+    'daily_seasonality': True,
+    'weekly_seasonality': True,
+    'yearly_seasonality': False,  # A few months of history cannot pin down a yearly cycle
+    'changepoint_prior_scale': 0.05
+}
+AQ_FIT_MODE = 'fast'  # Fit mode from FIT_MODES ('hourly' does not support regressors)
+AQ_REGRESSOR_PROFILE_DAYS = 14  # Future tmp/hum = hour-of-day mean over the last N days
+AQ_MIN_TRAINING_DAYS = 7  # Devices with less usable history are skipped
+AQ_FORECAST_TABLE_PATH = 'aq_forecast_table.npz'
+AQ_FORECAST_TABLE_DAYS = 14  # Regressors beyond the last reading are climatology, so keep it short
+AQ_FORECAST_HORIZONS = (15, 30, 45, 60)  # Minutes ahead checked for predicted exceedances
+AQ_WORKERS = None  # Process pool size for per-device training (None = CPU count)
+
+# ============================================================================
+# SPATIAL INTERPOLATION SETTINGS
+# ============================================================================
+SPATIAL_NEIGHBOURS = 8  # Sensors blended per grid cell (IDW)
+SPATIAL_POWER = 2.0  # IDW distance exponent
+SPATIAL_MAX_DISTANCE_KM = 5.0  # Cells farther than this from every sensor stay empty
+SPATIAL_GRID_RESOLUTION_M = 200  # Grid cell size
+SPATIAL_GRID_MARGIN_KM = 1.0  # Grid extends this far beyond the outermost sensors
+SPATIAL_WINDOW_MINUTES = 60  # Surfaces are cached per time window
+SPATIAL_CACHE_WINDOWS = 24  # Windows kept in memory (LRU)
+
+# ============================================================================
+# AIR QUALITY ROLLUP SETTINGS
+# ============================================================================
+AQ_ROLLUP_PATH = 'data_cache/aq_rollups.sqlite'  # Local store of hourly/daily partial aggregates
+AQ_ROLLUP_INITIAL_DAYS = 30  # History loaded by the first refresh
+AQ_ROLLUP_HOURLY_RETENTION_DAYS = 35  # Hourly partials (windows up to ~1 month)
+AQ_ROLLUP_DAILY_RETENTION_DAYS = 400  # Daily partials (WHO exceedance-day counts)
+
+# ============================================================================
+# NOISE SETTINGS
+# ============================================================================
+NOISE_LEVEL_COLUMN = 'laeq'  # A-weighted level (dB) column in noisesensordata
+NOISE_DATA_MONTHS = 3  # History extracted for the noise rollups
+NOISE_EXTRACT_CHUNK_DAYS = 30  # Time range per COPY query
+NOISE_SCORE_FLOOR_DB = 55.0  # Exposure score 0 at or below this level (WHO/EU annoyance onset)
+NOISE_SCORE_CEILING_DB = 75.0  # Exposure score 1 at or above this level
+NOISE_EXPOSURE_WEIGHT = 0.3  # Max. share of the PM10 threshold that noise can take up in the combined score
+
+# ============================================================================
+# ROLLUP SETTINGS
+# ============================================================================
+ROLLUP_DEFAULT_WIDTH_PX = 800  # Chart width assumed when the caller does not pass one
+
+# ============================================================================
+# ALIGNMENT SETTINGS
+# ============================================================================
+ALIGN_TOLERANCE_MINUTES = 30  # An air quality reading is carried forward at most this long
+ALIGN_NEIGHBOURS = 3  # Candidate air quality sensors per traffic device (nearest first)
+ALIGN_MAX_DISTANCE_KM = 2.0  # Sensors farther than this from a traffic device are not used
+
+# ============================================================================
+# POLICY REPLAY SETTINGS
+# ============================================================================
+REPLAY_CAPACITY_GRID = tuple(range(100, 2001, 100))  # Capacity thresholds swept (cars/hr)
+REPLAY_PM10_GRID = tuple(range(30, 101, 5))  # PM10 rerouting thresholds swept (µg/m³)
+REPLAY_WORKERS = None  # Worker processes for the sweep (None = one per CPU)
+
+# ============================================================================
+# HYSTERESIS SETTINGS
+# ============================================================================
+HYSTERESIS_PM10_EXIT_THRESHOLD = 40.0  # Rerouting (entered above EMERGENCY_PM10_THRESHOLD) ends below this
+HYSTERESIS_CAPACITY_EXIT_RATIO = 0.85  # Extended green ends below this share of the capacity threshold
+HYSTERESIS_MIN_DWELL_MINUTES = 30  # A state is held at least this long (escalation to rerouting is never delayed)
+HYSTERESIS_MAX_TRANSITIONS_PER_HOUR = 4  # Token-bucket rate limit on transitions per intersection
+
+# ============================================================================
+# SIGNAL TIMING SETTINGS
+# ============================================================================
+SIGNAL_SATURATION_FLOW_VPH = 1800  # Discharge rate of one direction during green (vehicles/hr)
+SIGNAL_LOST_TIME_PER_PHASE_S = 4  # Start-up loss + clearance per phase (seconds)
+SIGNAL_MIN_GREEN_S = 10  # Shortest green per direction (pedestrian crossing)
+SIGNAL_MIN_CYCLE_S = 40
+SIGNAL_MAX_CYCLE_S = 120
+SIGNAL_MAX_FLOW_RATIO = 0.9  # Sum of flow ratios above which the junction is treated as oversaturated
+
+# ============================================================================
+# GREEN WAVE SETTINGS
+# ============================================================================
+GREEN_WAVE_SPEED_KMH = 50  # Progression speed along corridors
+GREEN_WAVE_MAX_SWEEPS = 8  # Coordinate-descent passes over a corridor per solve
+GREEN_WAVE_WORKERS = None  # Worker processes for city-wide solves (None = one per CPU)
+GREEN_WAVE_PARALLEL_MIN_CORRIDORS = 16  # Fewer corridors are solved in-process (pool start-up dominates)
+
+# ============================================================================
+# HEALTH EXPOSURE SETTINGS
+# ============================================================================
+# Optional population grid (CSV with latitude, longitude, population per cell);
+# without it exposure is weighted by area (every surface cell counts the same)
+POPULATION_GRID_PATH = 'data_cache/population_grid.csv'
+
+# ============================================================================
+# FORECAST PUBLISHING SETTINGS
+# ============================================================================
+PUBLISHED_FORECAST_PATH = 'data_cache/published_forecasts.npz'  # Latest published forecasts (replaced atomically)
+PUBLISH_HORIZON_HOURS = 6  # Forecast hours published every cycle
+PUBLISH_INTERVAL_MINUTES = 15
+PUBLISH_DELAY_SECONDS = 30  # Run this long after each quarter hour so the last slot has landed
+
+# ============================================================================
+# PIPELINE SETTINGS
+# ============================================================================
+PIPELINE_CACHE_PATH = 'data_cache/pipeline/'  # Stage outputs, keyed by content hash of inputs and config
+PIPELINE_WORKERS = 4  # Tasks run concurrently (DB queries and Stan fits run outside the GIL)
+PIPELINE_DEVICES = None  # Traffic devices to build (None = the German device found by data_extraction)
+PIPELINE_KEEP_ARTIFACTS = 3  # Model/table files kept per stage and device (newest first); older ones are deleted
+
+# ============================================================================
+# FLEET TRAINING SETTINGS
+# ============================================================================
+# Work queue and models live on storage shared by every worker node
+FLEET_QUEUE_PATH = 'data_cache/fleet/queue.sqlite'
+FLEET_MODEL_DIR = 'data_cache/fleet/models/'
+FLEET_LEASE_SECONDS = 900  # A job whose worker stops renewing for this long is handed out again
+FLEET_MAX_ATTEMPTS = 3  # Failures (or expired leases) before a job is given up
+FLEET_POLL_SECONDS = 10  # Idle workers re-check the queue this often while other jobs are leased
+
+# ============================================================================
+# INSTRUMENTATION SETTINGS
+# ============================================================================
+# Number of recent timing samples kept for the diagnostics panel percentiles
+METRICS_WINDOW_SIZE = 500
+# Optional .prom file for the node_exporter textfile collector (None = disabled)
+METRICS_TEXTFILE_PATH = None
+
+# Cold-start budget checked by benchmark.py (seconds per entry-point import)
+IMPORT_TIME_BUDGET_SECONDS = 1.0
@@ -3,11 +3,44 @@ Data Extraction Module for Project EcoFlow
 Connects to SensorBox database and extracts traffic and air quality data
 """
 
-import psycopg2
+import io
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-from config import DB_CONFIG, TRAINING_DATA_MONTHS
+from config import (
+    DB_CONFIG,
+    TRAINING_DATA_MONTHS,
+    AQ_DATA_MONTHS,
+    NOISE_LEVEL_COLUMN,
+    NOISE_DATA_MONTHS,
+    NOISE_EXTRACT_CHUNK_DAYS
+)
+from metrics import timed
+
+
+def _connect():
+    """
+    Open a database connection, timing the (SSH-tunnelled) handshake.
+    psycopg2 is imported here so tools that only read the CSV cache never load it.
+    """
+    import psycopg2
+
+    with timed('db.connect'):
+        return psycopg2.connect(**DB_CONFIG)
+
+
+def _copy_query(conn, query, params=None):
+    """
+    Run a SELECT through COPY ... TO STDOUT and parse the CSV stream.
+    COPY skips the per-row protocol overhead of cursor fetches, which
+    dominates extraction time for large result sets.
+    """
+    with conn.cursor() as cursor:
+        sql = cursor.mogrify(query, params).decode() if params else query
+        buffer = io.StringIO()
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH CSV HEADER", buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
 
 
 def test_connection():
@@ -16,9 +49,10 @@ def test_connection():
     Returns True if successful, False otherwise.
     """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = _connect()
         cursor = conn.cursor()
-        cursor.execute("SELECT version();")
+        with timed('db.query', query='version'):
+            cursor.execute("SELECT version();")
         version = cursor.fetchone()
         print(f"✅ Database connection successful!")
         print(f"📊 PostgreSQL version: {version[0]}")
@@ -38,7 +72,7 @@ def get_german_device_imei():
     Returns the IMEI of the device with the most traffic data.
     """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = _connect()
 
         # Find device with most traffic data (likely the German one with 1 year history)
         query = """
@@ -59,7 +93,8 @@ def get_german_device_imei():
         LIMIT 5
         """
 
-        df = pd.read_sql(query, conn)
+        with timed('db.query', query='device_scan'):
+            df = pd.read_sql(query, conn)
         conn.close()
 
         print("\n📡 Top devices with traffic data:")
@@ -95,7 +130,7 @@ def get_german_traffic_data(imei, months=TRAINING_DATA_MONTHS):
     - pandas DataFrame with timestamp, tr1, tr2, and combined total
     """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = _connect()
 
         query = f"""
         SELECT
@@ -113,7 +148,8 @@ def get_german_traffic_data(imei, months=TRAINING_DATA_MONTHS):
         """
 
         print(f"\n🔍 Extracting {months} months of traffic data for device {imei}...")
-        df = pd.read_sql(query, conn)
+        with timed('db.query', query='traffic_data'):
+            df = pd.read_sql(query, conn)
         conn.close()
 
         print(f"✅ Extracted {len(df):,} traffic records")
@@ -133,6 +169,97 @@ def get_german_traffic_data(imei, months=TRAINING_DATA_MONTHS):
         return None
 
 
+def get_fleet_traffic_15min(months=TRAINING_DATA_MONTHS):
+    """
+    Extract 15-minute traffic aggregates for every device.
+    Aggregation runs in the database, so only one row per device and
+    15-minute slot crosses the (SSH-tunnelled) connection.
+
+    Parameters:
+    - months: Number of months of historical data (default from config)
+
+    Returns:
+    - pandas DataFrame with imei, ds_15min, tr1, tr2, total_traffic, readings
+    """
+    try:
+        conn = _connect()
+
+        query = f"""
+        SELECT
+            imei,
+            date_trunc('hour', timestamp)
+                + floor(extract(minute FROM timestamp) / 15) * INTERVAL '15 minutes' AS ds_15min,
+            SUM(tr1) AS tr1,
+            SUM(tr2) AS tr2,
+            SUM(tr1 + tr2) AS total_traffic,
+            COUNT(*) AS readings
+        FROM trafficsensordata
+        WHERE timestamp > NOW() - INTERVAL '{months} months'
+          AND tr1 IS NOT NULL
+          AND tr2 IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """
+
+        print(f"\n🔍 Extracting {months} months of 15-minute traffic aggregates for all devices...")
+        with timed('db.query', query='fleet_traffic_15min'):
+            df = pd.read_sql(query, conn)
+        conn.close()
+
+        print(f"✅ Extracted {len(df):,} intervals from {df['imei'].nunique()} devices")
+
+        os.makedirs('data_cache', exist_ok=True)
+        csv_path = f'data_cache/fleet_traffic_{months}m.csv'
+        df.to_csv(csv_path, index=False)
+        print(f"💾 Saved to: {csv_path}")
+
+        return df
+
+    except Exception as e:
+        print(f"❌ Error extracting fleet traffic data: {e}")
+        return None
+
+
+def get_recent_traffic(imei, since):
+    """
+    Incremental traffic feed: readings newer than a timestamp.
+    Used by the nowcast layer, which polls with the last slot it consumed.
+
+    Parameters:
+    - imei: Device IMEI to query
+    - since: Only return readings strictly after this timestamp
+
+    Returns:
+    - pandas DataFrame with timestamp, imei, tr1, tr2, total_traffic (None on error)
+    """
+    try:
+        conn = _connect()
+
+        query = """
+        SELECT
+            timestamp,
+            imei,
+            tr1,
+            tr2,
+            (tr1 + tr2) as total_traffic
+        FROM trafficsensordata
+        WHERE imei = %(imei)s
+          AND timestamp > %(since)s
+          AND tr1 IS NOT NULL
+          AND tr2 IS NOT NULL
+        ORDER BY timestamp ASC
+        """
+
+        with timed('db.query', query='recent_traffic'):
+            df = pd.read_sql(query, conn, params={'imei': str(imei), 'since': since})
+        conn.close()
+        return df
+
+    except Exception as e:
+        print(f"❌ Error fetching recent traffic: {e}")
+        return None
+
+
 def get_air_quality_statistics():
     """
     Extract air quality statistics from Italian devices to understand
@@ -142,7 +269,7 @@ def get_air_quality_statistics():
     - pandas DataFrame with pollution statistics
     """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = _connect()
 
         query = """
         SELECT
@@ -166,7 +293,8 @@ def get_air_quality_statistics():
         """
 
         print("\n🌫️  Extracting air quality statistics from Italian devices...")
-        df = pd.read_sql(query, conn)
+        with timed('db.query', query='air_quality_stats'):
+            df = pd.read_sql(query, conn)
         conn.close()
 
         print(f"✅ Analyzed {len(df)} locations")
@@ -189,6 +317,166 @@ def get_air_quality_statistics():
         return None
 
 
+def get_air_quality_data(months=AQ_DATA_MONTHS):
+    """
+    Extract 15-minute air quality averages (PM10, PM2.5, temperature,
+    humidity) for every enabled air quality device.
+    Aggregation runs in the database, as for the fleet traffic extract.
+
+    Parameters:
+    - months: Number of months of historical data
+
+    Returns:
+    - pandas DataFrame with imei, ds_15min, p10, p02, tmp, hum, readings
+    """
+    try:
+        conn = _connect()
+
+        query = f"""
+        SELECT
+            a.imei,
+            date_trunc('hour', a.timestamp)
+                + floor(extract(minute FROM a.timestamp) / 15) * INTERVAL '15 minutes' AS ds_15min,
+            AVG(a.p10) AS p10,
+            AVG(a.p02) AS p02,
+            AVG(a.tmp) AS tmp,
+            AVG(a.hum) AS hum,
+            COUNT(*) AS readings
+        FROM airqsensordata a
+        JOIN device_mapping dm ON a.imei = dm.imei
+        WHERE a.timestamp > NOW() - INTERVAL '{months} months'
+          AND dm.enabled = 1
+          AND a.p10 IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """
+
+        print(f"\n🌫️  Extracting {months} months of 15-minute air quality averages for all devices...")
+        with timed('db.query', query='air_quality_15min'):
+            df = pd.read_sql(query, conn)
+        conn.close()
+
+        print(f"✅ Extracted {len(df):,} intervals from {df['imei'].nunique()} devices")
+
+        os.makedirs('data_cache', exist_ok=True)
+        csv_path = f'data_cache/air_quality_{months}m.csv'
+        df.to_csv(csv_path, index=False)
+        print(f"💾 Saved to: {csv_path}")
+
+        return df
+
+    except Exception as e:
+        print(f"❌ Error extracting air quality data: {e}")
+        return None
+
+
+def get_air_quality_partials(since, device_since=None):
+    """
+    Hourly partial aggregates (sum, count, min, max) of air quality readings
+    newer than a timestamp, for the incremental rollups in aq_rollups.py.
+
+    Parameters:
+    - since: Only include readings strictly after this timestamp
+    - device_since: Optional dict of imei -> timestamp overriding `since` per device
+
+    Returns:
+    - pandas DataFrame with imei, hour, last_timestamp and <column>_sum/_count/_min/_max
+      for p10, p02, tmp, hum (None on error)
+    """
+    try:
+        conn = _connect()
+
+        aggregates = ",\n            ".join(
+            f"SUM(a.{c}) AS {c}_sum, COUNT(a.{c}) AS {c}_count, MIN(a.{c}) AS {c}_min, MAX(a.{c}) AS {c}_max"
+            for c in ('p10', 'p02', 'tmp', 'hum')
+        )
+        query = f"""
+        SELECT
+            a.imei,
+            date_trunc('hour', a.timestamp) AS hour,
+            MAX(a.timestamp) AS last_timestamp,
+            {aggregates}
+        FROM airqsensordata a
+        JOIN device_mapping dm ON a.imei = dm.imei
+        LEFT JOIN unnest(%(imeis)s::text[], %(device_since)s::timestamp[]) AS w(imei, since)
+          ON w.imei = a.imei::text
+        WHERE a.timestamp > COALESCE(w.since, %(since)s)
+          AND dm.enabled = 1
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """
+
+        device_since = device_since or {}
+        params = {
+            'since': since,
+            'imeis': [str(imei) for imei in device_since],
+            'device_since': [pd.Timestamp(ts).to_pydatetime() for ts in device_since.values()]
+        }
+        with timed('db.query', query='air_quality_partials'):
+            df = pd.read_sql(query, conn, params=params)
+        conn.close()
+        return df
+
+    except Exception as e:
+        print(f"❌ Error fetching air quality partials: {e}")
+        return None
+
+
+def get_noise_15min(months=NOISE_DATA_MONTHS, chunk_days=NOISE_EXTRACT_CHUNK_DAYS):
+    """
+    Extract 15-minute noise rollups for every device.
+    The database aggregates each slot (energy-averaged Leq, Lmax, Lmin) and
+    the result streams back via COPY, one time chunk per query.
+
+    Parameters:
+    - months: Number of months of historical data
+    - chunk_days: Days per COPY query (bounds query time and server memory)
+
+    Returns:
+    - pandas DataFrame with imei, ds_15min, leq, lmax, lmin, readings (None on error)
+    """
+    try:
+        conn = _connect()
+
+        level = NOISE_LEVEL_COLUMN
+        query = f"""
+        SELECT
+            n.imei,
+            date_trunc('hour', n.timestamp)
+                + floor(extract(minute FROM n.timestamp) / 15) * INTERVAL '15 minutes' AS ds_15min,
+            10 * LOG(AVG(POWER(10, n.{level} / 10.0))) AS leq,
+            MAX(n.{level}) AS lmax,
+            MIN(n.{level}) AS lmin,
+            COUNT(*) AS readings
+        FROM noisesensordata n
+        WHERE n.timestamp >= %(start)s
+          AND n.timestamp < %(end)s
+          AND n.{level} IS NOT NULL
+        GROUP BY 1, 2
+        """
+
+        # Chunk boundaries on quarter hours, so no slot is split between two queries
+        end = pd.Timestamp.now().ceil('15min').to_pydatetime()
+        start = end - timedelta(days=30 * months)
+        print(f"\n🔊 Extracting {months} months of 15-minute noise rollups for all devices...")
+        chunks = []
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(end, chunk_start + timedelta(days=chunk_days))
+            with timed('db.query', query='noise_15min'):
+                chunks.append(_copy_query(conn, query, {'start': chunk_start, 'end': chunk_end}))
+            chunk_start = chunk_end
+        conn.close()
+
+        df = pd.concat(chunks, ignore_index=True).sort_values(['imei', 'ds_15min'], ignore_index=True)
+        print(f"✅ Extracted {len(df):,} intervals from {df['imei'].nunique()} devices ({len(chunks)} chunks)")
+        return df
+
+    except Exception as e:
+        print(f"❌ Error extracting noise data: {e}")
+        return None
+
+
 def get_device_locations():
     """
     Get all device locations for map visualization.
@@ -197,7 +485,7 @@ def get_device_locations():
     - pandas DataFrame with device locations
     """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = _connect()
 
         query = """
         SELECT
@@ -213,7 +501,8 @@ def get_device_locations():
         ORDER BY friendly_name
         """
 
-        df = pd.read_sql(query, conn)
+        with timed('db.query', query='device_locations'):
+            df = pd.read_sql(query, conn)
         conn.close()
 
         print(f"\n📍 Found {len(df)} devices with GPS coordinates")
@@ -253,9 +542,31 @@ if __name__ == "__main__":
         print("\n❌ Exiting: Could not extract traffic data")
         exit(1)
 
-    # Step 4: Extract air quality statistics
+    # Chart pyramids (15min/1h/1d/1w) are built once at ingest, not per dashboard rerun
+    from rollups import build_from_csv
+    _, rollup_counts = build_from_csv(f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv')
+    print(f"🗂️  Traffic rollups built: {rollup_counts}")
+
+    # Step 4: Extract air quality statistics (incrementally via the rollup store)
     print("\n[4/4] Extracting air quality statistics...")
-    air_quality_data = get_air_quality_statistics()
+    from aq_rollups import AirQualityRollups
+    rollups = AirQualityRollups()
+    if rollups.refresh() is not None:
+        air_quality_data = rollups.statistics()
+        os.makedirs('data_cache', exist_ok=True)
+        air_quality_data.drop(columns='imei').to_csv('data_cache/air_quality_stats.csv', index=False)
+        print(f"✅ {len(air_quality_data)} locations from the rollups (watermark: {rollups.watermark()})")
+    else:
+        air_quality_data = get_air_quality_statistics()
+
+    # Bonus: 15-minute aggregates of every traffic device (fleet.py, global_model.py,
+    # baseline fallback of the forecast publisher)
+    print("\n[BONUS] Extracting fleet traffic aggregates...")
+    get_fleet_traffic_15min()
+
+    # Bonus: Air quality history for the PM10/PM2.5 forecaster (aq_model.py)
+    print("\n[BONUS] Extracting air quality history for forecasting...")
+    get_air_quality_data()
 
     # Bonus: Get device locations
     print("\n[BONUS] Getting device locations for map...")
@@ -263,11 +574,18 @@ if __name__ == "__main__":
     if locations is not None:
         locations.to_csv('data_cache/device_locations.csv', index=False)
 
+    # Bonus: Noise rollups into the columnar cache
+    print("\n[BONUS] Extracting noise rollups...")
+    from noise import load_noise_15min
+    load_noise_15min(refresh=True)
+
     print("\n" + "=" * 70)
     print("✅ DATA EXTRACTION COMPLETE!")
     print("=" * 70)
     print(f"\n📁 Data saved to: data_cache/")
     print(f"   - german_traffic_{TRAINING_DATA_MONTHS}m.csv")
+    print(f"   - fleet_traffic_{TRAINING_DATA_MONTHS}m.csv")
     print(f"   - air_quality_stats.csv")
+    print(f"   - air_quality_{AQ_DATA_MONTHS}m.csv")
     print(f"   - device_locations.csv")
     print(f"\n🎯 Next step: Train the prediction model with: python model.py")
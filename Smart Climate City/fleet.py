@@ -0,0 +1,337 @@
+"""
+Fleet Training for Project EcoFlow
+Retrains the per-device traffic models of the whole fleet on any number of
+worker processes or nodes. Devices are the shards: every retrain run puts
+one job per device into a SQLite work queue on shared storage, and workers
+claim jobs under a lease that they renew while training. A worker that
+crashes stops renewing, its lease expires and the job is handed out again.
+Publishing is idempotent: models are stored under the content key of their
+job and registered with registry.register_model(), so a job that runs twice
+publishes the same model once.
+"""
+
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import pandas as pd
+import config
+from config import (
+    FLEET_QUEUE_PATH,
+    FLEET_MODEL_DIR,
+    FLEET_LEASE_SECONDS,
+    FLEET_MAX_ATTEMPTS,
+    FLEET_POLL_SECONDS,
+    MODEL_REGISTRY_PATH
+)
+from metrics import timed, increment
+from model import TRAIN_SETTINGS
+
+STATES = ('pending', 'leased', 'done', 'failed')
+
+
+def default_worker_id():
+    """host:pid - unique across the nodes sharing one queue."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def job_key(run, device):
+    """Content key of a training job: the run, the device and the settings that shape its model."""
+    from registry import best_params
+
+    digest = hashlib.sha1(f"{run}:{device}".encode())
+    for setting in ('TRAINING_DATA_MONTHS',) + TRAIN_SETTINGS:
+        digest.update(f"{setting}={getattr(config, setting)!r};".encode())
+    for series in ('total', 'tr1', 'tr2'):
+        digest.update(repr(best_params(device, series)).encode())
+    return digest.hexdigest()[:20]
+
+
+class WorkQueue:
+    """
+    Jobs of every retrain run in one SQLite file. Each operation opens its
+    own connection and claims run in an IMMEDIATE transaction, so any number
+    of processes (and threads) can share the file. The rollback journal is
+    kept (no WAL) because WAL does not work on network file systems; lease
+    expiry compares wall clocks, so worker nodes need synchronized time.
+    """
+
+    def __init__(self, path=FLEET_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                         "run TEXT, device TEXT, key TEXT, state TEXT, worker TEXT, lease_expires REAL, "
+                         "attempts INTEGER DEFAULT 0, error TEXT, result TEXT, updated REAL, "
+                         "PRIMARY KEY (run, device))")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def enqueue(self, devices, run, key=job_key):
+        """
+        Add one job per device to a run. Enqueueing a run again only adds
+        devices it does not have yet.
+
+        Parameters:
+        - devices: Device IMEIs
+        - run: Run identifier (e.g. the retrain date)
+        - key: key(run, device) -> content key of the job
+
+        Returns:
+        - Number of jobs added
+        """
+        rows = [(run, str(d), key(run, str(d)), 'pending', time.time()) for d in devices]
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO jobs (run, device, key, state, updated) VALUES (?, ?, ?, ?, ?)",
+                             rows)
+            added = conn.total_changes - before
+        increment('fleet_jobs_enqueued', amount=added)
+        return added
+
+    def claim(self, worker, lease_seconds=FLEET_LEASE_SECONDS, max_attempts=FLEET_MAX_ATTEMPTS, run=None):
+        """
+        Lease the next job: a pending one, or one whose lease expired.
+        Jobs whose leases expired max_attempts times are marked failed.
+
+        Returns:
+        - dict with run, device, key and attempts, or None if nothing is claimable
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE jobs SET state = 'failed', error = 'lease expired', updated = ? "
+                         "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, max_attempts))
+            row = conn.execute(
+                "SELECT run, device, key, attempts, state FROM jobs "
+                "WHERE (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                f"{'AND run = ?' if run is not None else ''} ORDER BY attempts, updated LIMIT 1",
+                (now, run) if run is not None else (now,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?, "
+                             "attempts = attempts + 1, updated = ? WHERE run = ? AND device = ?",
+                             (worker, now + lease_seconds, now, row[0], row[1]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+        if row[4] == 'leased':
+            increment('fleet_leases_expired')
+        return {'run': row[0], 'device': row[1], 'key': row[2], 'attempts': row[3] + 1, 'worker': worker}
+
+    def _owned_update(self, job, assignments, values):
+        """Update a job only while the worker still holds its lease. Returns True if it did."""
+        with self._connect() as conn:
+            cursor = conn.execute(f"UPDATE jobs SET {assignments}, updated = ? "
+                                  "WHERE run = ? AND device = ? AND worker = ? AND state = 'leased'",
+                                  (*values, time.time(), job['run'], job['device'], job['worker']))
+            return cursor.rowcount == 1
+
+    def renew(self, job, lease_seconds=FLEET_LEASE_SECONDS):
+        """Extend the lease. False if it was lost (expired and claimed by another worker)."""
+        return self._owned_update(job, "lease_expires = ?", (time.time() + lease_seconds,))
+
+    def complete(self, job, result=''):
+        return self._owned_update(job, "state = 'done', result = ?, error = NULL", (result,))
+
+    def fail(self, job, error, max_attempts=FLEET_MAX_ATTEMPTS):
+        """Release a failed job for a retry, or give it up after max_attempts."""
+        state = 'failed' if job['attempts'] >= max_attempts else 'pending'
+        return self._owned_update(job, "state = ?, error = ?, lease_expires = NULL", (state, str(error)[:500]))
+
+    def jobs(self, run=None):
+        """Jobs as a DataFrame (one run, or all)."""
+        with self._connect() as conn:
+            return pd.read_sql("SELECT * FROM jobs" + (" WHERE run = ?" if run is not None else "")
+                               + " ORDER BY run, device", conn, params=(run,) if run is not None else None)
+
+    def counts(self, run=None):
+        """Jobs per state."""
+        states = self.jobs(run)['state'].value_counts()
+        return {state: int(states.get(state, 0)) for state in STATES}
+
+
+def train_device(device, key, model_dir=FLEET_MODEL_DIR):
+    """
+    Train one device's models into <model_dir>/<device>/<key>.pkl.
+    Models are written under a private name and renamed into place, the
+    main model last, so a concurrent duplicate of the job never leaves a
+    partial model behind.
+
+    Returns:
+    - Path of the main model file
+    """
+    from data_extraction import get_german_traffic_data
+    from model import TrafficPredictor, direction_model_paths
+
+    directory = os.path.join(model_dir, str(device))
+    os.makedirs(directory, exist_ok=True)
+    model_path = os.path.join(directory, f"{key}.pkl")
+    if os.path.exists(model_path):
+        return model_path  # Published by an earlier attempt that lost its lease
+
+    df = get_german_traffic_data(device, config.TRAINING_DATA_MONTHS)
+    if df is None or df.empty:
+        raise RuntimeError(f"no traffic data for {device}")
+    private = os.path.join(directory, f"{key}.{os.getpid()}")
+    if not TrafficPredictor().train_frame(df, model_path=f"{private}.pkl"):
+        raise RuntimeError(f"training failed for {device}")
+    for source, destination in zip(direction_model_paths(f"{private}.pkl"), direction_model_paths(model_path)):
+        if os.path.exists(source):
+            os.replace(source, destination)
+    os.replace(f"{private}.pkl", model_path)
+    return model_path
+
+
+class _LeaseKeeper(threading.Thread):
+    """Renews a job's lease in the background while it trains."""
+
+    def __init__(self, queue, job, lease_seconds):
+        super().__init__(daemon=True)
+        self.queue, self.job, self.lease_seconds = queue, job, lease_seconds
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            if not self.queue.renew(self.job, self.lease_seconds):
+                self.lost = True
+                return
+
+
+def run_worker(queue_path=FLEET_QUEUE_PATH, train=train_device, worker=None, run=None,
+               lease_seconds=FLEET_LEASE_SECONDS, poll_seconds=FLEET_POLL_SECONDS,
+               registry_path=MODEL_REGISTRY_PATH, max_jobs=None):
+    """
+    Claim, train and publish jobs until the queue is drained.
+
+    Parameters:
+    - train: train(device, key) -> model path (default: train_device)
+    - worker: Worker ID (default: host:pid)
+    - run: Only work on this run (default: any)
+    - max_jobs: Stop after this many jobs (None = until drained)
+
+    Returns:
+    - Number of jobs this worker published
+    """
+    from registry import register_model
+
+    queue = WorkQueue(queue_path)
+    worker = worker or default_worker_id()
+    published = 0
+    handled = 0
+    while max_jobs is None or handled < max_jobs:
+        job = queue.claim(worker, lease_seconds, run=run)
+        if job is None:
+            # Leased jobs may still come back if their worker dies
+            if queue.counts(run)['leased'] == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        handled += 1
+        keeper = _LeaseKeeper(queue, job, lease_seconds)
+        keeper.start()
+        try:
+            with timed('fleet.train'):
+                model_path = train(job['device'], job['key'])
+        except Exception as e:
+            keeper.stopped.set()
+            increment('errors', stage='fleet.train')
+            queue.fail(job, e)
+            print(f"❌ [{worker}] {job['device']} (attempt {job['attempts']}): {e}")
+            continue
+        keeper.stopped.set()
+        keeper.join()
+
+        if keeper.lost:
+            # Another worker owns the job now and publishes the same key
+            increment('fleet_leases_lost')
+            print(f"⚠️  [{worker}] lost the lease on {job['device']} - leaving it to the new owner")
+            continue
+        if register_model(job['device'], job['key'], model_path, path=registry_path, run=job['run'], worker=worker):
+            published += 1
+            increment('fleet_models_published')
+        queue.complete(job, model_path)
+        print(f"✅ [{worker}] {job['device']} published")
+    return published
+
+
+def _worker_process(queue_path, train, run, lease_seconds, poll_seconds, registry_path):
+    run_worker(queue_path, train, run=run, lease_seconds=lease_seconds, poll_seconds=poll_seconds,
+               registry_path=registry_path)
+
+
+def run_local(devices, processes=4, run=None, queue_path=FLEET_QUEUE_PATH, train=train_device,
+              lease_seconds=FLEET_LEASE_SECONDS, poll_seconds=FLEET_POLL_SECONDS,
+              registry_path=MODEL_REGISTRY_PATH):
+    """
+    Enqueue a run and work it with local processes standing in for nodes.
+
+    Returns:
+    - Job counts per state after the run
+    """
+    import multiprocessing
+
+    run = run or pd.Timestamp.now().strftime('%Y-%m-%d')
+    queue = WorkQueue(queue_path)
+    queue.enqueue(devices, run)
+    workers = [multiprocessing.Process(target=_worker_process,
+                                       args=(queue_path, train, run, lease_seconds, poll_seconds, registry_path))
+               for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    return queue.counts(run)
+
+
+if __name__ == "__main__":
+    """
+    Fleet retrain:
+      python fleet.py enqueue [run]     - one job per device of the fleet extract
+      python fleet.py worker [run]      - work the queue until drained (start one per node/core)
+      python fleet.py local N [run]     - enqueue and work with N local processes
+      python fleet.py status [run]
+    """
+    import sys
+
+    print("=" * 70)
+    print("🛰️  PROJECT ECOFLOW - FLEET TRAINING")
+    print("=" * 70)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    run_id = sys.argv[-1] if len(sys.argv) > (3 if command == 'local' else 2) else None
+
+    def fleet_devices():
+        path = f'data_cache/fleet_traffic_{config.TRAINING_DATA_MONTHS}m.csv'
+        if not os.path.exists(path):
+            print(f"\n❌ Fleet data not found: {path}")
+            print("⚠️  Run data_extraction.py (or global_model.py) first to extract the fleet traffic")
+            exit(1)
+        return sorted(pd.read_csv(path, usecols=['imei'], dtype={'imei': str})['imei'].unique())
+
+    if command == 'enqueue':
+        run_id = run_id or pd.Timestamp.now().strftime('%Y-%m-%d')
+        added = WorkQueue().enqueue(fleet_devices(), run_id)
+        print(f"\n📥 Enqueued {added} jobs for run {run_id}")
+    elif command == 'worker':
+        count = run_worker(run=run_id)
+        print(f"\n✅ Worker done: {count} models published")
+    elif command == 'local':
+        start = time.perf_counter()
+        counts = run_local(fleet_devices(), processes=int(sys.argv[2]), run=run_id)
+        print(f"\n✅ Fleet retrain finished in {time.perf_counter() - start:.1f}s: {counts}")
+    else:
+        print(WorkQueue().jobs(run_id).to_string(index=False))
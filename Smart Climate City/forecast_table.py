@@ -0,0 +1,244 @@
+"""
+Precomputed Forecast Tables for Project EcoFlow
+Materializes the Prophet forecasts into a compact NumPy table after training,
+so the dashboard can serve predictions with an O(1) lookup - without importing
+Prophet or unpickling the models
+"""
+
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import FORECAST_TABLE_PATH, FORECAST_TABLE_DAYS, MODEL_PATH
+from metrics import timed, increment
+from model import format_prediction
+
+SLOT_MINUTES = 15
+SERIES = ('total', 'tr1', 'tr2')
+COLUMNS = ('yhat', 'yhat_lower', 'yhat_upper')
+
+
+def build_forecast_table(predictor, days=FORECAST_TABLE_DAYS, chunk_days=30):
+    """
+    Run the trained models over a regular 15-minute grid starting right after
+    the end of the training data.
+
+    Parameters:
+    - predictor: Trained TrafficPredictor or SeasonalBaselinePredictor
+      (direction models used if present)
+    - days: Number of days to materialize
+    - chunk_days: Days per Prophet predict call (bounds peak memory)
+
+    Returns:
+    - dict of arrays ready for save_forecast_table()
+    """
+    start = predictor.training_end() + timedelta(minutes=SLOT_MINUTES)
+    periods = days * 24 * 60 // SLOT_MINUTES
+    ds = pd.date_range(start, periods=periods, freq=f'{SLOT_MINUTES}min')
+    chunk = chunk_days * 24 * 60 // SLOT_MINUTES
+
+    series_names = ['total']
+    if predictor.use_directions and predictor.model_tr1 is not None and predictor.model_tr2 is not None:
+        series_names += ['tr1', 'tr2']
+
+    table = {
+        'start': np.int64(start.value),
+        'slot_minutes': np.int64(SLOT_MINUTES),
+        'device_imei': np.array(str(predictor.device_imei)),
+        'created': np.array(datetime.now().isoformat())
+    }
+    if getattr(predictor, 'cap_15min', None) is not None:
+        table['cap_15min'] = np.float64(predictor.cap_15min)
+
+    print(f"\n📦 Materializing {days}-day forecast table ({periods:,} slots, {len(series_names)} series)...")
+    for name in series_names:
+        values = {column: np.empty(periods, dtype=np.float32) for column in COLUMNS}
+        with timed('forecast_table.build', series=name):
+            for i in range(0, periods, chunk):
+                forecast = predictor.forecast_frame(name, pd.DataFrame({'ds': ds[i:i + chunk]}))
+                for column in COLUMNS:
+                    values[column][i:i + chunk] = forecast[column].to_numpy()
+        for column in COLUMNS:
+            table[f'{name}_{column}'] = values[column]
+        print(f"   ✅ {name}: avg {values['yhat'].mean():.1f} vehicles/15min")
+
+    return table
+
+
+def save_forecast_table(table, path=FORECAST_TABLE_PATH):
+    """
+    Save a forecast table atomically (readers never see a partial file).
+
+    Parameters:
+    - table: dict returned by build_forecast_table()
+    - path: Destination .npz path
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **table)
+    os.replace(tmp_path, path)
+    print(f"💾 Forecast table saved to: {path}")
+    return True
+
+
+class ForecastTable:
+    """
+    Read-only view over a materialized forecast table.
+    Exposes the same prediction interface as TrafficPredictor.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.slot = timedelta(minutes=SLOT_MINUTES)
+        self.values = {}
+        self.periods = 0
+        self.device_imei = None
+        self.trained = False
+        self.use_directions = False
+        self.cap_15min = None  # Data-derived cap of the model the table was built from
+
+    def load(self, path=FORECAST_TABLE_PATH):
+        """
+        Load a forecast table from disk.
+
+        Parameters:
+        - path: .npz file written by save_forecast_table()
+
+        Returns:
+        - True if loaded, False otherwise
+        """
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with timed('forecast_table.load'), np.load(path) as data:
+                self.start = pd.Timestamp(int(data['start']))
+                self.slot = timedelta(minutes=int(data['slot_minutes']))
+                self.device_imei = str(data['device_imei'])
+                self.cap_15min = float(data['cap_15min']) if 'cap_15min' in data.files else None
+                self.values = {key: data[key] for key in data.files
+                               if key.startswith(SERIES)}
+            self.periods = len(self.values['total_yhat'])
+            self.use_directions = 'tr1_yhat' in self.values and 'tr2_yhat' in self.values
+            self.trained = True
+            return True
+        except Exception as e:
+            increment('errors', stage='forecast_table.load')
+            print(f"❌ Error loading forecast table: {e}")
+            return False
+
+    def is_current(self, model_path=MODEL_PATH, path=FORECAST_TABLE_PATH):
+        """Return True if the table on disk is at least as new as the model."""
+        if not os.path.exists(path):
+            return False
+        if not os.path.exists(model_path):
+            return True
+        return os.path.getmtime(path) >= os.path.getmtime(model_path)
+
+    def _slot_index(self, target_time):
+        """Index of the slot closest to target_time, or None if outside the table."""
+        idx = int(round((pd.Timestamp(target_time) - self.start) / self.slot))
+        if 0 <= idx < self.periods:
+            return idx
+        return None
+
+    def _row(self, series, idx):
+        return tuple(float(self.values[f'{series}_{column}'][idx]) for column in COLUMNS)
+
+    def forecast_frame(self, series, future):
+        """
+        Look up one series for a frame of timestamps (vectorized).
+
+        Parameters:
+        - series: 'total', 'tr1' or 'tr2'
+        - future: DataFrame with a 'ds' column
+
+        Returns:
+        - DataFrame with ds, yhat, yhat_lower, yhat_upper (NaN outside the table)
+        """
+        ds = pd.to_datetime(future['ds']).reset_index(drop=True)
+        idx = np.rint((ds - self.start) / self.slot).to_numpy()
+        valid = (idx >= 0) & (idx < self.periods)
+        safe = np.where(valid, idx, 0).astype(np.int64)
+        forecast = pd.DataFrame({'ds': ds})
+        for column in COLUMNS:
+            forecast[column] = np.where(valid, self.values[f'{series}_{column}'][safe], np.nan)
+        return forecast
+
+    def get_current_prediction(self, include_directions=False, minutes_ahead=15):
+        """
+        Get the prediction for N minutes from now.
+
+        Parameters:
+        - include_directions: If True, also return TR1 and TR2 predictions
+        - minutes_ahead: Number of minutes to predict ahead (default 15 minutes)
+
+        Returns:
+        - Dictionary with prediction details (same keys as TrafficPredictor),
+          or None if the target time falls outside the table
+        """
+        if not self.trained:
+            return None
+
+        with timed('forecast_table.lookup'):
+            target_time = (datetime.now() + timedelta(minutes=minutes_ahead)).replace(second=0, microsecond=0)
+            idx = self._slot_index(target_time)
+            if idx is None:
+                increment('fallbacks', path='forecast_table_out_of_range')
+                return None
+
+            # Same rule as TrafficPredictor: directions whenever they are available
+            with_directions = self.use_directions
+            return format_prediction(
+                self.start + idx * self.slot,
+                self._row('total', idx),
+                minutes_ahead,
+                tr1=self._row('tr1', idx) if with_directions else None,
+                tr2=self._row('tr2', idx) if with_directions else None,
+                cap=self.cap_15min
+            )
+
+    def predict(self, hours_ahead=24):
+        """
+        Return the next N hours of 15-minute forecasts starting from now.
+
+        Parameters:
+        - hours_ahead: Number of hours to return (default 24)
+
+        Returns:
+        - pandas DataFrame with ds, yhat, yhat_lower, yhat_upper (None if out of range)
+        """
+        if not self.trained:
+            return None
+
+        first = self._slot_index(datetime.now())
+        if first is None:
+            return None
+        last = min(self.periods, first + hours_ahead * 60 // int(self.slot.total_seconds() // 60))
+        ds = pd.date_range(self.start + first * self.slot, periods=last - first, freq=self.slot)
+        return pd.DataFrame({
+            'ds': ds,
+            **{column: self.values[f'total_{column}'][first:last] for column in COLUMNS}
+        })
+
+
+if __name__ == "__main__":
+    """
+    Build the forecast table from the saved Prophet models
+    """
+    from model import TrafficPredictor
+
+    print("=" * 70)
+    print("📦 PROJECT ECOFLOW - FORECAST TABLE")
+    print("=" * 70)
+
+    predictor = TrafficPredictor()
+    if not predictor.load_model(MODEL_PATH):
+        print("\n❌ No trained model found. Run model.py first.")
+        exit(1)
+
+    save_forecast_table(build_forecast_table(predictor))
+
+    table = ForecastTable()
+    table.load()
+    print(f"\n🔮 Next 15 minutes: {table.get_current_prediction(include_directions=True)}")
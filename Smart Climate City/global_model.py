@@ -0,0 +1,335 @@
+"""
+Global Cross-Device Forecaster for Project EcoFlow
+One ridge regression trained across every traffic sensor instead of one
+Prophet model per device. Features (recent lags, rolling means, seasonal
+lags, calendar terms and a device profile embedding) are built with
+vectorized NumPy gathers and strided windows over a devices x time panel,
+and batch inference covers every device and horizon with one einsum.
+Devices with little history borrow the fleet profile.
+"""
+
+import os
+import pickle
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from config import (
+    GLOBAL_MODEL_PATH,
+    GLOBAL_HORIZONS,
+    GLOBAL_RIDGE,
+    GLOBAL_MAX_TRAIN_ROWS,
+    GLOBAL_EMBEDDING_HARMONICS,
+    TRAINING_DATA_MONTHS
+)
+from metrics import timed
+from baseline import _calendar, SLOTS_PER_DAY, SLOTS_PER_WEEK
+
+SLOT = timedelta(minutes=15)
+RECENT_LAGS = (0, 1, 2, 3)            # Slots before the forecast origin
+ROLLING_WINDOWS = (4, 16, 96)         # 1 hour, 4 hours, 1 day
+SEASONAL_DAYS = 7                     # Same-slot mean over the last week
+DAILY_HARMONICS = 4
+WEEKLY_HARMONICS = 2
+
+
+def build_panel(df_15min, value_column='total_traffic', id_column='imei'):
+    """
+    Pivot long 15-minute aggregates into a dense devices x time matrix.
+
+    Parameters:
+    - df_15min: DataFrame with id_column, ds_15min and value_column
+    - value_column: Series to model
+    - id_column: Device identifier column
+
+    Returns:
+    - (devices array, start Timestamp, values matrix with NaN for missing slots)
+    """
+    ds = pd.to_datetime(df_15min['ds_15min'])
+    start = ds.min()
+    periods = int((ds.max() - start) / SLOT) + 1
+    ids = df_15min[id_column].astype(str).to_numpy()
+    devices = np.unique(ids)
+
+    panel = np.full((len(devices), periods), np.nan)
+    panel[np.searchsorted(devices, ids), ((ds - start) / SLOT).astype(np.int64).to_numpy()] = \
+        df_15min[value_column].to_numpy(dtype=float)
+    return devices, start, panel
+
+
+def _fourier(phase, harmonics):
+    """sin/cos columns for phase in [0, 1), shape (..., 2 * harmonics)."""
+    k = np.arange(1, harmonics + 1)
+    angle = 2 * np.pi * phase[..., None] * k
+    return np.concatenate([np.sin(angle), np.cos(angle)], axis=-1)
+
+
+def _rolling_mean(values, window):
+    """Trailing mean over `window` slots ending at each slot (strided view, no copy)."""
+    padded = np.concatenate([np.repeat(values[:, :1], window - 1, axis=1), values], axis=1)
+    return sliding_window_view(padded, window, axis=1).mean(axis=-1)
+
+
+class GlobalTrafficModel:
+    """
+    Direct multi-horizon ridge regression shared by all devices.
+    Each device is scaled by its mean level, so one set of weights serves
+    quiet side streets and arterials alike.
+    """
+
+    def __init__(self, series='total_traffic', horizons=GLOBAL_HORIZONS, ridge=GLOBAL_RIDGE,
+                 max_rows=GLOBAL_MAX_TRAIN_ROWS, embedding_harmonics=GLOBAL_EMBEDDING_HARMONICS):
+        """
+        Parameters:
+        - series: Value column to forecast ('total_traffic', 'tr1', 'tr2')
+        - horizons: Forecast horizons in 15-minute slots (max one day)
+        - ridge: L2 penalty
+        - max_rows: Training rows sampled per horizon (bounds cost as the fleet grows)
+        - embedding_harmonics: Fourier order of the device profile embedding
+        """
+        if max(horizons) > SLOTS_PER_DAY:
+            raise ValueError("Horizons beyond one day would need future seasonal lags")
+        self.series = series
+        self.horizons = tuple(horizons)
+        self.ridge = ridge
+        self.max_rows = max_rows
+        self.embedding_harmonics = embedding_harmonics
+        self.weights = None          # horizons x features
+        self.device_stats = {}       # device -> (scale, 96-slot normalized profile)
+        self.fleet_profile = None
+        self.trained_end = None
+
+    # ------------------------------------------------------------------
+    # Panel preparation
+    # ------------------------------------------------------------------
+    def _device_stats(self, devices, start, panel):
+        """Scale and normalized daily profile per device (stored ones take precedence)."""
+        n, periods = panel.shape
+        slot = _calendar(start + np.arange(periods) * SLOT)[1]
+        observed = np.isfinite(panel)
+        counts = observed.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scales = np.where(observed, panel, 0.0).sum(axis=1) / counts
+        scales = np.where(np.isfinite(scales) & (scales > 0), scales, 1.0)
+
+        # One bincount over (device, slot of day) pairs for every device at once
+        groups = (np.arange(n)[:, None] * SLOTS_PER_DAY + slot[None, :])[observed]
+        sums = np.bincount(groups, weights=(panel / scales[:, None])[observed], minlength=n * SLOTS_PER_DAY)
+        slot_counts = np.bincount(groups, minlength=n * SLOTS_PER_DAY)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            profiles = np.where(slot_counts > 0, sums / slot_counts, np.nan).reshape(n, SLOTS_PER_DAY)
+
+        for i, device in enumerate(devices):
+            if device in self.device_stats:
+                scales[i], profiles[i] = self.device_stats[device]
+        return scales, profiles
+
+    def _prepare(self, devices, start, panel):
+        """Normalize, gap-fill and precompute the rolling features of a panel."""
+        scales, profiles = self._device_stats(devices, start, panel)
+        if self.fleet_profile is not None:
+            # Devices with sparse history borrow the fleet shape for unseen slots
+            profiles = np.where(np.isfinite(profiles), profiles, self.fleet_profile)
+
+        slot = _calendar(start + np.arange(panel.shape[1]) * SLOT)[1]
+        normalized = panel / scales[:, None]
+        filled = np.where(np.isfinite(normalized), normalized, profiles[:, slot])
+        filled = np.nan_to_num(filled, nan=1.0)
+
+        k = np.arange(1, self.embedding_harmonics + 1)
+        angle = 2 * np.pi * np.outer(np.arange(SLOTS_PER_DAY) / SLOTS_PER_DAY, k)
+        clean_profiles = np.nan_to_num(profiles, nan=1.0)
+        embedding = np.concatenate([clean_profiles @ np.sin(angle), clean_profiles @ np.cos(angle)], axis=1) * 2 / SLOTS_PER_DAY
+
+        return {
+            'start': start,
+            'scales': scales,
+            'profiles': clean_profiles,
+            'normalized': normalized,
+            'filled': filled,
+            'rolling': [_rolling_mean(filled, window) for window in ROLLING_WINDOWS],
+            'embedding': embedding
+        }
+
+    def _design(self, prep, d, t, h):
+        """
+        Feature matrix for forecast origins (device d, slot t) at horizon h slots.
+        Every feature uses values at or before t only.
+        """
+        filled = prep['filled']
+        target = t + h
+        _, slot_of_day, slot_of_week = _calendar(
+            np.datetime64(prep['start'], 'm') + (target * 15).astype('timedelta64[m]'))
+
+        columns = [np.ones(len(d))]
+        columns += [filled[d, t - lag] for lag in RECENT_LAGS]
+        columns += [rolling[d, t] for rolling in prep['rolling']]
+        seasonal = np.stack([filled[d, target - SLOTS_PER_DAY * k] for k in range(1, SEASONAL_DAYS + 1)], axis=1)
+        columns += [seasonal[:, 0], seasonal.mean(axis=1), filled[d, target - SLOTS_PER_WEEK]]
+        columns.append(prep['profiles'][d, slot_of_day])
+
+        daily = _fourier(slot_of_day / SLOTS_PER_DAY, DAILY_HARMONICS)
+        weekly = _fourier(slot_of_week / SLOTS_PER_WEEK, WEEKLY_HARMONICS)
+        embedding = prep['embedding'][d]
+        # Device shape x time of day, so one weight vector can express many daily profiles
+        shape_terms = _fourier(slot_of_day / SLOTS_PER_DAY, self.embedding_harmonics)
+        interactions = (embedding[:, :, None] * shape_terms[:, None, :]).reshape(len(d), -1)
+
+        return np.column_stack(columns + [daily, weekly, embedding, interactions])
+
+    # ------------------------------------------------------------------
+    # Training and inference
+    # ------------------------------------------------------------------
+    def fit(self, df_15min, id_column='imei', seed=0):
+        """
+        Train on long 15-minute aggregates for the whole fleet.
+
+        Parameters:
+        - df_15min: DataFrame with id_column, ds_15min and the series column
+        - id_column: Device identifier column
+        - seed: Seed for the training row sample
+
+        Returns:
+        - self
+        """
+        devices, start, panel = build_panel(df_15min, self.series, id_column)
+        self.device_stats = {}
+        with timed('global_model.prepare', devices=len(devices)):
+            scales, profiles = self._device_stats(devices, start, panel)
+            self.device_stats = {device: (scales[i], profiles[i]) for i, device in enumerate(devices)}
+            self.fleet_profile = np.nanmean(profiles, axis=0)
+            prep = self._prepare(devices, start, panel)
+
+        rng = np.random.default_rng(seed)
+        normalized = prep['normalized']
+        weights = []
+        with timed('global_model.fit', devices=len(devices)):
+            for h in self.horizons:
+                # Origins with a full week of history, an observed origin and an observed target
+                d, t = np.nonzero(np.isfinite(normalized[:, SLOTS_PER_WEEK:panel.shape[1] - h]))
+                t = t + SLOTS_PER_WEEK
+                keep = np.isfinite(normalized[d, t + h])
+                d, t = d[keep], t[keep]
+                if len(d) > self.max_rows:
+                    pick = rng.choice(len(d), size=self.max_rows, replace=False)
+                    d, t = d[pick], t[pick]
+                if len(d) == 0:
+                    raise ValueError("Not enough history: need at least one week per device")
+
+                X = self._design(prep, d, t, h)
+                y = normalized[d, t + h]
+                penalty = self.ridge * len(d) * np.eye(X.shape[1])
+                penalty[0, 0] = 0.0  # Don't shrink the intercept
+                weights.append(np.linalg.solve(X.T @ X + penalty, X.T @ y))
+        self.weights = np.stack(weights)
+        self.trained_end = start + (panel.shape[1] - 1) * SLOT
+        print(f"✅ Global model trained on {len(devices)} devices, {len(self.horizons)} horizons, "
+              f"{self.weights.shape[1]} features")
+        return self
+
+    def predict_fleet(self, df_15min, id_column='imei', origin=None):
+        """
+        Forecast every device and horizon in one batch.
+
+        Parameters:
+        - df_15min: Recent 15-minute aggregates (at least one week per device)
+        - id_column: Device identifier column
+        - origin: Forecast origin timestamp (default: last slot in the data)
+
+        Returns:
+        - DataFrame with device, ds, horizon_minutes, yhat
+        """
+        devices, start, panel = build_panel(df_15min, self.series, id_column)
+        with timed('global_model.predict', devices=len(devices)):
+            prep = self._prepare(devices, start, panel)
+            t_origin = panel.shape[1] - 1 if origin is None else int((pd.Timestamp(origin) - start) / SLOT)
+
+            d = np.repeat(np.arange(len(devices)), len(self.horizons))
+            h = np.tile(np.array(self.horizons), len(devices))
+            t = np.full(len(d), t_origin)
+            X = self._design(prep, d, t, h)
+            # (devices x horizons, features) . (horizons, features) in one einsum
+            horizon_index = np.tile(np.arange(len(self.horizons)), len(devices))
+            yhat = np.einsum('rp,rp->r', X, self.weights[horizon_index]) * prep['scales'][d]
+
+        return pd.DataFrame({
+            'device': devices[d],
+            'ds': start + pd.to_timedelta((t + h) * 15, unit='m'),
+            'horizon_minutes': h * 15,
+            'yhat': np.maximum(yhat, 0.0)
+        })
+
+    def evaluate(self, df_15min, cutoff, id_column='imei', step_slots=SLOTS_PER_DAY // 4):
+        """
+        Holdout MAE per horizon over forecast origins after `cutoff`
+        (fit on data up to the cutoff first).
+
+        Returns:
+        - DataFrame with horizon_minutes, mae, naive_mae (same slot yesterday)
+        """
+        devices, start, panel = build_panel(df_15min, self.series, id_column)
+        prep = self._prepare(devices, start, panel)
+        first = max(int((pd.Timestamp(cutoff) - start) / SLOT), SLOTS_PER_WEEK)
+        rows = []
+        for i, h in enumerate(self.horizons):
+            origins = np.arange(first, panel.shape[1] - h, step_slots)
+            d = np.repeat(np.arange(len(devices)), len(origins))
+            t = np.tile(origins, len(devices))
+            actual = panel[d, t + h]
+            keep = np.isfinite(actual)
+            d, t, actual = d[keep], t[keep], actual[keep]
+            yhat = np.maximum(self._design(prep, d, t, h) @ self.weights[i], 0.0) * prep['scales'][d]
+            naive = prep['filled'][d, t + h - SLOTS_PER_DAY] * prep['scales'][d]
+            rows.append({'horizon_minutes': h * 15, 'mae': np.mean(np.abs(yhat - actual)),
+                         'naive_mae': np.mean(np.abs(naive - actual)), 'n': len(actual)})
+        return pd.DataFrame(rows)
+
+    def save_model(self, path=GLOBAL_MODEL_PATH):
+        """Save the trained model to disk."""
+        with open(path, 'wb') as f:
+            pickle.dump({'model': self, 'trained_date': datetime.now()}, f)
+        print(f"💾 Global model saved to: {path}")
+        return True
+
+    @staticmethod
+    def load_model(path=GLOBAL_MODEL_PATH):
+        """
+        Load a trained model from disk.
+
+        Returns:
+        - GlobalTrafficModel, or None if not found
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)['model']
+
+
+if __name__ == "__main__":
+    """
+    Train the global model on the whole fleet and compare it on the last week
+    """
+    from data_extraction import get_fleet_traffic_15min
+
+    print("=" * 70)
+    print("🌐 PROJECT ECOFLOW - GLOBAL FLEET MODEL")
+    print("=" * 70)
+
+    data_path = f'data_cache/fleet_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if os.path.exists(data_path):
+        fleet = pd.read_csv(data_path)
+    else:
+        fleet = get_fleet_traffic_15min()
+        if fleet is None:
+            print("\n❌ Could not load fleet data")
+            exit(1)
+
+    cutoff = pd.to_datetime(fleet['ds_15min']).max() - timedelta(days=7)
+    holdout = GlobalTrafficModel().fit(fleet[pd.to_datetime(fleet['ds_15min']) <= cutoff])
+    print("\n📊 7-day holdout (vehicles/15min):")
+    print(holdout.evaluate(fleet, cutoff).to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+
+    model = GlobalTrafficModel().fit(fleet)
+    model.save_model()
+    forecast = model.predict_fleet(fleet)
+    print(f"\n🔮 Forecast {forecast['device'].nunique()} devices x {len(model.horizons)} horizons")
@@ -0,0 +1,230 @@
+"""
+Health Impact and Population Exposure for Project EcoFlow
+Vectorized classification of PM10/PM2.5 into health bands (searchsorted
+over threshold tables), exposure-hours per band over time, and
+population-weighted exposure on the interpolated pollution surface.
+Neighbour weights for the population points are computed once, so an
+hourly city report is a handful of array operations per hour.
+"""
+
+import numpy as np
+import pandas as pd
+from config import POPULATION_GRID_PATH
+from metrics import timed
+
+LEVELS = ('Excellent', 'Good', 'Moderate', 'Unhealthy', 'Hazardous')
+COLORS = ('#00C853', '#64DD17', '#FFD600', '#FF6D00', '#DD2C00')
+MESSAGES = (
+    "Air quality is excellent. Ideal for outdoor activities.",
+    "Air quality is good. Safe for all activities.",
+    "Air quality is acceptable for most people.",
+    "Sensitive groups should limit outdoor activities.",
+    "Health warning! Everyone should avoid outdoor activities."
+)
+
+# Upper bound (inclusive, µg/m³) of every band but the last - European AQI
+# bands, as used by logic.calculate_health_impact for PM10
+BAND_LIMITS = {
+    'pm10': np.array([20.0, 40.0, 50.0, 100.0]),
+    'pm25': np.array([10.0, 20.0, 25.0, 50.0])
+}
+
+
+def classify(values, pollutant='pm10'):
+    """
+    Health band of every value.
+
+    Parameters:
+    - values: Concentrations in µg/m³ (scalar or array)
+    - pollutant: 'pm10' or 'pm25'
+
+    Returns:
+    - int8 array of indices into LEVELS (-1 where the value is NaN)
+    """
+    values = np.asarray(values, dtype=float)
+    codes = np.searchsorted(BAND_LIMITS[pollutant], values, side='left').astype(np.int8)
+    return np.where(np.isnan(values), np.int8(-1), codes)
+
+
+def band_labels(codes):
+    """Band codes -> categorical of level names (NaN for -1)."""
+    return pd.Categorical.from_codes(np.asarray(codes), categories=list(LEVELS))
+
+
+def exposure_hours(frame, value_column='p10', pollutant='pm10', by=('imei',), slot_minutes=15):
+    """
+    Hours spent in every band, per group.
+
+    Parameters:
+    - frame: Readings with one row per slot (e.g. get_air_quality_data() output)
+    - value_column: Concentration column
+    - by: Grouping columns (e.g. ('imei',) or ('imei', 'day'); () = one total)
+    - slot_minutes: Duration of one row
+
+    Returns:
+    - DataFrame indexed by the groups with one column of hours per level
+    """
+    codes = classify(frame[value_column].to_numpy(dtype=float), pollutant)
+    if by:
+        group, keys = pd.MultiIndex.from_frame(frame[list(by)]).factorize()
+    else:
+        group, keys = np.zeros(len(frame), dtype=np.int64), pd.Index(['all'])
+    valid = codes >= 0
+    cells = np.bincount(group[valid] * len(LEVELS) + codes[valid], minlength=len(keys) * len(LEVELS))
+    hours = cells.reshape(len(keys), len(LEVELS)) * slot_minutes / 60
+    return pd.DataFrame(hours, index=keys, columns=list(LEVELS))
+
+
+def hourly_sensor_values(readings, sensor_ids, value_column='p10'):
+    """
+    Hourly mean per sensor as a (hours, sensors) matrix.
+
+    Parameters:
+    - readings: Rows with imei, ds_15min and the value column
+    - sensor_ids: Sensor order of the matrix (e.g. PollutionSurface.sensor_ids)
+
+    Returns:
+    - (DatetimeIndex of hours, matrix; NaN where a sensor has no reading)
+    """
+    sensor = pd.Index([str(s) for s in sensor_ids]).get_indexer(readings['imei'].astype(str))
+    values = readings[value_column].to_numpy(dtype=float)
+    keep = (sensor >= 0) & np.isfinite(values)
+    hour_codes, hours = pd.factorize(pd.to_datetime(readings['ds_15min']).dt.floor('h')[keep], sort=True)
+    flat = hour_codes * len(sensor_ids) + sensor[keep]
+    size = len(hours) * len(sensor_ids)
+    sums = np.bincount(flat, weights=values[keep], minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matrix = np.where(counts > 0, sums / counts, np.nan).reshape(len(hours), len(sensor_ids))
+    return pd.DatetimeIndex(hours), matrix
+
+
+class PopulationExposure:
+    """
+    Population-weighted exposure on a spatial.PollutionSurface. The IDW
+    neighbours and weights of the population points are fixed, so every
+    window costs one weighted blend.
+    """
+
+    def __init__(self, surface, latitudes=None, longitudes=None, population=None, pollutant='pm10'):
+        """
+        Parameters:
+        - surface: spatial.PollutionSurface
+        - latitudes, longitudes, population: Population grid (default: every
+          surface cell with population 1, i.e. area weighting)
+        - pollutant: Band table used for the report
+        """
+        if latitudes is None:
+            latitudes, longitudes = surface.cell_latitudes, surface.cell_longitudes
+            population = np.ones(len(latitudes))
+        self.surface = surface
+        self.population = np.asarray(population, dtype=float)
+        self.pollutant = pollutant
+        self.indices, self.weights = surface._weights(surface.project(latitudes, longitudes))
+
+    def concentrations(self, values):
+        """
+        Concentration at every population point.
+
+        Parameters:
+        - values: Sensor values, (sensors,) or (windows, sensors)
+
+        Returns:
+        - Array (points,) or (windows, points); NaN beyond the sensor coverage
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        neighbour_values = values[:, self.indices]  # (windows, points, k)
+        valid = np.isfinite(neighbour_values) & (self.weights > 0)
+        w = np.where(valid, self.weights, 0.0)
+        total = w.sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            blended = np.where(total > 0, (w * np.where(valid, neighbour_values, 0.0)).sum(axis=2) / total, np.nan)
+        return blended
+
+    def report(self, values, windows=None, window_hours=1.0):
+        """
+        Exposure report with one row per window.
+
+        Parameters:
+        - values: Sensor values, (windows, sensors)
+        - windows: Window labels (default: 0..n-1)
+        - window_hours: Duration of one window (for person-hours)
+
+        Returns:
+        - DataFrame indexed by window with population_weighted (mean
+          concentration per person), covered (population with an estimate),
+          one column of people per level and one of person-hours per level
+        """
+        with timed('health.report', windows=len(np.atleast_2d(values))):
+            levels = self.concentrations(values)
+            codes = classify(levels, self.pollutant)
+            n_windows = len(levels)
+            covered = codes >= 0
+
+            flat = (np.arange(n_windows)[:, None] * len(LEVELS) + codes)[covered]
+            weights = np.broadcast_to(self.population, codes.shape)[covered]
+            people = np.bincount(flat, weights=weights, minlength=n_windows * len(LEVELS)).reshape(n_windows, len(LEVELS))
+            population_total = np.where(covered, self.population, 0.0).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weighted = np.where(covered, levels * self.population, 0.0).sum(axis=1) / population_total
+
+        result = pd.DataFrame(people, columns=list(LEVELS), index=windows)
+        result.insert(0, 'covered', population_total)
+        result.insert(0, 'population_weighted', weighted)
+        for i, level in enumerate(LEVELS):
+            result[f'{level}_person_hours'] = people[:, i] * window_hours
+        return result
+
+
+def load_population(path=POPULATION_GRID_PATH):
+    """Population grid (latitude, longitude, population), or None if not provided."""
+    import os
+
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path).dropna(subset=['latitude', 'longitude', 'population'])
+
+
+def exposure_for_surface(surface, path=POPULATION_GRID_PATH):
+    """PopulationExposure on the population grid if available, else area-weighted."""
+    population = load_population(path)
+    if population is None:
+        return PopulationExposure(surface)
+    return PopulationExposure(surface, population['latitude'], population['longitude'], population['population'])
+
+
+if __name__ == "__main__":
+    """
+    Hourly population exposure report from the extracted air quality data
+    """
+    import os
+    import time
+    from config import AQ_DATA_MONTHS
+
+    print("=" * 70)
+    print("🫁 PROJECT ECOFLOW - HEALTH EXPOSURE")
+    print("=" * 70)
+
+    readings_path = f'data_cache/air_quality_{AQ_DATA_MONTHS}m.csv'
+    locations_path = 'data_cache/device_locations.csv'
+    if not os.path.exists(readings_path) or not os.path.exists(locations_path):
+        print(f"\n❌ Data not found: {readings_path} / {locations_path}")
+        print("⚠️  Run data_extraction.py first to extract the air quality data")
+        exit(1)
+
+    from spatial import PollutionSurface
+
+    readings = pd.read_csv(readings_path)
+    locations = pd.read_csv(locations_path, dtype={'imei': str}).dropna(subset=['latitude', 'longitude'])
+    locations = locations[locations['imei'].isin(readings['imei'].astype(str))]
+    surface = PollutionSurface(locations['latitude'], locations['longitude'], sensor_ids=locations['imei'].tolist())
+
+    start = time.perf_counter()
+    exposure = exposure_for_surface(surface)
+    hours, matrix = hourly_sensor_values(readings, surface.sensor_ids)
+    report = exposure.report(matrix, windows=hours)
+    print(f"\n✅ {len(report):,} hourly reports in {time.perf_counter() - start:.2f}s")
+    print(report.tail(24)[['population_weighted', *LEVELS]].round(1).to_string())
+
+    print("\n⏱️  Hours per band and device:")
+    print(exposure_hours(readings).round(1).to_string())
@@ -3,13 +3,23 @@ Smart Intersection Logic Engine for Project EcoFlow
 Decides traffic light timing and routing based on predicted traffic and air quality
 """
 
+from datetime import datetime
 from config import (
     DEFAULT_CAPACITY_THRESHOLD,
     STANDARD_GREEN_DURATION,
     EXTENDED_GREEN_DURATION,
     EMERGENCY_PM10_THRESHOLD,
-    EMERGENCY_PM25_THRESHOLD
+    EMERGENCY_PM25_THRESHOLD,
+    HYSTERESIS_PM10_EXIT_THRESHOLD,
+    HYSTERESIS_CAPACITY_EXIT_RATIO,
+    HYSTERESIS_MIN_DWELL_MINUTES,
+    HYSTERESIS_MAX_TRANSITIONS_PER_HOUR
 )
+import numpy as np
+from metrics import timed
+
+# Action codes of decide_batch()
+ACTIONS = ('NORMAL', 'EXTEND_GREEN', 'REROUTE')
 
 
 class SmartIntersection:
@@ -19,45 +29,61 @@ class SmartIntersection:
     Features:
     - Congestion management: Extends green lights during high traffic
     - Climate override: Suggests rerouting when air pollution is hazardous
+    - Optional hysteresis: no flapping around the thresholds (HysteresisController)
     """
 
-    def __init__(self, name, capacity_threshold=DEFAULT_CAPACITY_THRESHOLD):
+    def __init__(self, name, capacity_threshold=DEFAULT_CAPACITY_THRESHOLD, hysteresis=False):
         """
         Initialize a smart intersection.
 
         Parameters:
         - name: Name of the intersection (e.g., "Heilbronn Center")
         - capacity_threshold: Traffic volume (cars/hr) that triggers congestion mode
+        - hysteresis: Use enter/exit thresholds, minimum dwell and a transition
+          rate limit; only actual transitions are recorded in decision_history
         """
         self.name = name
         self.capacity = capacity_threshold
         self.state = "NORMAL"
         self.green_light_duration = STANDARD_GREEN_DURATION
         self.decision_history = []
+        self.controller = HysteresisController(1, capacity_threshold) if hysteresis else None
 
-    def decide(self, predicted_traffic, current_aqi):
+    @timed('logic.decide')
+    def decide(self, predicted_traffic, current_aqi, predicted_aqi=None, noise_level=None, now=None):
         """
         Make a traffic control decision based on predicted traffic and air quality.
 
         Parameters:
         - predicted_traffic: Predicted traffic volume (vehicles per hour)
         - current_aqi: Current air quality index - PM10 level (µg/m³)
+        - predicted_aqi: Optional peak PM10 forecast for the next hour (µg/m³),
+          e.g. from AirQualityForecaster.peak_pm10(); a predicted exceedance
+          triggers rerouting before the air becomes hazardous
+        - noise_level: Optional current noise Leq in dB(A); loud streets with
+          elevated PM10 are rerouted on the combined exposure score
+        - now: Time of the decision (hysteresis only; default: now)
 
         Returns:
         - str: Status message describing the decision
         """
         traffic_status = "NORMAL"
         air_status = "GOOD"
+        capacity, pm10_threshold = self.capacity, EMERGENCY_PM10_THRESHOLD
+        if self.controller is not None:
+            # Exit thresholds apply while the matching state is active
+            capacities, pm10_thresholds = self.controller.thresholds()
+            capacity, pm10_threshold = capacities[0], pm10_thresholds[0]
 
         # ====================================================================
         # RULE 1: CONGESTION MANAGEMENT
         # ====================================================================
         # If predicted traffic exceeds capacity, extend green light duration
-        if predicted_traffic > self.capacity:
-            self.green_light_duration = EXTENDED_GREEN_DURATION
+        if predicted_traffic > capacity:
+            green_light_duration = EXTENDED_GREEN_DURATION
             traffic_status = "HEAVY"
         else:
-            self.green_light_duration = STANDARD_GREEN_DURATION
+            green_light_duration = STANDARD_GREEN_DURATION
             traffic_status = "NORMAL"
 
         # ====================================================================
@@ -65,28 +91,52 @@ class SmartIntersection:
         # ====================================================================
         # If air pollution exceeds emergency threshold, prioritize public health
         # over traffic flow by suggesting rerouting
-        if current_aqi > EMERGENCY_PM10_THRESHOLD:
+        if current_aqi > pm10_threshold:
             air_status = "HAZARDOUS"
-            self.state = "⛔ REROUTING (Toxic Air)"
+            state = "⛔ REROUTING (Toxic Air)"
             action = "REROUTE"
             reason = f"PM10 level ({current_aqi:.1f} µg/m³) exceeds safe limit"
 
+        elif predicted_aqi is not None and predicted_aqi > pm10_threshold:
+            air_status = "HAZARDOUS FORECAST"
+            state = "⛔ REROUTING (Toxic Air Forecast)"
+            action = "REROUTE"
+            reason = f"PM10 forecast to reach {predicted_aqi:.1f} µg/m³ within the hour"
+
+        elif noise_level is not None and _combined_exposure(current_aqi, noise_level, pm10_threshold) > 1.0:
+            air_status = "HAZARDOUS (COMBINED)"
+            state = "⛔ REROUTING (Air + Noise)"
+            action = "REROUTE"
+            reason = f"PM10 {current_aqi:.1f} µg/m³ combined with {noise_level:.0f} dB(A) noise"
+
         elif traffic_status == "HEAVY":
             air_status = "ACCEPTABLE"
-            self.state = f"🟢 MAX FLOW (Green: {self.green_light_duration}s)"
+            state = f"🟢 MAX FLOW (Green: {green_light_duration}s)"
             action = "EXTEND_GREEN"
             reason = f"High traffic volume ({predicted_traffic:.0f} cars/hr)"
 
         else:
             air_status = "GOOD"
-            self.state = f"🟢 STANDARD (Green: {self.green_light_duration}s)"
+            state = f"🟢 STANDARD (Green: {green_light_duration}s)"
             action = "NORMAL"
             reason = "Normal traffic and air quality"
 
+        if self.controller is not None:
+            _, changed = self.controller.step([ACTIONS.index(action)], now)
+            if not changed[0]:
+                # Same state, or a transition held back by dwell/rate limit:
+                # nothing is actuated and nothing is recorded
+                return self.state
+
+        self.state = state
+        self.green_light_duration = green_light_duration
+
         # Log decision
         decision = {
             'traffic': predicted_traffic,
             'aqi': current_aqi,
+            'predicted_aqi': predicted_aqi,
+            'noise_level': noise_level,
             'traffic_status': traffic_status,
             'air_status': air_status,
             'action': action,
@@ -130,6 +180,8 @@ class SmartIntersection:
         self.state = "NORMAL"
         self.green_light_duration = STANDARD_GREEN_DURATION
         self.decision_history = []
+        if self.controller is not None:
+            self.controller = HysteresisController(1, self.capacity)
 
 
 class TrafficNetwork:
@@ -154,10 +206,146 @@ class TrafficNetwork:
         return {name: intersection.state
                 for name, intersection in self.intersections.items()}
 
+    def build_controller(self, **params):
+        """
+        One batch HysteresisController for the whole network, with each
+        intersection's capacity threshold. Row i belongs to the i-th name
+        of self.intersections (insertion order).
+        """
+        capacities = [intersection.capacity for intersection in self.intersections.values()]
+        return HysteresisController(len(capacities), capacities, **params)
+
+
+class HysteresisController:
+    """
+    Flap-free state machine over the decide() rules for one or many
+    intersections (all state is a few arrays, one entry per intersection,
+    so an update is O(1) per intersection and one vectorized call per network):
+    - Enter/exit thresholds: rerouting starts above EMERGENCY_PM10_THRESHOLD
+      and ends below HYSTERESIS_PM10_EXIT_THRESHOLD; extended green ends below
+      HYSTERESIS_CAPACITY_EXIT_RATIO of the capacity threshold
+    - Minimum dwell: a state is left only after HYSTERESIS_MIN_DWELL_MINUTES
+    - Rate limit: a token bucket of HYSTERESIS_MAX_TRANSITIONS_PER_HOUR
+    Escalation to REROUTE bypasses dwell and rate limit - health first.
+    """
+
+    def __init__(self, n=1, capacity_threshold=DEFAULT_CAPACITY_THRESHOLD,
+                 pm10_enter=EMERGENCY_PM10_THRESHOLD, pm10_exit=HYSTERESIS_PM10_EXIT_THRESHOLD,
+                 capacity_exit_ratio=HYSTERESIS_CAPACITY_EXIT_RATIO,
+                 min_dwell_minutes=HYSTERESIS_MIN_DWELL_MINUTES,
+                 max_transitions_per_hour=HYSTERESIS_MAX_TRANSITIONS_PER_HOUR):
+        """
+        Parameters:
+        - n: Number of intersections
+        - capacity_threshold: Capacity (cars/hr), scalar or one per intersection
+        - pm10_enter, pm10_exit: Rerouting enter/exit thresholds (µg/m³)
+        - capacity_exit_ratio: Extended green exit threshold as a share of capacity
+        - min_dwell_minutes: Minimum time in a state before leaving it
+        - max_transitions_per_hour: Transition budget (token bucket size and refill rate)
+        """
+        self.capacity = np.broadcast_to(np.asarray(capacity_threshold, dtype=float), (n,)).copy()
+        self.pm10_enter = pm10_enter
+        self.pm10_exit = pm10_exit
+        self.capacity_exit_ratio = capacity_exit_ratio
+        self.min_dwell_seconds = min_dwell_minutes * 60
+        self.max_transitions_per_hour = float(max_transitions_per_hour)
+
+        self.action = np.full(n, -1, dtype=np.int8)  # -1 = no decision yet
+        self.since = np.full(n, np.nan)  # Epoch seconds of the last transition
+        self.tokens = np.full(n, self.max_transitions_per_hour)
+        self.refilled = np.full(n, np.nan)
+        self.transitions = 0
+        self.suppressed = 0
+
+    def thresholds(self):
+        """(capacity, PM10) thresholds in effect for each intersection's current state."""
+        capacity = np.where(self.action == 1, self.capacity * self.capacity_exit_ratio, self.capacity)
+        pm10 = np.where(self.action == 2, self.pm10_exit, self.pm10_enter)
+        return capacity, pm10
+
+    def step(self, desired, now=None):
+        """
+        Apply dwell and rate limit to the desired actions.
+
+        Parameters:
+        - desired: Action codes (ACTIONS indices), one per intersection
+        - now: Time of the update (default: now)
+
+        Returns:
+        - (current action codes, bool array of intersections that changed state)
+        """
+        t = (now or datetime.now()).timestamp()
+        desired = np.asarray(desired, dtype=np.int8)
+
+        elapsed_hours = np.nan_to_num((t - self.refilled) / 3600, nan=0.0)
+        self.tokens = np.minimum(self.max_transitions_per_hour,
+                                 self.tokens + np.maximum(elapsed_hours, 0) * self.max_transitions_per_hour)
+        self.refilled[:] = t
+
+        wants = desired != self.action
+        escalation = (desired == 2) & (self.action != 2)
+        settled = np.isnan(self.since) | (t - self.since >= self.min_dwell_seconds)
+        changed = wants & (escalation | (settled & (self.tokens >= 1)))
+
+        self.tokens[changed] = np.maximum(self.tokens[changed] - 1, 0)
+        self.action[changed] = desired[changed]
+        self.since[changed] = t
+        self.transitions += int(changed.sum())
+        self.suppressed += int((wants & ~changed).sum())
+        return self.action.copy(), changed
+
+    def update(self, predicted_traffic, current_aqi, now=None, predicted_aqi=None, noise_level=None):
+        """
+        One decision round for every intersection (arrays of length n or scalars).
+
+        Returns:
+        - (current action codes, bool array of intersections that changed state)
+        """
+        capacity, pm10 = self.thresholds()
+        desired = decide_batch(predicted_traffic, current_aqi, predicted_aqi, noise_level,
+                               capacity_threshold=capacity, pm10_threshold=pm10)
+        return self.step(np.broadcast_to(desired, self.action.shape), now)
+
+
+def _combined_exposure(pm10, noise_level, threshold):
+    # Imported on first use: noise.py (and health.py) pull in pandas, which
+    # the decision path does not otherwise need at startup
+    from noise import combined_exposure
+    return combined_exposure(pm10, noise_level, threshold=threshold)
+
+
+def decide_batch(predicted_traffic, current_aqi, predicted_aqi=None, noise_level=None,
+                 capacity_threshold=DEFAULT_CAPACITY_THRESHOLD, pm10_threshold=EMERGENCY_PM10_THRESHOLD):
+    """
+    SmartIntersection.decide() rules over arrays. Inputs broadcast, so
+    threshold grids can be passed as extra axes. NaN inputs never trigger
+    a rule (like a missing forecast or noise level in decide()).
+
+    Parameters:
+    - predicted_traffic: Traffic volume (vehicles per hour)
+    - current_aqi: PM10 (µg/m³)
+    - predicted_aqi: Optional PM10 forecast (µg/m³)
+    - noise_level: Optional noise Leq in dB(A)
+    - capacity_threshold: Congestion threshold (vehicles per hour)
+    - pm10_threshold: Rerouting threshold (µg/m³)
+
+    Returns:
+    - int8 array of action codes (indices into ACTIONS)
+    """
+    pm10 = np.asarray(current_aqi, dtype=float)
+    reroute = pm10 > pm10_threshold
+    if predicted_aqi is not None:
+        reroute = reroute | (np.asarray(predicted_aqi, dtype=float) > pm10_threshold)
+    if noise_level is not None:
+        reroute = reroute | (_combined_exposure(pm10, noise_level, pm10_threshold) > 1.0)
+    heavy = np.asarray(predicted_traffic, dtype=float) > capacity_threshold
+    return np.where(reroute, np.int8(2), heavy.astype(np.int8))
+
 
 def calculate_health_impact(aqi_pm10):
     """
     Calculate health impact based on PM10 levels (WHO guidelines).
+    Single-value form of health.classify(); use that for arrays.
 
     Parameters:
     - aqi_pm10: PM10 level in µg/m³
@@ -165,26 +353,10 @@ def calculate_health_impact(aqi_pm10):
     Returns:
     - dict: Health impact information
     """
-    if aqi_pm10 <= 20:
-        level = "Excellent"
-        color = "#00C853"  # Green
-        message = "Air quality is excellent. Ideal for outdoor activities."
-    elif aqi_pm10 <= 40:
-        level = "Good"
-        color = "#64DD17"  # Light green
-        message = "Air quality is good. Safe for all activities."
-    elif aqi_pm10 <= 50:
-        level = "Moderate"
-        color = "#FFD600"  # Yellow
-        message = "Air quality is acceptable for most people."
-    elif aqi_pm10 <= 100:
-        level = "Unhealthy"
-        color = "#FF6D00"  # Orange
-        message = "Sensitive groups should limit outdoor activities."
-    else:
-        level = "Hazardous"
-        color = "#DD2C00"  # Red
-        message = "Health warning! Everyone should avoid outdoor activities."
+    from health import classify, LEVELS, COLORS, MESSAGES
+
+    band = int(classify(aqi_pm10, 'pm10'))
+    level, color, message = LEVELS[band], COLORS[band], MESSAGES[band]
 
     return {
         'level': level,
@@ -0,0 +1,306 @@
+"""
+Instrumentation Module for Project EcoFlow
+Timers and counters for the hot paths (database queries, Prophet fit/predict,
+model loading, decision logic) with Prometheus text export and a rolling
+window of recent timings for the in-app diagnostics panel
+"""
+
+import os
+import threading
+import time
+import functools
+from collections import deque, defaultdict
+from config import METRICS_WINDOW_SIZE, METRICS_TEXTFILE_PATH
+
+# Prometheus histogram bucket upper bounds (seconds)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)      # (name, labels) -> value
+_durations = {}                     # (stage, labels) -> {'count', 'sum', 'max', 'buckets'}
+_recent = deque(maxlen=METRICS_WINDOW_SIZE)
+
+
+def _label_key(labels):
+    """Turn a labels dict into a hashable, order-independent key."""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label(value):
+    """Escape a label value per the text exposition format (backslash, quote, newline)."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=None):
+    """Render a label key as Prometheus label text, e.g. {stage="db",le="0.1"}."""
+    pairs = list(label_key) + list(extra or [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+# ============================================================================
+# COUNTERS
+# ============================================================================
+def increment(name, amount=1, **labels):
+    """
+    Increment a counter.
+
+    Parameters:
+    - name: Counter name without prefix/suffix (e.g. 'fallbacks')
+    - amount: Value to add (default 1)
+    - labels: Optional label values (e.g. path='sensor_location')
+    """
+    with _lock:
+        _counters[(name, _label_key(labels))] += amount
+
+
+def cache_lookup(cache):
+    """Record a lookup against a cached function (hit or miss)."""
+    increment('cache_requests', cache=cache)
+
+
+def cache_miss(cache):
+    """Record a cache miss - call this from inside the cached function body."""
+    increment('cache_misses', cache=cache)
+
+
+def cache_stats():
+    """
+    Summarize hit/miss counts for every instrumented cache.
+
+    Returns:
+    - dict: cache name -> {'requests', 'misses', 'hits', 'hit_rate'}
+    """
+    stats = {}
+    with _lock:
+        for (name, label_key), value in _counters.items():
+            if name not in ('cache_requests', 'cache_misses'):
+                continue
+            cache = dict(label_key).get('cache', 'unknown')
+            entry = stats.setdefault(cache, {'requests': 0, 'misses': 0})
+            entry['requests' if name == 'cache_requests' else 'misses'] += int(value)
+
+    for entry in stats.values():
+        # A miss inside a function called outside a tracked lookup would
+        # otherwise produce negative hits
+        entry['hits'] = max(0, entry['requests'] - entry['misses'])
+        entry['hit_rate'] = entry['hits'] / entry['requests'] if entry['requests'] else 0.0
+    return stats
+
+
+# ============================================================================
+# TIMERS
+# ============================================================================
+def record_timing(stage, seconds, ok=True, **labels):
+    """
+    Record one duration sample for a stage.
+
+    Parameters:
+    - stage: Stage name (e.g. 'db.traffic_data', 'prophet.fit')
+    - seconds: Elapsed wall-clock time
+    - ok: False if the stage raised an exception
+    - labels: Optional extra labels (e.g. series='tr1')
+    """
+    key = (stage, _label_key(labels))
+    with _lock:
+        entry = _durations.get(key)
+        if entry is None:
+            entry = {'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0,
+                     'buckets': [0] * len(DURATION_BUCKETS)}
+            _durations[key] = entry
+        entry['count'] += 1
+        entry['sum'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+        if not ok:
+            entry['errors'] += 1
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                entry['buckets'][i] += 1
+        _recent.append({
+            'time': time.time(),
+            'stage': stage,
+            'labels': dict(labels),
+            'seconds': seconds,
+            'ok': ok
+        })
+
+
+class timed:
+    """
+    Time a block of code or a function.
+
+    Usable as a context manager:
+        with timed('db.traffic_data'):
+            df = pd.read_sql(query, conn)
+
+    or as a decorator:
+        @timed('logic.decide')
+        def decide(...): ...
+
+    Exceptions are recorded as errors for the stage and re-raised.
+    """
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.elapsed = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._start
+        record_timing(self.stage, self.elapsed, ok=exc_type is None, **self.labels)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage, **self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def stage_summary():
+    """
+    Summarize stage timings, including percentiles over the rolling window.
+
+    Returns:
+    - list of dicts sorted by total time spent (largest first)
+    """
+    with _lock:
+        totals = {key: dict(entry) for key, entry in _durations.items()}
+        recent = list(_recent)
+
+    window = defaultdict(list)
+    for sample in recent:
+        window[(sample['stage'], _label_key(sample['labels']))].append(sample['seconds'])
+
+    rows = []
+    for (stage, label_key), entry in totals.items():
+        samples = sorted(window.get((stage, label_key), []))
+        if samples:
+            p50 = samples[int(0.50 * (len(samples) - 1))]
+            p95 = samples[int(0.95 * (len(samples) - 1))]
+        else:
+            p50 = p95 = None
+        rows.append({
+            'stage': stage + _format_labels(label_key),
+            'count': entry['count'],
+            'errors': entry['errors'],
+            'total_s': entry['sum'],
+            'avg_ms': 1000 * entry['sum'] / entry['count'],
+            'p50_ms': 1000 * p50 if p50 is not None else None,
+            'p95_ms': 1000 * p95 if p95 is not None else None,
+            'max_ms': 1000 * entry['max']
+        })
+    rows.sort(key=lambda r: r['total_s'], reverse=True)
+    return rows
+
+
+# ============================================================================
+# EXPORT
+# ============================================================================
+def to_prometheus():
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Returns:
+    - str: Metrics text (counters as ecoflow_<name>_total, stage timings as
+      the ecoflow_stage_duration_seconds histogram)
+    """
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        durations = {key: dict(entry, buckets=list(entry['buckets']))
+                     for key, entry in _durations.items()}
+
+    by_name = defaultdict(list)
+    for (name, label_key), value in counters.items():
+        by_name[name].append((label_key, value))
+
+    # Hits are derived so dashboards don't have to subtract
+    hits = [(label_key, value - counters.get(('cache_misses', label_key), 0))
+            for label_key, value in by_name.get('cache_requests', [])]
+    if hits:
+        by_name['cache_hits'] = [(k, max(0, v)) for k, v in hits]
+
+    for name in sorted(by_name):
+        metric = f"ecoflow_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for label_key, value in sorted(by_name[name]):
+            lines.append(f"{metric}{_format_labels(label_key)} {value:g}")
+
+    if durations:
+        metric = "ecoflow_stage_duration_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for (stage, label_key), entry in sorted(durations.items()):
+            base = (('stage', stage),) + label_key
+            for bound, count in zip(DURATION_BUCKETS, entry['buckets']):
+                lines.append(f"{metric}_bucket{_format_labels(base, [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{metric}_bucket{_format_labels(base, [('le', '+Inf')])} {entry['count']}")
+            lines.append(f"{metric}_sum{_format_labels(base)} {entry['sum']:.6f}")
+            lines.append(f"{metric}_count{_format_labels(base)} {entry['count']}")
+
+        metric = "ecoflow_stage_errors_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (stage, label_key), entry in sorted(durations.items()):
+            lines.append(f"{metric}{_format_labels((('stage', stage),) + label_key)} {entry['errors']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=METRICS_TEXTFILE_PATH):
+    """
+    Write metrics to a file for the node_exporter textfile collector.
+    The file is replaced atomically so the collector never reads a partial write.
+
+    Parameters:
+    - path: Destination .prom file (no-op if None)
+
+    Returns:
+    - True if written, False otherwise
+    """
+    if not path:
+        return False
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(to_prometheus())
+    os.replace(tmp_path, path)
+    return True
+
+
+def reset():
+    """Clear all counters and timings (used between benchmark runs)."""
+    with _lock:
+        _counters.clear()
+        _durations.clear()
+        _recent.clear()
+
+
+if __name__ == "__main__":
+    """
+    Demonstrate the instrumentation layer
+    """
+    print("=" * 70)
+    print("📈 PROJECT ECOFLOW - METRICS TEST")
+    print("=" * 70)
+
+    for _ in range(5):
+        with timed('demo.sleep'):
+            time.sleep(0.01)
+    cache_lookup('demo')
+    cache_lookup('demo')
+    cache_miss('demo')
+    increment('fallbacks', path='demo')
+
+    print("\n📊 Stage summary:")
+    for row in stage_summary():
+        print(f"   {row['stage']}: {row['count']} calls, avg {row['avg_ms']:.1f} ms, max {row['max_ms']:.1f} ms")
+    print(f"\n🗄️  Cache stats: {cache_stats()}")
+    print("\n📄 Prometheus export:")
+    print(to_prometheus())
@@ -3,12 +3,285 @@ Traffic Prediction Model for Project EcoFlow
 Uses Facebook Prophet for time series forecasting of traffic patterns
 """
 
+import numpy as np
 import pandas as pd
 import pickle
 import os
 from datetime import datetime, timedelta
-from prophet import Prophet
-from config import MODEL_PATH, MODEL_TR1_PATH, MODEL_TR2_PATH, TRAINING_DATA_MONTHS
+from config import (
+    MODEL_PATH,
+    MODEL_TR1_PATH,
+    MODEL_TR2_PATH,
+    TRAINING_DATA_MONTHS,
+    INTERVAL_METHOD,
+    INTERVAL_WIDTH,
+    PROPHET_PARAMS,
+    TRAINING_MODE,
+    FIT_MODES,
+    ANOMALY_EXCLUDE_FROM_TRAINING
+)
+from metrics import timed, increment
+from registry import best_params
+from intervals import ResidualIntervals, SAMPLING_METHODS, prophet_uncertainty_samples
+
+# Max reasonable per 15min: ~1125 vehicles (75 vehicles/min * 15 min)
+MAX_REASONABLE_15MIN = 1125.0
+
+# config settings that change a trained model for the same input data
+# (cleaning, anomaly exclusion, Prophet fit and stored intervals) - part of
+# the cache/job keys of pipeline.py and fleet.py
+TRAIN_SETTINGS = (
+    'PREPROCESS_CAP_PERCENTILE', 'PREPROCESS_CAP_HEADROOM', 'PREPROCESS_MIN_COVERAGE',
+    'ANOMALY_EXCLUDE_FROM_TRAINING', 'ANOMALY_GAP_MINUTES', 'ANOMALY_FLATLINE_READINGS',
+    'ANOMALY_ZERO_RUN_MINUTES', 'ANOMALY_SPIKE_Z', 'ANOMALY_SPIKE_FLOOR', 'ANOMALY_WARMUP_READINGS',
+    'ANOMALY_LEARNING_RATE', 'ANOMALY_MAX_PER_MINUTE',
+    'PROPHET_PARAMS', 'FIT_MODES', 'TRAINING_MODE',
+    'INTERVAL_METHOD', 'INTERVAL_WIDTH', 'INTERVAL_SAMPLES'
+)
+
+
+def _prophet_class():
+    """
+    Import Prophet on first use.
+    Prophet pulls in cmdstanpy, matplotlib and friends, which costs seconds at
+    startup - callers that only serve precomputed forecasts never pay it.
+    """
+    with timed('import.prophet'):
+        from prophet import Prophet
+    return Prophet
+
+
+def fit_prophet(prophet_df, params=None, series='total', mode=None, regressors=(), **fit_kwargs):
+    """
+    Fit one Prophet model on a 15-minute series.
+
+    Parameters:
+    - prophet_df: DataFrame with 'ds' and 'y' columns
+    - params: Overrides for the Prophet constructor (defaults: PROPHET_PARAMS)
+    - series: Series label for instrumentation ('total', 'tr1', 'tr2')
+    - mode: Fit mode from FIT_MODES (default: TRAINING_MODE)
+    - regressors: Extra columns of prophet_df to add as linear regressors
+    - fit_kwargs: Passed through to Prophet.fit (override the mode's optimizer settings)
+
+    Returns:
+    - Fitted Prophet model (HourlyProphet for hourly-resolution modes)
+    """
+    mode = mode or TRAINING_MODE
+    settings = FIT_MODES[mode]
+    fit_kwargs = {**settings.get('optimizer', {}), **fit_kwargs}
+
+    Prophet = _prophet_class()
+    model = Prophet(
+        **{**PROPHET_PARAMS, **(params or {})},
+        interval_width=INTERVAL_WIDTH,
+        uncertainty_samples=prophet_uncertainty_samples()
+    )
+    for name in regressors:
+        model.add_regressor(name)
+    with timed('prophet.fit', series=series, mode=mode):
+        if settings.get('resolution') == 'hourly':
+            if regressors:
+                raise ValueError(f"Fit mode '{mode}' does not support extra regressors")
+            return HourlyProphet.fit(model, prophet_df, **fit_kwargs)
+        model.fit(prophet_df, **fit_kwargs)
+    return model
+
+
+class HourlyProphet:
+    """
+    Prophet fitted on hourly totals (4x fewer points than the 15-minute
+    series) and disaggregated back to 15-minute slots using the intra-hour
+    profile: each quarter's share of its hour, per hour of day.
+    Exposes the parts of the Prophet interface used by TrafficPredictor.
+    """
+
+    def __init__(self, model, shares, history):
+        self.model = model          # Prophet fitted on hourly totals
+        self.shares = shares        # 24 x 4 quarter-of-hour shares (rows sum to 1)
+        self.history = history      # 15-minute ds/y training data
+
+    @classmethod
+    def fit(cls, model, prophet_df, **fit_kwargs):
+        """
+        Fit an unfitted Prophet model on the hourly version of a 15-minute series.
+
+        Returns:
+        - HourlyProphet
+        """
+        history = prophet_df[['ds', 'y']].dropna().reset_index(drop=True)
+        ds = pd.to_datetime(history['ds'])
+
+        # Hourly totals; hours with missing quarters are scaled up from their mean
+        hourly = history['y'].groupby(ds.dt.floor('h')).mean() * 4
+        model.fit(pd.DataFrame({'ds': hourly.index, 'y': hourly.to_numpy()}), **fit_kwargs)
+
+        sums = np.zeros((24, 4))
+        np.add.at(sums, (ds.dt.hour.to_numpy(), ds.dt.minute.to_numpy() // 15), history['y'].to_numpy(dtype=float))
+        totals = sums.sum(axis=1, keepdims=True)
+        shares = np.divide(sums, totals, out=np.full((24, 4), 0.25), where=totals > 0)
+        return cls(model, shares, history)
+
+    @property
+    def uncertainty_samples(self):
+        return self.model.uncertainty_samples
+
+    @uncertainty_samples.setter
+    def uncertainty_samples(self, value):
+        self.model.uncertainty_samples = value
+
+    def make_future_dataframe(self, periods, freq='15min', include_history=True):
+        """Same contract as Prophet.make_future_dataframe, on the 15-minute grid."""
+        history_ds = pd.to_datetime(self.history['ds'])
+        dates = pd.Series(pd.date_range(history_ds.max(), periods=periods + 1, freq=freq)[1:])
+        if include_history:
+            dates = pd.concat([history_ds, dates], ignore_index=True)
+        return pd.DataFrame({'ds': dates})
+
+    def predict(self, future):
+        """
+        Predict 15-minute values: hourly forecast x quarter share.
+
+        Returns:
+        - DataFrame with ds, yhat and, when Prophet sampled them, yhat_lower/yhat_upper
+        """
+        ds = pd.to_datetime(future['ds']).reset_index(drop=True)
+        hours = ds.dt.floor('h')
+        unique_hours = pd.DatetimeIndex(hours.unique())
+        hourly = self.model.predict(pd.DataFrame({'ds': unique_hours}))
+        position = unique_hours.get_indexer(hours)
+        share = self.shares[ds.dt.hour.to_numpy(), ds.dt.minute.to_numpy() // 15]
+
+        forecast = pd.DataFrame({'ds': ds})
+        for column in ('yhat', 'yhat_lower', 'yhat_upper'):
+            if column in hourly.columns:
+                forecast[column] = hourly[column].to_numpy()[position] * share
+        return forecast
+
+
+def fit_prophet_intervals(model, series='total'):
+    """
+    Fit residual-based prediction bands for a fitted model (once, at training
+    or load time) so predict calls can skip Prophet's Monte Carlo sampling.
+
+    Returns:
+    - ResidualIntervals, or None when INTERVAL_METHOD samples inside Prophet
+      (or no finite residual was left to fit, in which case Prophet samples
+      its own bands again)
+    """
+    model.uncertainty_samples = prophet_uncertainty_samples()
+    if INTERVAL_METHOD in SAMPLING_METHODS:
+        return None
+    with timed('intervals.fit', series=series):
+        history = model.history
+        fitted = model.predict(history[['ds']])
+        engine = ResidualIntervals().fit(history['ds'], history['y'], fitted['yhat'])
+    if not engine.fitted:
+        print(f"⚠️  No finite residuals for {series} - using Prophet's own intervals")
+        model.uncertainty_samples = prophet_uncertainty_samples('sampled')
+        return None
+    return engine
+
+
+def prophet_forecast(model, intervals, future, series='total'):
+    """
+    Predict with a Prophet model, filling the bands from the interval engine.
+
+    Parameters:
+    - model: Fitted Prophet model
+    - intervals: ResidualIntervals or None (bands come from Prophet itself)
+    - future: DataFrame with a 'ds' column
+    - series: Series label for instrumentation
+
+    Returns:
+    - Forecast DataFrame including yhat, yhat_lower, yhat_upper
+    """
+    with timed('prophet.predict', series=series):
+        forecast = model.predict(future)
+    if intervals is not None:
+        forecast['yhat_lower'], forecast['yhat_upper'] = intervals.apply(forecast['ds'], forecast['yhat'])
+    return forecast
+
+
+def format_prediction(timestamp, total, minutes_ahead, tr1=None, tr2=None, cap=None):
+    """
+    Build the prediction dictionary shared by every predictor.
+    Values come in as vehicles per 15-minute period (the training resolution)
+    and are capped, clipped at zero and converted to vehicles per minute.
+
+    Parameters:
+    - timestamp: Timestamp of the forecast slot
+    - total: (yhat, yhat_lower, yhat_upper) for total traffic
+    - minutes_ahead: Minutes ahead the caller asked for
+    - tr1, tr2: Optional (yhat, yhat_lower, yhat_upper) tuples per direction
+    - cap: Maximum vehicles per 15 minutes (default: MAX_REASONABLE_15MIN)
+
+    Returns:
+    - Dictionary with prediction details
+    """
+    cap = min(cap, MAX_REASONABLE_15MIN) if cap else MAX_REASONABLE_15MIN
+    predicted_per_15min = round(total[0], 1)
+
+    # Cap predictions at reasonable maximum
+    if predicted_per_15min > cap:
+        increment('prediction_capped')
+        print(f"⚠️  Prediction {predicted_per_15min} vehicles/15min capped at {cap}")
+        predicted_per_15min = cap
+
+    # Ensure minimum is reasonable (can't be negative)
+    predicted_per_15min = max(0, predicted_per_15min)
+    predicted_per_min = predicted_per_15min / 15.0  # Convert to per-minute for consistency
+
+    # Cap bounds as well (convert to per-minute for consistency)
+    lower_bound = max(0, round(total[1], 1)) / 15.0
+    upper_bound = min(cap, round(total[2], 1)) / 15.0
+
+    result = {
+        'timestamp': timestamp,
+        'predicted_traffic': predicted_per_min,  # Vehicles per minute (for consistency)
+        'predicted_traffic_15min': predicted_per_15min,  # Vehicles per 15-minute period
+        'lower_bound': lower_bound,
+        'upper_bound': upper_bound,
+        'confidence_range': round(upper_bound - lower_bound, 1),
+        'target_minutes_ahead': minutes_ahead,  # Store the actual target time we're predicting for
+        'cap_15min': cap  # Cap applied, so re-formatting (nowcast) caps the same way
+    }
+
+    if tr1 is not None and tr2 is not None:
+        for key, values in (('direction_1', tr1), ('direction_2', tr2)):
+            # Direction predictions are also in vehicles per 15-minute period
+            pred_15min = max(0, min(cap, round(values[0], 1)))
+            result[key] = pred_15min / 15.0
+            result[f'{key}_15min'] = pred_15min
+            result[f'{key}_lower'] = max(0, round(values[1], 1)) / 15.0
+            result[f'{key}_upper'] = min(cap, round(values[2], 1)) / 15.0
+
+    return result
+
+
+def aggregate_to_15min(df):
+    """
+    Aggregate raw traffic readings to 15-minute sums.
+
+    Parameters:
+    - df: DataFrame with timestamp, total_traffic, tr1 and tr2 columns
+
+    Returns:
+    - DataFrame with ds_15min, total_traffic, tr1, tr2 (one row per interval)
+    """
+    ds = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
+    ds_15min = ds.dt.floor('15T')  # Round down to nearest 15 minutes
+
+    # Aggregate to 15-minute intervals (sum traffic per 15-minute period)
+    columns = [c for c in ('total_traffic', 'tr1', 'tr2') if c in df.columns]
+    return df[columns].groupby(ds_15min.rename('ds_15min')).sum().reset_index()
+
+
+def direction_model_paths(path=MODEL_PATH):
+    """TR1/TR2 model files that belong to a main model file."""
+    if path == MODEL_PATH:
+        return MODEL_TR1_PATH, MODEL_TR2_PATH
+    root, ext = os.path.splitext(path)
+    return f"{root}_tr1{ext}", f"{root}_tr2{ext}"
 
 
 class TrafficPredictor:
@@ -24,8 +297,10 @@ class TrafficPredictor:
         self.trained = False
         self.device_imei = None
         self.use_directions = False  # Whether to use direction-specific models
+        self.intervals = {}  # series -> ResidualIntervals (when not sampling in Prophet)
+        self.cap_15min = None  # Data-derived prediction cap (vehicles per 15 minutes)
 
-    def train(self, traffic_data_path, train_directions=True):
+    def train(self, traffic_data_path, train_directions=True, mode=None, model_path=MODEL_PATH):
         """
         Train the Prophet model on historical traffic data.
         Can train separate models for each direction (TR1 and TR2).
@@ -33,35 +308,63 @@ class TrafficPredictor:
         Parameters:
         - traffic_data_path: Path to CSV file with traffic data (from data_extraction.py)
         - train_directions: If True, train separate models for TR1 and TR2 in addition to total
+        - mode: Fit mode from FIT_MODES ('full', 'fast', 'hourly'; default: TRAINING_MODE)
+        - model_path: Where the trained models are saved
 
         Returns:
         - True if training successful, False otherwise
         """
         try:
-            print("\n" + "=" * 70)
-            print("🧠 TRAINING TRAFFIC PREDICTION MODEL")
-            print("=" * 70)
-
             # Load data
             print(f"\n📂 Loading data from: {traffic_data_path}")
-            df = pd.read_csv(traffic_data_path)
+            with timed('model.load_training_data'):
+                df = pd.read_csv(traffic_data_path)
             print(f"✅ Loaded {len(df):,} records")
+        except Exception as e:
+            increment('errors', stage='model.train')
+            print(f"❌ Error loading training data: {e}")
+            return False
+        return self.train_frame(df, train_directions=train_directions, mode=mode, model_path=model_path)
+
+    def train_frame(self, df, df_15min=None, train_directions=True, mode=None, model_path=MODEL_PATH):
+        """
+        Train on raw readings already in memory.
+
+        Parameters:
+        - df: Raw 1-minute readings (as extracted by data_extraction.py)
+        - df_15min: Clean 15-minute frame of df (preprocessing.load_clean_traffic());
+          cleaned here if not given
+        - train_directions, mode, model_path: As for train()
+
+        Returns:
+        - True if training successful, False otherwise
+        """
+        try:
+            print("\n" + "=" * 70)
+            print("🧠 TRAINING TRAFFIC PREDICTION MODEL")
+            print("=" * 70)
 
             # Prepare data for Prophet
             # Prophet requires columns named 'ds' (datetime) and 'y' (target value)
             # We'll aggregate to 15-minute intervals for better short-term predictions
             print("\n🔧 Preparing data for Prophet (15-minute intervals)...")
 
-            # Convert timestamp and aggregate to 15-minute intervals
-            df['ds'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
-            df['ds_15min'] = df['ds'].dt.floor('15T')  # Round down to nearest 15 minutes
-
-            # Aggregate to 15-minute intervals (sum traffic per 15-minute period)
-            df_15min = df.groupby('ds_15min').agg({
-                'total_traffic': 'sum',
-                'tr1': 'sum',
-                'tr2': 'sum'
-            }).reset_index()
+            # Deduplicate, cap outliers and resample onto a complete 15-minute grid;
+            # partial intervals are scaled to a full interval, sparse ones dropped
+            from preprocessing import load_clean_traffic, data_derived_cap
+            if df_15min is None:
+                df_15min = load_clean_traffic(df)
+            partial = ((df_15min['coverage'] > 0) & (df_15min['coverage'] < 1)).sum()
+            print(f"🧹 {len(df_15min):,} 15-minute intervals: {(df_15min['readings'] == 0).sum():,} empty, "
+                  f"{partial:,} partial, {df_15min['total_traffic'].isna().sum():,} left out")
+            self.cap_15min = data_derived_cap(df_15min, ceiling=MAX_REASONABLE_15MIN)
+
+            # Drop intervals touched by dropouts, stuck counters or spikes
+            if ANOMALY_EXCLUDE_FROM_TRAINING:
+                from anomaly import SensorMonitor, exclude_flagged
+                events = SensorMonitor(log_path=None).process_frame(df)
+                df_15min, removed = exclude_flagged(df_15min, events)
+                print(f"🚨 {len(events)} sensor anomalies; excluded {removed:,} flagged 15-minute intervals")
 
             # Prepare total traffic model (15-minute intervals)
             prophet_df_total = pd.DataFrame({
@@ -74,24 +377,23 @@ class TrafficPredictor:
             print(f"   Average total traffic per 15min: {prophet_df_total['y'].mean():.1f} vehicles")
             print(f"   (Original: {len(df):,} 1-minute samples aggregated to {len(prophet_df_total):,} 15-minute intervals)")
 
+            # Use the tuned configuration for this device when tuning.py has registered one
+            self.device_imei = df['imei'].iloc[0] if 'imei' in df.columns else 'unknown'
+            params = {series: best_params(self.device_imei, series) for series in ('total', 'tr1', 'tr2')}
+
             # Initialize and train total traffic Prophet model
-            print("\n🔮 Training Total Traffic Model...")
-            print("   - Daily seasonality: ON")
-            print("   - Weekly seasonality: ON")
-            print("   - Yearly seasonality: AUTO")
-
-            self.model = Prophet(
-                daily_seasonality=True,
-                weekly_seasonality=True,
-                yearly_seasonality='auto',
-                seasonality_mode='multiplicative',
-                changepoint_prior_scale=0.05
-            )
+            print(f"\n🔮 Training Total Traffic Model ({mode or TRAINING_MODE} fit)...")
+            if params['total']:
+                print(f"   - Tuned configuration from registry: {params['total']}")
+            else:
+                print("   - Daily seasonality: ON")
+                print("   - Weekly seasonality: ON")
+                print("   - Yearly seasonality: AUTO")
 
             # Fit the total model
-            self.model.fit(prophet_df_total)
+            self.model = fit_prophet(prophet_df_total, params=params['total'], series='total', mode=mode)
+            self._fit_intervals('total', self.model)
             self.trained = True
-            self.device_imei = df['imei'].iloc[0] if 'imei' in df.columns else 'unknown'
 
             print("✅ Total traffic model training complete!")
 
@@ -119,42 +421,70 @@ class TrafficPredictor:
 
                 # Train TR1 model
                 print("\n🔮 Training TR1 (Direction 1) Model...")
-                self.model_tr1 = Prophet(
-                    daily_seasonality=True,
-                    weekly_seasonality=True,
-                    yearly_seasonality='auto',
-                    seasonality_mode='multiplicative',
-                    changepoint_prior_scale=0.05
-                )
-                self.model_tr1.fit(prophet_df_tr1)
+                self.model_tr1 = fit_prophet(prophet_df_tr1, params=params['tr1'], series='tr1', mode=mode)
+                self._fit_intervals('tr1', self.model_tr1)
                 print("✅ TR1 model training complete!")
 
                 # Train TR2 model
                 print("\n🔮 Training TR2 (Direction 2) Model...")
-                self.model_tr2 = Prophet(
-                    daily_seasonality=True,
-                    weekly_seasonality=True,
-                    yearly_seasonality='auto',
-                    seasonality_mode='multiplicative',
-                    changepoint_prior_scale=0.05
-                )
-                self.model_tr2.fit(prophet_df_tr2)
+                self.model_tr2 = fit_prophet(prophet_df_tr2, params=params['tr2'], series='tr2', mode=mode)
+                self._fit_intervals('tr2', self.model_tr2)
                 print("✅ TR2 model training complete!")
 
                 self.use_directions = True
                 print("\n✅ All direction-specific models trained!")
 
             # Save the models
-            self.save_model()
+            self.save_model(model_path)
 
             return True
 
         except Exception as e:
+            increment('errors', stage='model.train')
             print(f"❌ Error training model: {e}")
             import traceback
             traceback.print_exc()
             return False
 
+    def _fit_intervals(self, series, model):
+        """Fit (or clear) the residual bands for one series."""
+        engine = fit_prophet_intervals(model, series=series)
+        if engine is None:
+            self.intervals.pop(series, None)
+        else:
+            self.intervals[series] = engine
+
+    def _restore_intervals(self, series, model, engine):
+        """
+        Reuse the bands saved with a model, or fit them now for models saved
+        before the interval engine existed (or with a different method).
+        """
+        if engine is not None and engine.method == INTERVAL_METHOD:
+            model.uncertainty_samples = prophet_uncertainty_samples()
+            self.intervals[series] = engine
+        else:
+            self._fit_intervals(series, model)
+
+    def _series_model(self, series):
+        return {'total': self.model, 'tr1': self.model_tr1, 'tr2': self.model_tr2}[series]
+
+    def forecast_frame(self, series, future):
+        """
+        Run one series' model over a frame of timestamps.
+
+        Parameters:
+        - series: 'total', 'tr1' or 'tr2'
+        - future: DataFrame with a 'ds' column
+
+        Returns:
+        - Prophet forecast DataFrame including yhat, yhat_lower, yhat_upper
+        """
+        return prophet_forecast(self._series_model(series), self.intervals.get(series), future, series=series)
+
+    def training_end(self):
+        """Return the timestamp of the last training interval."""
+        return pd.to_datetime(self.model.history['ds'].max())
+
     def predict(self, hours_ahead=24):
         """
         Predict traffic volume for the next N hours.
@@ -181,7 +511,7 @@ class TrafficPredictor:
             )
 
             # Make predictions
-            forecast = self.model.predict(future)
+            forecast = self.forecast_frame('total', future)
 
             # Get only future predictions (not historical)
             # Return the last N hours worth of 15-minute predictions
@@ -196,6 +526,7 @@ class TrafficPredictor:
             return future_only
 
         except Exception as e:
+            increment('errors', stage='model.predict')
             print(f"❌ Error making predictions: {e}")
             return None
 
@@ -249,7 +580,7 @@ class TrafficPredictor:
             future = self.model.make_future_dataframe(periods=periods_ahead, freq='15T')
 
             # Make prediction
-            forecast = self.model.predict(future)
+            forecast = self.forecast_frame('total', future)
 
             # Get the prediction for the target time
             # Since Prophet works in hourly intervals, we use the hour that contains our target time
@@ -260,54 +591,16 @@ class TrafficPredictor:
                 closest_idx = time_diffs.idxmin()
                 row = forecast.iloc[closest_idx]
 
-                # The prediction is in vehicles per 15-minute period (based on training data)
-                # Training data is aggregated to 15-minute intervals
-                # To convert to vehicles per minute: divide by 15
-                # To convert to vehicles per hour: multiply by 4
-
-                predicted_per_15min = round(row['yhat'], 1)
-                predicted_per_min = predicted_per_15min / 15.0  # Convert to per-minute for consistency
-
-                # Cap predictions at reasonable maximum
-                # Max reasonable per 15min: ~1125 vehicles (75 vehicles/min * 15 min)
-                MAX_REASONABLE_15MIN = 1125.0
-                if predicted_per_15min > MAX_REASONABLE_15MIN:
-                    print(f"⚠️  Prediction {predicted_per_15min} vehicles/15min capped at {MAX_REASONABLE_15MIN}")
-                    predicted_per_15min = MAX_REASONABLE_15MIN
-                    predicted_per_min = predicted_per_15min / 15.0
-
-                # Ensure minimum is reasonable (can't be negative)
-                predicted_per_15min = max(0, predicted_per_15min)
-                predicted_per_min = predicted_per_15min / 15.0
-
-                # Cap bounds as well (convert to per-minute for consistency)
-                lower_bound_15min = max(0, round(row['yhat_lower'], 1))
-                upper_bound_15min = min(MAX_REASONABLE_15MIN, round(row['yhat_upper'], 1))
-                lower_bound = lower_bound_15min / 15.0
-                upper_bound = upper_bound_15min / 15.0
-
-                # Get the timestamp for the prediction (closest hour to target)
-                pred_timestamp = row['ds']
-
-                result = {
-                    'timestamp': pred_timestamp,
-                    'predicted_traffic': predicted_per_min,  # Vehicles per minute (for consistency)
-                    'predicted_traffic_15min': predicted_per_15min,  # Vehicles per 15-minute period
-                    'lower_bound': lower_bound,
-                    'upper_bound': upper_bound,
-                    'confidence_range': round(upper_bound - lower_bound, 1),
-                    'target_minutes_ahead': minutes_ahead  # Store the actual target time we're predicting for
-                }
-
                 # If we have direction models, add direction-specific predictions
+                row_tr1 = row_tr2 = None
                 if (include_directions or self.use_directions) and self.model_tr1 is not None and self.model_tr2 is not None:
                     # Create future dataframes for direction models (same periods, 15-minute intervals)
                     future_tr1 = self.model_tr1.make_future_dataframe(periods=periods_ahead, freq='15T')
                     future_tr2 = self.model_tr2.make_future_dataframe(periods=periods_ahead, freq='15T')
 
                     # Predict for each direction
-                    forecast_tr1 = self.model_tr1.predict(future_tr1)
-                    forecast_tr2 = self.model_tr2.predict(future_tr2)
+                    forecast_tr1 = self.forecast_frame('tr1', future_tr1)
+                    forecast_tr2 = self.forecast_frame('tr2', future_tr2)
 
                     if len(forecast_tr1) > 0 and len(forecast_tr2) > 0:
                         # Find closest time for direction predictions too
@@ -318,27 +611,20 @@ class TrafficPredictor:
                         row_tr1 = forecast_tr1.iloc[closest_idx_tr1]
                         row_tr2 = forecast_tr2.iloc[closest_idx_tr2]
 
-                        # Direction predictions are also in vehicles per 15-minute period
-                        tr1_pred_15min = max(0, min(MAX_REASONABLE_15MIN, round(row_tr1['yhat'], 1)))
-                        tr2_pred_15min = max(0, min(MAX_REASONABLE_15MIN, round(row_tr2['yhat'], 1)))
-
-                        # Convert to per-minute for consistency
-                        tr1_pred = tr1_pred_15min / 15.0
-                        tr2_pred = tr2_pred_15min / 15.0
-
-                        result['direction_1'] = tr1_pred
-                        result['direction_2'] = tr2_pred
-                        result['direction_1_15min'] = tr1_pred_15min
-                        result['direction_2_15min'] = tr2_pred_15min
-                        result['direction_1_lower'] = max(0, round(row_tr1['yhat_lower'], 1)) / 15.0
-                        result['direction_1_upper'] = min(MAX_REASONABLE_15MIN, round(row_tr1['yhat_upper'], 1)) / 15.0
-                        result['direction_2_lower'] = max(0, round(row_tr2['yhat_lower'], 1)) / 15.0
-                        result['direction_2_upper'] = min(MAX_REASONABLE_15MIN, round(row_tr2['yhat_upper'], 1)) / 15.0
+                result = format_prediction(
+                    row['ds'],
+                    (row['yhat'], row['yhat_lower'], row['yhat_upper']),
+                    minutes_ahead,
+                    tr1=None if row_tr1 is None else (row_tr1['yhat'], row_tr1['yhat_lower'], row_tr1['yhat_upper']),
+                    tr2=None if row_tr2 is None else (row_tr2['yhat'], row_tr2['yhat_lower'], row_tr2['yhat_upper']),
+                    cap=self.cap_15min
+                )
 
                 return result
             return None
 
         except Exception as e:
+            increment('errors', stage='model.current_prediction')
             print(f"❌ Error getting current prediction: {e}")
             import traceback
             traceback.print_exc()
@@ -363,32 +649,38 @@ class TrafficPredictor:
                     'model': self.model,
                     'device_imei': self.device_imei,
                     'training_date': datetime.now(),
-                    'use_directions': self.use_directions
+                    'use_directions': self.use_directions,
+                    'intervals': self.intervals.get('total'),
+                    'cap_15min': self.cap_15min
                 }, f)
             print(f"💾 Total traffic model saved to: {path}")
 
             # Save direction-specific models if available
+            tr1_path, tr2_path = direction_model_paths(path)
             if self.use_directions and self.model_tr1 is not None and self.model_tr2 is not None:
-                with open(MODEL_TR1_PATH, 'wb') as f:
+                with open(tr1_path, 'wb') as f:
                     pickle.dump({
                         'model': self.model_tr1,
                         'device_imei': self.device_imei,
                         'training_date': datetime.now(),
-                        'direction': 'TR1'
+                        'direction': 'TR1',
+                        'intervals': self.intervals.get('tr1')
                     }, f)
-                print(f"💾 TR1 model saved to: {MODEL_TR1_PATH}")
+                print(f"💾 TR1 model saved to: {tr1_path}")
 
-                with open(MODEL_TR2_PATH, 'wb') as f:
+                with open(tr2_path, 'wb') as f:
                     pickle.dump({
                         'model': self.model_tr2,
                         'device_imei': self.device_imei,
                         'training_date': datetime.now(),
-                        'direction': 'TR2'
+                        'direction': 'TR2',
+                        'intervals': self.intervals.get('tr2')
                     }, f)
-                print(f"💾 TR2 model saved to: {MODEL_TR2_PATH}")
+                print(f"💾 TR2 model saved to: {tr2_path}")
 
             return True
         except Exception as e:
+            increment('errors', stage='model.save')
             print(f"❌ Error saving model: {e}")
             return False
 
@@ -406,12 +698,14 @@ class TrafficPredictor:
 
         try:
             # Load main (total) model
-            with open(path, 'rb') as f:
+            with open(path, 'rb') as f, timed('model.load', series='total'):
                 data = pickle.load(f)
                 self.model = data['model']
                 self.device_imei = data.get('device_imei', 'unknown')
                 self.trained = True
                 self.use_directions = data.get('use_directions', False)
+                self.cap_15min = data.get('cap_15min')  # Older pickles: fixed cap
+            self._restore_intervals('total', self.model, data.get('intervals'))
 
             training_date = data.get('training_date', 'Unknown')
             print(f"✅ Total traffic model loaded from: {path}")
@@ -420,25 +714,30 @@ class TrafficPredictor:
             print(f"   Direction models: {'Yes' if self.use_directions else 'No'}")
 
             # Try to load direction-specific models if they exist
-            if os.path.exists(MODEL_TR1_PATH) and os.path.exists(MODEL_TR2_PATH):
+            tr1_path, tr2_path = direction_model_paths(path)
+            if os.path.exists(tr1_path) and os.path.exists(tr2_path):
                 try:
-                    with open(MODEL_TR1_PATH, 'rb') as f:
+                    with open(tr1_path, 'rb') as f, timed('model.load', series='tr1'):
                         data_tr1 = pickle.load(f)
                         self.model_tr1 = data_tr1['model']
-                    print(f"✅ TR1 model loaded from: {MODEL_TR1_PATH}")
+                    self._restore_intervals('tr1', self.model_tr1, data_tr1.get('intervals'))
+                    print(f"✅ TR1 model loaded from: {tr1_path}")
 
-                    with open(MODEL_TR2_PATH, 'rb') as f:
+                    with open(tr2_path, 'rb') as f, timed('model.load', series='tr2'):
                         data_tr2 = pickle.load(f)
                         self.model_tr2 = data_tr2['model']
-                    print(f"✅ TR2 model loaded from: {MODEL_TR2_PATH}")
+                    self._restore_intervals('tr2', self.model_tr2, data_tr2.get('intervals'))
+                    print(f"✅ TR2 model loaded from: {tr2_path}")
 
                     self.use_directions = True
                 except Exception as e:
+                    increment('fallbacks', path='direction_models_unavailable')
                     print(f"⚠️  Could not load direction models: {e}")
                     self.use_directions = False
 
             return True
         except Exception as e:
+            increment('errors', stage='model.load')
             print(f"❌ Error loading model: {e}")
             return False
 
@@ -447,9 +746,13 @@ def simulate_predictions_for_demo():
     """
     Generate simulated predictions for demo purposes (if real data isn't available).
     Returns sample predictions that vary by time of day.
+    Only for demos without any data - use baseline.SeasonalBaselinePredictor as
+    the fallback whenever traffic history exists.
     """
     import numpy as np
 
+    increment('fallbacks', path='simulated_predictions')
+
     current_hour = datetime.now().hour
 
     # Simulate rush hour patterns
@@ -496,6 +799,13 @@ if __name__ == "__main__":
         print("⚠️  Run data_extraction.py first to extract the training data")
         exit(1)
 
+    # Always fit the NumPy seasonal baseline first - it takes milliseconds and
+    # keeps the dashboard forecasting even if Prophet fails below
+    from baseline import SeasonalBaselinePredictor
+    baseline = SeasonalBaselinePredictor()
+    if baseline.train(data_path, train_directions=True):
+        baseline.save_model()
+
     # Initialize and train (with direction-specific models)
     predictor = TrafficPredictor()
     print(f"\n📊 Training on {TRAINING_DATA_MONTHS} months of data with direction-specific models...")
@@ -525,6 +835,10 @@ if __name__ == "__main__":
         print("✅ MODEL TRAINING & TESTING COMPLETE!")
         print("=" * 70)
         print(f"\n💾 Model saved to: {MODEL_PATH}")
+
+        # Materialize forecasts so the dashboard can serve them without Prophet
+        from forecast_table import build_forecast_table, save_forecast_table
+        save_forecast_table(build_forecast_table(predictor))
         print(f"🎯 Next step: Run the dashboard with: streamlit run app.py")
     else:
         print("\n❌ Model training failed!")
@@ -0,0 +1,159 @@
+"""
+Noise Exposure for Project EcoFlow
+15-minute noise rollups per device (served from the columnar cache),
+per-device day/evening/night levels and a vectorized exposure score that
+the decision engine combines with PM10.
+Decibels are logarithmic, so every average here is an energy average:
+10 * log10(mean(10^(L/10))).
+"""
+
+import numpy as np
+import pandas as pd
+from config import (
+    NOISE_DATA_MONTHS,
+    NOISE_SCORE_FLOOR_DB,
+    NOISE_SCORE_CEILING_DB,
+    NOISE_EXPOSURE_WEIGHT,
+    EMERGENCY_PM10_THRESHOLD
+)
+from metrics import timed, increment
+
+DATASET = 'noise_15min'
+
+# EU Environmental Noise Directive periods: (start hour, end hour, penalty dB)
+PERIODS = {'day': (7, 19, 0.0), 'evening': (19, 23, 5.0), 'night': (23, 7, 10.0)}
+
+
+def load_noise_15min(months=NOISE_DATA_MONTHS, refresh=False):
+    """
+    15-minute noise rollups, extracted once and then read from the columnar cache.
+
+    Parameters:
+    - months: Months of history to extract on a cache miss
+    - refresh: Re-extract even if the cache exists
+
+    Returns:
+    - DataFrame with imei, ds_15min, leq, lmax, lmin, readings (None if unavailable)
+    """
+    from columnar_cache import load_columns, save_columns
+
+    if not refresh:
+        frame = load_columns(DATASET)
+        if frame is not None:
+            return frame
+
+    from data_extraction import get_noise_15min
+
+    frame = get_noise_15min(months)
+    if frame is None:
+        increment('fallbacks', path='noise_extract_failed')
+        return load_columns(DATASET)  # Stale cache beats nothing
+    frame['imei'] = frame['imei'].astype(str)
+    frame['ds_15min'] = pd.to_datetime(frame['ds_15min'])
+    save_columns(DATASET, frame, months=months)
+    return frame
+
+
+def energy_mean(levels, groups, n_groups):
+    """
+    Energy-averaged level per group (vectorized with bincount).
+
+    Parameters:
+    - levels: dB values
+    - groups: Integer group code per value
+    - n_groups: Number of groups
+
+    Returns:
+    - Array of n_groups levels (NaN for empty groups)
+    """
+    levels = np.asarray(levels, dtype=float)
+    valid = np.isfinite(levels)
+    energy = np.bincount(groups[valid], weights=10 ** (levels[valid] / 10), minlength=n_groups)
+    total = np.bincount(groups[valid], minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, 10 * np.log10(energy / total), np.nan)
+
+
+def device_aggregates(frame):
+    """
+    Per-device noise indicators from the 15-minute rollups.
+
+    Returns:
+    - DataFrame indexed by imei with leq, lday, levening, lnight, lden, lmax, slots
+    """
+    with timed('noise.aggregates', rows=len(frame)):
+        codes, devices = pd.factorize(frame['imei'].astype(str), sort=True)
+        n = len(devices)
+        hour = pd.DatetimeIndex(frame['ds_15min']).hour.to_numpy()
+        leq = frame['leq'].to_numpy(dtype=float)
+
+        result = pd.DataFrame(index=pd.Index(devices, name='imei'))
+        result['leq'] = energy_mean(leq, codes, n)
+        lden_energy = np.zeros(n)
+        for name, (start, end, penalty) in PERIODS.items():
+            in_period = (hour >= start) & (hour < end) if start < end else (hour >= start) | (hour < end)
+            level = energy_mean(np.where(in_period, leq, np.nan), codes, n)
+            result[f'l{name}'] = level
+            hours = (end - start) % 24
+            lden_energy += hours * 10 ** ((level + penalty) / 10)  # NaN if a period has no data
+        result['lden'] = 10 * np.log10(lden_energy / 24)
+        result['lmax'] = pd.Series(frame['lmax'].to_numpy(dtype=float)).groupby(codes).max().to_numpy()
+        result['slots'] = np.bincount(codes, minlength=n)
+    return result
+
+
+def exposure_score(level_db, floor=NOISE_SCORE_FLOOR_DB, ceiling=NOISE_SCORE_CEILING_DB):
+    """
+    Noise exposure on a 0-1 scale: 0 at or below `floor`, 1 at or above
+    `ceiling`, linear in dB in between (vectorized; NaN stays NaN).
+    """
+    return np.clip((np.asarray(level_db, dtype=float) - floor) / (ceiling - floor), 0.0, 1.0)
+
+
+def combined_exposure(pm10, noise_db, weight=NOISE_EXPOSURE_WEIGHT, threshold=EMERGENCY_PM10_THRESHOLD):
+    """
+    PM10 and noise exposure in one score where above 1.0 means "act": PM10 as a
+    fraction of `threshold` (EMERGENCY_PM10_THRESHOLD) plus the weighted noise score, so
+    a street at the noise ceiling is rerouted at (1 - weight) of the PM10
+    threshold. Where no noise level is known the score is PM10 alone.
+
+    Parameters:
+    - pm10: PM10 in µg/m³ (scalar or array)
+    - noise_db: Leq in dB(A) (scalar or array, NaN/None = unknown)
+
+    Returns:
+    - Combined score (same shape as the inputs)
+    """
+    pm_score = np.asarray(pm10, dtype=float) / threshold
+    noise = exposure_score(np.asarray(noise_db if noise_db is not None else np.nan, dtype=float))
+    return pm_score + weight * np.nan_to_num(noise, nan=0.0)
+
+
+def latest_levels(frame):
+    """Most recent 15-minute Leq per device (imei -> (ds_15min, leq))."""
+    ordered = frame.sort_values('ds_15min')
+    last = ordered.groupby(ordered['imei'].astype(str)).tail(1)
+    return last.set_index(last['imei'].astype(str))[['ds_15min', 'leq']]
+
+
+if __name__ == "__main__":
+    """
+    Load (or extract) the noise rollups and print per-device indicators
+    """
+    import time
+
+    print("=" * 70)
+    print("🔊 PROJECT ECOFLOW - NOISE EXPOSURE")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    frame = load_noise_15min()
+    if frame is None:
+        print("\n❌ No noise data - the database is unreachable and nothing is cached")
+        exit(1)
+    print(f"\n✅ {len(frame):,} 15-minute intervals in {time.perf_counter() - start:.2f}s")
+
+    aggregates = device_aggregates(frame)
+    aggregates['score'] = exposure_score(aggregates['lden'])
+    print(f"\n📊 Noise indicators for {len(aggregates)} devices (dB(A)):")
+    print(aggregates.round(1).to_string())
@@ -0,0 +1,409 @@
+"""
+Pipeline Runner for Project EcoFlow
+Runs extract -> clean -> train -> forecast -> publish (and aq_extract ->
+aq_train -> aq_publish for air quality) as a DAG of stages.
+Every task (a stage, or a stage for one device) is keyed by a content hash
+of its inputs and the config settings it reads, and its output is cached
+under that key - so a rerun only executes the tasks whose inputs or
+settings changed. Source stages (database extracts) always run, but their
+output is hashed per device, so unchanged devices keep their models.
+Ready tasks run concurrently in a thread pool.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import config
+from config import PIPELINE_CACHE_PATH, PIPELINE_WORKERS, PIPELINE_DEVICES, PIPELINE_KEEP_ARTIFACTS
+from metrics import timed, increment
+from model import TRAIN_SETTINGS
+
+
+def content_hash(value):
+    """Content hash of a stage output (vectorized for DataFrames)."""
+    if isinstance(value, pd.DataFrame):
+        from preprocessing import input_hash
+        return input_hash(value)
+    if isinstance(value, dict):
+        digest = hashlib.sha1()
+        for key in sorted(value, key=str):
+            digest.update(f"{key}={content_hash(value[key])};".encode())
+        return digest.hexdigest()[:20]
+    return hashlib.sha1(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()[:20]
+
+
+class Stage:
+    """
+    One pipeline step.
+
+    A per-device stage runs once per device and receives, for each
+    dependency, that device's output (per-device dependency) or its entry
+    of a device-keyed dict (global dependency). A global stage receives the
+    full output of global dependencies and a device -> output dict for
+    per-device ones.
+    """
+
+    def __init__(self, name, func, deps=(), settings=(), per_device=False, source=False, version=1,
+                 fingerprint=None):
+        """
+        Parameters:
+        - name: Stage name
+        - func: func(inputs, device, key) -> output (inputs: dict of dependency -> value)
+        - deps: Names of upstream stages
+        - settings: config attribute names that affect the output
+        - per_device: Run once per device
+        - source: Always run (reads external data); downstream caching relies
+          on the content hash of its output
+        - version: Bump to invalidate cached outputs after a code change
+        - fingerprint: Optional callable(device) with extra key material
+          (e.g. tuned parameters from the model registry)
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.settings = tuple(settings)
+        self.per_device = per_device
+        self.source = source
+        self.version = version
+        self.fingerprint = fingerprint
+
+
+class Pipeline:
+    """A DAG of stages with content-addressed caching and concurrent execution."""
+
+    def __init__(self, stages, cache_dir=PIPELINE_CACHE_PATH):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name}: unknown dependencies {missing}")
+
+    def _cache_path(self, stage, device):
+        return os.path.join(self.cache_dir, stage, f"{device or '_all'}.pkl")
+
+    def artifact_dir(self, stage):
+        """Directory for files a stage writes besides its cached output."""
+        path = os.path.join(self.cache_dir, stage, 'artifacts')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def prune_artifacts(self, stage, prefix, keep=PIPELINE_KEEP_ARTIFACTS):
+        """
+        Delete all but the newest `keep` artifact sets of a stage whose file
+        names start with prefix (a set = the files named with one task key,
+        e.g. a model and its direction models).
+
+        Returns:
+        - Number of files deleted
+        """
+        directory = self.artifact_dir(stage)
+        sets = {}
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and not name.endswith('.tmp'):
+                sets.setdefault(name[len(prefix):len(prefix) + 20], []).append(os.path.join(directory, name))
+        newest = sorted(sets, key=lambda k: max(os.path.getmtime(p) for p in sets[k]), reverse=True)
+        removed = 0
+        for stale in newest[max(keep, 1):]:
+            for path in sets[stale]:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def _task_key(self, stage, device, dep_hashes):
+        digest = hashlib.sha1(f"{stage.name}:v{stage.version}:{device}".encode())
+        for setting in stage.settings:
+            digest.update(f"{setting}={getattr(config, setting)!r};".encode())
+        if stage.fingerprint is not None:
+            digest.update(repr(stage.fingerprint(device)).encode())
+        for dep in sorted(dep_hashes):
+            digest.update(f"{dep}={dep_hashes[dep]};".encode())
+        return digest.hexdigest()[:20]
+
+    def _tasks(self, targets, devices):
+        """Tasks (stage, device) needed for the targets, with their upstream tasks."""
+        needed, stack = [], list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.append(name)
+                stack.extend(self.stages[name].deps)
+
+        tasks = {}
+        for name in needed:
+            stage = self.stages[name]
+            for device in (devices if stage.per_device else [None]):
+                upstream = []
+                for dep in stage.deps:
+                    if self.stages[dep].per_device:
+                        upstream += [(dep, device)] if stage.per_device else [(dep, d) for d in devices]
+                    else:
+                        upstream.append((dep, None))
+                tasks[(name, device)] = upstream
+        return tasks
+
+    def _inputs(self, stage, device, results):
+        """Dependency values and hashes for one task."""
+        inputs, hashes = {}, {}
+        for dep in stage.deps:
+            dep_stage = self.stages[dep]
+            if dep_stage.per_device and stage.per_device:
+                value, digest = results[(dep, device)]
+            elif dep_stage.per_device:
+                value = {d: results[(dep, d)][0] for (name, d) in results if name == dep}
+                digest = content_hash({d: results[(dep, d)][1] for (name, d) in results if name == dep})
+            elif stage.per_device and isinstance(results[(dep, None)][0], dict):
+                # Device slice of a device-keyed global output
+                value = results[(dep, None)][0].get(device)
+                digest = content_hash(value)
+            else:
+                value, digest = results[(dep, None)]
+            inputs[dep], hashes[dep] = value, digest
+        return inputs, hashes
+
+    def _run_task(self, stage, device, inputs, hashes, force):
+        """Run one task or serve it from the cache. Returns (output, output hash, status)."""
+        key = self._task_key(stage, device, hashes)
+        path = self._cache_path(stage.name, device)
+        if not stage.source and not force and os.path.exists(path):
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['key'] == key:
+                increment('cache_hits', cache=f'pipeline_{stage.name}')
+                return cached['output'], cached['output_hash'], 'cached'
+
+        increment('cache_misses', cache=f'pipeline_{stage.name}')
+        with timed(f'pipeline.{stage.name}'):
+            output = stage.func(inputs, device, key)
+        output_hash = content_hash(output)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'output': output, 'output_hash': output_hash}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return output, output_hash, 'ran'
+
+    def run(self, targets=None, devices=(), force=(), workers=PIPELINE_WORKERS):
+        """
+        Run the tasks needed for the targets.
+
+        Parameters:
+        - targets: Stage names to build (default: every stage)
+        - devices: Device IDs for per-device stages
+        - force: Stage names to rerun even if their cache is valid
+        - workers: Tasks run concurrently
+
+        Returns:
+        - dict of (stage, device) -> 'ran', 'cached', 'failed' or 'skipped'
+        """
+        tasks = self._tasks(targets or list(self.stages), list(devices))
+        results, status = {}, {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while len(status) < len(tasks):
+                for task, upstream in tasks.items():
+                    if task in status or task in running.values():
+                        continue
+                    if any(status.get(dep) in ('failed', 'skipped') for dep in upstream):
+                        status[task] = 'skipped'
+                        print(f"   ⏭️  {task[0]}{f' [{task[1]}]' if task[1] else ''}: upstream failed")
+                    elif all(dep in results for dep in upstream):
+                        stage = self.stages[task[0]]
+                        inputs, hashes = self._inputs(stage, task[1], results)
+                        future = pool.submit(self._run_task, stage, task[1], inputs, hashes, task[0] in force)
+                        running[future] = task
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    label = f"{task[0]}{f' [{task[1]}]' if task[1] else ''}"
+                    try:
+                        output, output_hash, outcome = future.result()
+                        results[task] = (output, output_hash)
+                        status[task] = outcome
+                        print(f"   {'✅' if outcome == 'ran' else '♻️ '} {label}: {outcome}")
+                    except Exception as e:
+                        increment('errors', stage=f'pipeline.{task[0]}')
+                        status[task] = 'failed'
+                        print(f"   ❌ {label}: {e}")
+        return status
+
+
+# ============================================================================
+# ECOFLOW STAGES
+# ============================================================================
+
+def _extract_traffic(inputs, device, key):
+    """Raw readings per device (device -> DataFrame)."""
+    from data_extraction import get_german_traffic_data
+
+    frames = {}
+    for imei in pipeline_devices():
+        df = get_german_traffic_data(imei, config.TRAINING_DATA_MONTHS)
+        if df is None:
+            raise RuntimeError(f"traffic extraction failed for {imei}")
+        frames[imei] = df
+    return frames
+
+
+def _clean(inputs, device, key):
+    from preprocessing import load_clean_traffic
+    return load_clean_traffic(inputs['extract'])
+
+
+def _train(inputs, device, key):
+    """
+    Train one device on its clean 15-minute frame (the raw readings are only
+    scanned for sensor anomalies); returns the model file (named by task key).
+    """
+    from model import TrafficPredictor
+
+    model_path = os.path.join(ECOFLOW.artifact_dir('train'), f"{device}_{key}.pkl")
+    if not TrafficPredictor().train_frame(inputs['extract'], df_15min=inputs['clean'], model_path=model_path):
+        raise RuntimeError(f"training failed for {device}")
+    ECOFLOW.prune_artifacts('train', f"{device}_")
+    return model_path
+
+
+def _forecast(inputs, device, key):
+    """Forecast table of one device; returns the table file."""
+    from model import TrafficPredictor
+    from forecast_table import build_forecast_table, save_forecast_table
+
+    predictor = TrafficPredictor()
+    if not predictor.load_model(inputs['train']):
+        raise RuntimeError(f"cannot load model {inputs['train']}")
+    path = os.path.join(ECOFLOW.artifact_dir('forecast'), f"{device}_{key}.npz")
+    save_forecast_table(build_forecast_table(predictor), path)
+    ECOFLOW.prune_artifacts('forecast', f"{device}_")
+    return path
+
+
+def _rollups(inputs, device, key):
+    from rollups import RollupStore
+    return RollupStore().build(pd.concat(inputs['clean'].values(), ignore_index=True))
+
+
+def _extract_air_quality(inputs, device, key):
+    from data_extraction import get_air_quality_data
+
+    frame = get_air_quality_data(config.AQ_DATA_MONTHS)
+    if frame is None:
+        raise RuntimeError("air quality extraction failed")
+    return frame
+
+
+def _train_air_quality(inputs, device, key):
+    """Fleet air quality forecast table; returns the table file."""
+    from aq_model import build_aq_forecast_table
+    from forecast_table import save_forecast_table
+
+    path = os.path.join(ECOFLOW.artifact_dir('aq_train'), f"aq_{key}.npz")
+    save_forecast_table(build_aq_forecast_table(inputs['aq_extract']), path)
+    ECOFLOW.prune_artifacts('aq_train', 'aq_')
+    return path
+
+
+def _copy_atomic(source, destination):
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def _publish(inputs, device, key):
+    """
+    Promote the primary device's model and forecast table to the paths the
+    dashboard and scheduler read.
+    """
+    from model import direction_model_paths
+
+    primary = pipeline_devices()[0]
+    model_path = inputs['train'][primary]
+    for source, destination in zip((model_path, *direction_model_paths(model_path)),
+                                   (config.MODEL_PATH, *direction_model_paths(config.MODEL_PATH))):
+        if os.path.exists(source):
+            _copy_atomic(source, destination)
+    # Table last: ForecastTable.is_current() compares it against the model mtime
+    _copy_atomic(inputs['forecast'][primary], config.FORECAST_TABLE_PATH)
+    return {'device': primary, 'model': model_path, 'published': key}
+
+
+def _publish_air_quality(inputs, device, key):
+    """Promote the air quality forecast table to the path the dashboard and scheduler read."""
+    _copy_atomic(inputs['aq_train'], config.AQ_FORECAST_TABLE_PATH)
+    return {'table': inputs['aq_train'], 'published': key}
+
+
+def _tuned_params(device):
+    from registry import best_params
+    return [best_params(device, series) for series in ('total', 'tr1', 'tr2')]
+
+
+_devices = None
+
+
+def pipeline_devices():
+    """Devices to build: PIPELINE_DEVICES, or the German device from the database."""
+    global _devices
+    if _devices is None:
+        if PIPELINE_DEVICES:
+            _devices = [str(d) for d in PIPELINE_DEVICES]
+        else:
+            from data_extraction import get_german_device_imei
+            imei = get_german_device_imei()
+            _devices = [str(imei)] if imei else []
+    return _devices
+
+
+CLEAN_SETTINGS = ('PREPROCESS_CAP_PERCENTILE', 'PREPROCESS_CAP_HEADROOM', 'PREPROCESS_MIN_COVERAGE')
+
+ECOFLOW = Pipeline([
+    Stage('extract', _extract_traffic, settings=('TRAINING_DATA_MONTHS',), source=True),
+    Stage('clean', _clean, deps=('extract',), settings=CLEAN_SETTINGS, per_device=True),
+    Stage('train', _train, deps=('extract', 'clean'), settings=TRAIN_SETTINGS, per_device=True,
+          fingerprint=_tuned_params),
+    Stage('forecast', _forecast, deps=('train',), settings=('FORECAST_TABLE_DAYS',), per_device=True),
+    Stage('rollups', _rollups, deps=('clean',)),
+    Stage('aq_extract', _extract_air_quality, settings=('AQ_DATA_MONTHS',), source=True),
+    Stage('aq_train', _train_air_quality, deps=('aq_extract',),
+          settings=('AQ_PROPHET_PARAMS', 'AQ_FIT_MODE', 'AQ_REGRESSORS', 'AQ_POLLUTANTS',
+                    'AQ_MIN_TRAINING_DAYS', 'AQ_FORECAST_TABLE_DAYS')),
+    Stage('publish', _publish, deps=('train', 'forecast')),
+    Stage('aq_publish', _publish_air_quality, deps=('aq_train',))
+])
+
+
+if __name__ == "__main__":
+    """
+    Run the pipeline: python pipeline.py [stage ...] [--force stage,stage]
+    """
+    import sys
+
+    print("=" * 70)
+    print("🏗️  PROJECT ECOFLOW - PIPELINE")
+    print("=" * 70)
+
+    args = sys.argv[1:]
+    force = ()
+    if '--force' in args:
+        i = args.index('--force')
+        force = tuple(args[i + 1].split(',')) if i + 1 < len(args) else tuple(ECOFLOW.stages)
+        args = args[:i] + args[i + 2:]
+
+    devices = pipeline_devices()
+    if not devices:
+        print("\n❌ No traffic device found - check the database connection")
+        exit(1)
+
+    start = time.perf_counter()
+    status = ECOFLOW.run(targets=args or None, devices=devices, force=force)
+    counts = pd.Series(list(status.values())).value_counts()
+    print(f"\n{'✅' if 'failed' not in counts else '⚠️ '} Pipeline finished in {time.perf_counter() - start:.1f}s: "
+          + ", ".join(f"{n} {outcome}" for outcome, n in counts.items()))
+    exit(1 if 'failed' in counts else 0)
@@ -0,0 +1,217 @@
+"""
+Training Data Preprocessing for Project EcoFlow
+Turns raw sensor readings into clean 15-minute training sets: deduplicated,
+outliers capped at data-derived percentiles, a complete regular 15-minute
+index per device with reading counts, and partial buckets scaled up to a
+full interval (or dropped when too sparse). Fully vectorized and cached by
+a hash of the input, so fleet training sets rebuild in seconds.
+"""
+
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from config import (
+    PREPROCESS_CACHE_PATH,
+    PREPROCESS_CAP_PERCENTILE,
+    PREPROCESS_CAP_HEADROOM,
+    PREPROCESS_MIN_COVERAGE
+)
+from metrics import timed, increment
+
+CHANNELS = ('tr1', 'tr2')
+SLOT_NS = 15 * 60 * 10**9
+
+
+def input_hash(df, **params):
+    """
+    Content hash of a raw readings frame plus the cleaning parameters
+    (vectorized via pandas' row hashing).
+    """
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()[:20]
+
+
+def _expected_readings(device_codes, timestamps_ns, n_devices):
+    """
+    Readings a full 15-minute bucket should hold per device, from the median
+    spacing between consecutive readings (sensors report at different rates).
+    """
+    spacing = np.diff(timestamps_ns).astype(float)
+    same_device = device_codes[1:] == device_codes[:-1]
+    spacing[~same_device | (spacing <= 0)] = np.nan
+
+    expected = np.ones(n_devices)
+    order = np.argsort(device_codes[1:], kind='stable')
+    codes, spacing = device_codes[1:][order], spacing[order]
+    boundaries = np.searchsorted(codes, np.arange(n_devices + 1))
+    for d in range(n_devices):
+        gaps = spacing[boundaries[d]:boundaries[d + 1]]
+        gaps = gaps[np.isfinite(gaps)]
+        if len(gaps):
+            expected[d] = np.clip(SLOT_NS / np.median(gaps), 1, 15 * 60)
+    return expected
+
+
+def clean_traffic(df, id_column='imei', cap_percentile=PREPROCESS_CAP_PERCENTILE,
+                  min_coverage=PREPROCESS_MIN_COVERAGE):
+    """
+    Build a clean, regular 15-minute training set from raw readings.
+
+    Parameters:
+    - df: Raw readings with timestamp, tr1, tr2 (and id_column for fleets)
+    - id_column: Device identifier column (a single device if absent)
+    - cap_percentile: Per-device, per-direction percentile that readings are capped at
+    - min_coverage: Minimum fraction of expected readings for a bucket to be kept
+
+    Returns:
+    - DataFrame with id_column, ds_15min, tr1, tr2, total_traffic, readings,
+      coverage - one row per device and 15-minute slot, with NaN values for
+      missing or too-sparse buckets
+    """
+    with timed('preprocess.clean', rows=len(df)):
+        timestamps = pd.to_datetime(df['timestamp'])
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_localize(None)
+        devices = df[id_column].astype(str) if id_column in df.columns else pd.Series('unknown', index=df.index)
+        values = np.column_stack([pd.to_numeric(df[c], errors='coerce').to_numpy(dtype=float) for c in CHANNELS])
+        values[values < 0] = np.nan
+
+        # Dedup on (device, timestamp), keeping the last reading received
+        frame = pd.DataFrame({'device': devices.to_numpy(), 'ts': timestamps.to_numpy()})
+        duplicated = frame.duplicated(['device', 'ts'], keep='last').to_numpy()
+        keep = ~duplicated & np.isfinite(values).all(axis=1)
+        duplicates = int(duplicated.sum())
+        if duplicates:
+            increment('preprocess_duplicates', amount=duplicates)
+
+        device_codes, device_names = pd.factorize(frame['device'].to_numpy()[keep], sort=True)
+        ts_ns = frame['ts'].to_numpy()[keep].astype('datetime64[ns]').astype(np.int64)
+        values = values[keep]
+        order = np.lexsort((ts_ns, device_codes))
+        device_codes, ts_ns, values = device_codes[order], ts_ns[order], values[order]
+        n_devices = len(device_names)
+
+        # Cap readings at a per-device, per-direction percentile (x headroom)
+        caps = np.empty((n_devices, len(CHANNELS)))
+        boundaries = np.searchsorted(device_codes, np.arange(n_devices + 1))
+        for d in range(n_devices):
+            block = values[boundaries[d]:boundaries[d + 1]]
+            caps[d] = np.percentile(block, cap_percentile, axis=0) * PREPROCESS_CAP_HEADROOM if len(block) else np.inf
+        capped = values > caps[device_codes]
+        if capped.any():
+            increment('preprocess_capped', amount=int(capped.sum()))
+        values = np.minimum(values, caps[device_codes])
+
+        # Complete regular index: each device spans its first to last slot
+        slot = ts_ns // SLOT_NS
+        first = np.full(n_devices, np.iinfo(np.int64).max)
+        last = np.full(n_devices, np.iinfo(np.int64).min)
+        np.minimum.at(first, device_codes, slot)
+        np.maximum.at(last, device_codes, slot)
+        lengths = np.where(last >= first, last - first + 1, 0)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+        # Sum and count per bucket with one bincount each
+        position = offsets[device_codes] + (slot - first[device_codes])
+        total_slots = offsets[-1]
+        readings = np.bincount(position, minlength=total_slots)
+        sums = np.column_stack([np.bincount(position, weights=values[:, i], minlength=total_slots)
+                                for i in range(len(CHANNELS))])
+
+        # Normalize partial buckets to a full interval; drop buckets that are too sparse
+        expected = _expected_readings(device_codes, ts_ns, n_devices)
+        bucket_device = np.repeat(np.arange(n_devices), lengths)
+        coverage = np.minimum(readings / expected[bucket_device], 1.0)
+        usable = coverage >= min_coverage
+        with np.errstate(invalid='ignore', divide='ignore'):
+            normalized = np.where(usable[:, None], sums / coverage[:, None], np.nan)
+
+        bucket_slot = np.arange(total_slots) - np.repeat(offsets[:-1], lengths) + np.repeat(first, lengths)
+        result = pd.DataFrame({
+            id_column: device_names[bucket_device],
+            'ds_15min': pd.to_datetime(bucket_slot * SLOT_NS),
+            'tr1': normalized[:, 0],
+            'tr2': normalized[:, 1],
+            'total_traffic': normalized[:, 0] + normalized[:, 1],
+            'readings': readings,
+            'coverage': coverage
+        })
+
+    increment('preprocess_partial_buckets', amount=int(((coverage > 0) & (coverage < 1)).sum()))
+    return result
+
+
+def load_clean_traffic(df, id_column='imei', cache_dir=PREPROCESS_CACHE_PATH, **params):
+    """
+    clean_traffic() with an on-disk cache keyed by the input hash.
+
+    Parameters:
+    - df: Raw readings
+    - cache_dir: Cache directory (None disables caching)
+    - params: Passed through to clean_traffic()
+
+    Returns:
+    - Clean 15-minute DataFrame
+    """
+    if not cache_dir:
+        return clean_traffic(df, id_column=id_column, **params)
+
+    path = os.path.join(cache_dir, f"clean_{input_hash(df, id_column=id_column, **params)}.pkl")
+    if os.path.exists(path):
+        increment('cache_hits', cache='preprocess')
+        with timed('preprocess.cache_load'), open(path, 'rb') as f:
+            return pickle.load(f)
+
+    increment('cache_misses', cache='preprocess')
+    result = clean_traffic(df, id_column=id_column, **params)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return result
+
+
+def data_derived_cap(df_15min, column='total_traffic', percentile=PREPROCESS_CAP_PERCENTILE,
+                     ceiling=None):
+    """
+    Prediction cap from the clean training data: the given percentile of
+    15-minute totals times the headroom factor, never above `ceiling`.
+    """
+    values = df_15min[column].to_numpy(dtype=float)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return ceiling
+    cap = float(np.percentile(values, percentile) * PREPROCESS_CAP_HEADROOM)
+    return min(cap, ceiling) if ceiling is not None else cap
+
+
+if __name__ == "__main__":
+    """
+    Clean the extracted training data and report what changed
+    """
+    import time
+    from config import TRAINING_DATA_MONTHS
+
+    print("=" * 70)
+    print("🧹 PROJECT ECOFLOW - PREPROCESSING")
+    print("=" * 70)
+
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Training data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the training data")
+        exit(1)
+
+    raw = pd.read_csv(data_path)
+    start = time.perf_counter()
+    clean = load_clean_traffic(raw)
+    elapsed = time.perf_counter() - start
+
+    print(f"\n✅ {len(raw):,} readings -> {len(clean):,} 15-minute slots in {elapsed:.2f}s")
+    print(f"   Empty slots:   {(clean['readings'] == 0).sum():,}")
+    print(f"   Partial slots: {((clean['coverage'] > 0) & (clean['coverage'] < 1)).sum():,}")
+    print(f"   Dropped (coverage < {PREPROCESS_MIN_COVERAGE:.0%}): {clean['total_traffic'].isna().sum():,}")
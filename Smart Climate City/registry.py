@@ -0,0 +1,126 @@
+"""
+Model Registry for Project EcoFlow
+Small JSON store of per-device, per-direction model configuration (e.g. the
+Prophet settings chosen by tuning.py), read by TrafficPredictor at training time,
+and of the trained model published for every device by fleet training
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from config import MODEL_REGISTRY_PATH
+
+try:
+    import fcntl
+except ImportError:  # No advisory locks (Windows): single-writer use only
+    fcntl = None
+
+
+def load_registry(path=MODEL_REGISTRY_PATH):
+    """
+    Load the registry from disk.
+
+    Returns:
+    - dict with a 'devices' mapping (empty registry if the file does not exist)
+    """
+    if not os.path.exists(path):
+        return {'devices': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_registry(registry, path=MODEL_REGISTRY_PATH):
+    """Write the registry atomically (readers never see a partial file)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _locked(path):
+    """Exclusive lock for a read-modify-write of the registry across processes."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def register_params(device_imei, series, params, score=None, metric='mae', path=MODEL_REGISTRY_PATH):
+    """
+    Record the configuration to use for one device and series.
+
+    Parameters:
+    - device_imei: Device identifier
+    - series: 'total', 'tr1' or 'tr2'
+    - params: Prophet constructor settings
+    - score: Holdout score of this configuration (lower is better)
+    - metric: Name of the score metric
+    """
+    with _locked(path):
+        registry = load_registry(path)
+        entry = registry['devices'].setdefault(str(device_imei), {})
+        entry[series] = {
+            'params': params,
+            'score': score,
+            'metric': metric,
+            'updated': datetime.now().isoformat(timespec='seconds')
+        }
+        save_registry(registry, path)
+
+
+def register_model(device_imei, key, model_path, path=MODEL_REGISTRY_PATH, **info):
+    """
+    Publish the trained model of one device. Idempotent: publishing the same
+    key again (e.g. a retried or duplicated fleet job) changes nothing.
+
+    Parameters:
+    - device_imei: Device identifier
+    - key: Content key of the training job (same inputs = same key)
+    - model_path: Main model file (direction models sit next to it)
+    - info: Extra fields stored with the entry (worker, run, ...)
+
+    Returns:
+    - True if the registry changed, False if this key was already published
+    """
+    with _locked(path):
+        registry = load_registry(path)
+        models = registry.setdefault('models', {})
+        if models.get(str(device_imei), {}).get('key') == key:
+            return False
+        models[str(device_imei)] = {
+            'key': key,
+            'path': model_path,
+            'published': datetime.now().isoformat(timespec='seconds'),
+            **info
+        }
+        save_registry(registry, path)
+    return True
+
+
+def published_model(device_imei, path=MODEL_REGISTRY_PATH):
+    """Registry entry of the published model of one device (None if never published)."""
+    return load_registry(path).get('models', {}).get(str(device_imei))
+
+
+def best_params(device_imei, series, path=MODEL_REGISTRY_PATH):
+    """
+    Registered configuration for one device and series.
+
+    Returns:
+    - dict of Prophet settings, or None if the device was never tuned
+    """
+    try:
+        entry = load_registry(path)['devices'].get(str(device_imei), {}).get(series)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Could not read model registry: {e}")
+        return None
+    return entry['params'] if entry else None
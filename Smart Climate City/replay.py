@@ -0,0 +1,206 @@
+"""
+Historical Policy Replay for Project EcoFlow
+Drives the SmartIntersection rules over an aligned traffic x air quality
+panel (alignment.py), one decision per device and 15-minute slot, and
+sweeps grids of capacity and PM10 thresholds. Rules are evaluated with the
+vectorized logic.decide_batch(); each worker takes one PM10 threshold and
+evaluates every capacity threshold against it at once.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from config import (
+    DEFAULT_CAPACITY_THRESHOLD,
+    EMERGENCY_PM10_THRESHOLD,
+    REPLAY_CAPACITY_GRID,
+    REPLAY_PM10_GRID,
+    REPLAY_WORKERS
+)
+from logic import ACTIONS, decide_batch
+from metrics import timed
+
+SLOT_MINUTES = 15
+_worker_arrays = None
+
+
+def prepare_replay(panel, noise_column='leq'):
+    """
+    Arrays for the replay from an aligned panel, ordered by device and time.
+    Slots without traffic or PM10 (no sensor within the alignment tolerance)
+    are left out: the rules cannot be evaluated there, and counting them as
+    NORMAL would dilute the shares and dwell times. A left-out slot breaks
+    the run like a gap in the data.
+
+    Parameters:
+    - panel: alignment.align_panel() output (optionally with a noise column)
+    - noise_column: Column with noise Leq in dB(A), used when present
+
+    Returns:
+    - dict with traffic (vehicles per hour), pm10, noise (or None) and
+      continues (True where a slot directly follows the previous row's slot
+      on the same device) for the covered slots, covered (mask over the
+      sorted panel) and coverage (share of slots replayed)
+    """
+    ordered = panel.sort_values(['imei', 'ds_15min'])
+    imei = ordered['imei'].astype(str).to_numpy()
+    ns = pd.to_datetime(ordered['ds_15min']).to_numpy('datetime64[ns]').astype(np.int64)
+    traffic = ordered['total_traffic'].to_numpy(dtype=float) * (60 // SLOT_MINUTES)
+    pm10 = ordered['p10'].to_numpy(dtype=float)
+    covered = np.isfinite(traffic) & np.isfinite(pm10)
+
+    continues = np.zeros(len(ordered), dtype=bool)
+    continues[1:] = (imei[1:] == imei[:-1]) & (np.diff(ns) == SLOT_MINUTES * 60 * 10**9) & covered[:-1]
+    noise = ordered[noise_column].to_numpy(dtype=float)[covered] if noise_column in ordered.columns else None
+    return {
+        'traffic': traffic[covered],
+        'pm10': pm10[covered],
+        'noise': noise,
+        'continues': continues[covered],
+        'covered': covered,
+        'coverage': covered.mean() if len(covered) else np.nan
+    }
+
+
+def action_statistics(actions, continues, slot_minutes=SLOT_MINUTES):
+    """
+    Frequencies, flapping and time-in-state for one replayed action sequence.
+
+    Parameters:
+    - actions: Action codes (logic.ACTIONS indices), ordered by device and time
+    - continues: From prepare_replay()
+
+    Returns:
+    - dict with <action>_share, switches, switches_per_day, flaps (one-slot
+      excursions that switch straight back) and <action>_dwell_minutes (mean
+      uninterrupted time in the state)
+    """
+    n = len(actions)
+    changed = np.zeros(n, dtype=bool)
+    changed[1:] = continues[1:] & (actions[1:] != actions[:-1])
+    flaps = int((changed[1:-1] & continues[2:] & (actions[2:] == actions[:-2])).sum())
+
+    # Runs start at every change and every device/gap break
+    starts = changed | ~continues
+    lengths = np.bincount(np.cumsum(starts) - 1)
+    run_action = actions[starts]
+    run_count = np.bincount(run_action, minlength=len(ACTIONS))
+    run_slots = np.bincount(run_action, weights=lengths, minlength=len(ACTIONS))
+
+    stats = {}
+    for code, name in enumerate(ACTIONS):
+        stats[f'{name.lower()}_share'] = run_slots[code] / n if n else np.nan
+    stats['switches'] = int(changed.sum())
+    stats['switches_per_day'] = stats['switches'] / (n * slot_minutes / 1440) if n else np.nan
+    stats['flaps'] = flaps
+    for code, name in enumerate(ACTIONS):
+        stats[f'{name.lower()}_dwell_minutes'] = (run_slots[code] / run_count[code] * slot_minutes
+                                                 if run_count[code] else np.nan)
+    return stats
+
+
+def replay(panel, capacity_threshold=DEFAULT_CAPACITY_THRESHOLD, pm10_threshold=EMERGENCY_PM10_THRESHOLD):
+    """
+    Replay one threshold pair.
+
+    Returns:
+    - (panel sorted by device and time with an 'action' column - NaN where
+      the slot is not covered - and the statistics dict with coverage)
+    """
+    arrays = prepare_replay(panel)
+    actions = decide_batch(arrays['traffic'], arrays['pm10'], noise_level=arrays['noise'],
+                           capacity_threshold=capacity_threshold, pm10_threshold=pm10_threshold)
+    ordered = panel.sort_values(['imei', 'ds_15min']).reset_index(drop=True)
+    codes = np.full(len(ordered), -1, dtype=np.int8)
+    codes[arrays['covered']] = actions
+    ordered['action'] = pd.Categorical.from_codes(codes, categories=list(ACTIONS))
+    return ordered, {'coverage': arrays['coverage'], **action_statistics(actions, arrays['continues'])}
+
+
+def _init_worker(arrays):
+    """Give each pool worker the replay arrays once, not per task."""
+    global _worker_arrays
+    _worker_arrays = arrays
+
+
+def _replay_threshold(task):
+    """All capacity thresholds for one PM10 threshold: one decide_batch call."""
+    pm10_threshold, capacities = task
+    arrays = _worker_arrays
+    actions = decide_batch(arrays['traffic'], arrays['pm10'], noise_level=arrays['noise'],
+                           capacity_threshold=np.asarray(capacities, dtype=float)[:, None],
+                           pm10_threshold=pm10_threshold)
+    return [{'capacity_threshold': capacity, 'pm10_threshold': pm10_threshold, 'coverage': arrays['coverage'],
+             **action_statistics(row, arrays['continues'])}
+            for capacity, row in zip(capacities, actions)]
+
+
+def sweep(panel, capacities=REPLAY_CAPACITY_GRID, pm10_thresholds=REPLAY_PM10_GRID, workers=REPLAY_WORKERS):
+    """
+    Replay every combination of capacity and PM10 threshold.
+
+    Parameters:
+    - panel: Aligned panel (alignment.align_panel())
+    - capacities: Capacity thresholds (cars/hr)
+    - pm10_thresholds: PM10 rerouting thresholds (µg/m³)
+    - workers: Process pool size (1 = run in this process)
+
+    Returns:
+    - DataFrame with one row per threshold pair, the coverage and the
+      action_statistics() columns (over covered slots)
+    """
+    arrays = prepare_replay(panel)
+    arrays.pop('covered')  # Workers only need the covered slots
+    tasks = [(float(threshold), list(capacities)) for threshold in pm10_thresholds]
+    with timed('replay.sweep', slots=len(arrays['traffic']), pairs=len(tasks) * len(capacities)):
+        if workers == 1:
+            _init_worker(arrays)
+            results = [_replay_threshold(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(arrays,)) as pool:
+                results = list(pool.map(_replay_threshold, tasks))
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+if __name__ == "__main__":
+    """
+    Replay the current rules over the aligned historical data and sweep the thresholds
+    """
+    import os
+    import time
+    from config import TRAINING_DATA_MONTHS, AQ_DATA_MONTHS
+
+    print("=" * 70)
+    print("⏪ PROJECT ECOFLOW - POLICY REPLAY")
+    print("=" * 70)
+
+    paths = {
+        'traffic': f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv',
+        'air_quality': f'data_cache/air_quality_{AQ_DATA_MONTHS}m.csv',
+        'locations': 'data_cache/device_locations.csv'
+    }
+    missing = [path for path in paths.values() if not os.path.exists(path)]
+    if missing:
+        print(f"\n❌ Data not found: {', '.join(missing)}")
+        print("⚠️  Run data_extraction.py first to extract the data")
+        exit(1)
+
+    from alignment import load_aligned_panel
+    from preprocessing import load_clean_traffic
+
+    panel = load_aligned_panel(load_clean_traffic(pd.read_csv(paths['traffic'])),
+                               pd.read_csv(paths['air_quality']),
+                               pd.read_csv(paths['locations'], dtype={'imei': str}))
+    print(f"\n✅ {len(panel):,} aligned slots ({panel['p10'].notna().mean():.1%} with PM10)")
+
+    _, current = replay(panel)
+    print(f"\n📊 Current thresholds ({DEFAULT_CAPACITY_THRESHOLD} cars/hr, {EMERGENCY_PM10_THRESHOLD} µg/m³):")
+    for key, value in current.items():
+        print(f"   {key}: {value:.3f}" if isinstance(value, float) else f"   {key}: {value}")
+
+    start = time.perf_counter()
+    results = sweep(panel)
+    print(f"\n✅ Swept {len(results)} threshold pairs in {time.perf_counter() - start:.2f}s")
+    print(results.pivot(index='capacity_threshold', columns='pm10_threshold',
+                        values='reroute_share').round(3).to_string())
@@ -0,0 +1,274 @@
+"""
+Multi-Resolution Traffic Rollups for Project EcoFlow
+15-minute, hourly, daily and weekly pyramids per device for total traffic
+and both directions, stored in the columnar cache. Every bucket keeps
+sum, count, min and max of the 15-minute totals below it, so a chart at
+any zoom level reads a few thousand rows and still shows the peaks.
+"""
+
+import numpy as np
+import pandas as pd
+from config import ROLLUP_DEFAULT_WIDTH_PX, COLUMNAR_CACHE_PATH
+from metrics import timed, increment
+
+SERIES = ('total_traffic', 'tr1', 'tr2')
+LEVELS = {  # name -> bucket width
+    '15min': pd.Timedelta(minutes=15),
+    '1h': pd.Timedelta(hours=1),
+    '1d': pd.Timedelta(days=1),
+    '1w': pd.Timedelta(weeks=1)
+}
+WEEK_ANCHOR_NS = pd.Timestamp('1970-01-05').value  # Weeks start on Monday
+PARTS = ('sum', 'count', 'min', 'max')
+
+
+def _dataset(level):
+    return f'traffic_rollup_{level}'
+
+
+def _floor_ns(ns, level):
+    width = LEVELS[level].value
+    anchor = WEEK_ANCHOR_NS if level == '1w' else 0
+    return (ns - anchor) // width * width + anchor
+
+
+def _rollup(base, level):
+    """
+    Aggregate the 15-minute level (or partials of it) into one coarser level.
+    Sums and counts add, minima and maxima combine, so partial buckets
+    merge exactly.
+    """
+    bucket = _floor_ns(base['bucket'].to_numpy('datetime64[ns]').astype(np.int64), level)
+    keys = [base['imei'].astype(str).to_numpy(), bucket]
+    grouped = base.groupby(keys, sort=True)
+    aggregations = {f'{s}_{p}': ('sum' if p in ('sum', 'count') else p) for s in SERIES for p in PARTS}
+    result = grouped.agg(aggregations)
+    result.index.names = ['imei', 'bucket']
+    result = result.reset_index()
+    result['bucket'] = pd.to_datetime(result['bucket'])
+    return result
+
+
+def base_level(df_15min, id_column='imei'):
+    """
+    The 15-minute level from a clean 15-minute frame (preprocessing.clean_traffic
+    or model.aggregate_to_15min output): one bucket per slot with
+    count 1 and min = max = sum. Empty slots are left out.
+    """
+    imei = df_15min[id_column].astype(str) if id_column in df_15min.columns else 'unknown'
+    base = pd.DataFrame({'imei': imei, 'bucket': pd.to_datetime(df_15min['ds_15min'])})
+    for s in SERIES:
+        values = df_15min[s].to_numpy(dtype=float)
+        present = np.isfinite(values)
+        base[f'{s}_sum'] = np.where(present, values, 0.0)
+        base[f'{s}_count'] = present.astype(np.int64)
+        base[f'{s}_min'] = values
+        base[f'{s}_max'] = values
+    return base[base[[f'{s}_count' for s in SERIES]].sum(axis=1) > 0].reset_index(drop=True)
+
+
+class RollupStore:
+    """
+    The pyramid, loaded lazily per level from the columnar cache.
+    query() picks the level and reduces it to the pixel width of the chart.
+    """
+
+    def __init__(self, root=COLUMNAR_CACHE_PATH):
+        self.root = root
+        self.levels = {}
+
+    def _level(self, level):
+        if level not in self.levels:
+            from columnar_cache import load_columns
+            frame = load_columns(_dataset(level), root=self.root)
+            if frame is not None:
+                frame['imei'] = frame['imei'].astype(str)
+                frame = frame.sort_values(['imei', 'bucket'], ignore_index=True)
+            self.levels[level] = frame
+        return self.levels[level]
+
+    def build(self, df_15min, id_column='imei'):
+        """
+        Build every level from scratch and store it.
+
+        Parameters:
+        - df_15min: Clean 15-minute frame for one or more devices
+
+        Returns:
+        - dict of level -> number of buckets
+        """
+        from columnar_cache import save_columns
+
+        base = base_level(df_15min, id_column)
+        counts = {}
+        with timed('rollups.build', rows=len(base)):
+            for level in LEVELS:
+                frame = base if level == '15min' else _rollup(base, level)
+                save_columns(_dataset(level), frame, root=self.root)
+                self.levels[level] = frame.sort_values(['imei', 'bucket'], ignore_index=True)
+                counts[level] = len(frame)
+        return counts
+
+    def ingest(self, df_15min, id_column='imei'):
+        """
+        Fold newly ingested complete 15-minute slots into every level.
+        Only the coarse buckets those slots fall into are recomputed; slots
+        at or before a device's last stored slot are skipped.
+
+        Returns:
+        - Number of 15-minute slots added
+        """
+        from columnar_cache import save_columns
+
+        existing = self._level('15min')
+        new = base_level(df_15min, id_column)
+        if existing is not None and len(existing):
+            last = existing.groupby('imei')['bucket'].max()
+            cutoff = new['imei'].map(last)
+            stale = cutoff.notna() & (new['bucket'] <= cutoff)
+            if stale.any():
+                increment('rollup_stale_slots', amount=int(stale.sum()))
+            new = new[~stale.to_numpy()]
+        if len(new) == 0:
+            return 0
+
+        with timed('rollups.ingest', rows=len(new)):
+            for level in LEVELS:
+                current = self._level(level)
+                if level == '15min':
+                    merged = new if current is None else pd.concat([current, new], ignore_index=True)
+                else:
+                    partial = _rollup(new, level)
+                    if current is not None and len(current):
+                        # Re-aggregate only the buckets the new slots touch
+                        key = current['imei'] + '|' + current['bucket'].astype('int64').astype(str)
+                        touched = key.isin(partial['imei'] + '|' + partial['bucket'].astype('int64').astype(str))
+                        combined = pd.concat([current[touched.to_numpy()], partial], ignore_index=True)
+                        merged = pd.concat([current[~touched.to_numpy()], _rollup(combined, level)],
+                                           ignore_index=True)
+                    else:
+                        merged = partial
+                merged = merged.sort_values(['imei', 'bucket'], ignore_index=True)
+                save_columns(_dataset(level), merged, root=self.root)
+                self.levels[level] = merged
+        return len(new)
+
+    def devices(self):
+        """Devices with stored rollups."""
+        base = self._level('15min')
+        return [] if base is None else base['imei'].unique().tolist()
+
+    def time_range(self, device):
+        """(first slot start, last slot end) stored for a device, or None."""
+        base = self._level('15min')
+        if base is None:
+            return None
+        buckets = base.loc[base['imei'] == str(device), 'bucket']
+        if len(buckets) == 0:
+            return None
+        return buckets.iloc[0], buckets.iloc[-1] + LEVELS['15min']
+
+    def choose_level(self, start, end, width_px=ROLLUP_DEFAULT_WIDTH_PX):
+        """
+        Coarsest level that still has at least one bucket per pixel over
+        [start, end) - falling back to 15 minutes for short ranges.
+        """
+        span = pd.Timestamp(end) - pd.Timestamp(start)
+        chosen = '15min'
+        for level, width in LEVELS.items():
+            if span / width >= width_px:
+                chosen = level
+        return chosen
+
+    def query(self, device, start, end, series='total_traffic', width_px=ROLLUP_DEFAULT_WIDTH_PX):
+        """
+        Chart-ready series for one device and time range.
+
+        Parameters:
+        - device: Device IMEI
+        - start, end: Time range [start, end)
+        - series: 'total_traffic', 'tr1' or 'tr2'
+        - width_px: Chart width in pixels (at most this many points are returned)
+
+        Returns:
+        - DataFrame with ds, mean, min, max (vehicles per 15 minutes) and the
+          chosen level in .attrs['level'] (None if no rollups are stored)
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        level = self.choose_level(start, end, width_px)
+        frame = self._level(level)
+        if frame is None:
+            return None
+
+        with timed('rollups.query', level=level):
+            # Rows are sorted by (imei, bucket): two binary searches find the slice
+            devices = frame['imei'].to_numpy()
+            lo, hi = np.searchsorted(devices, str(device), 'left'), np.searchsorted(devices, str(device), 'right')
+            buckets = frame['bucket'].to_numpy()[lo:hi]
+            first, last = lo + np.searchsorted(buckets, start.to_datetime64()), lo + np.searchsorted(buckets, end.to_datetime64())
+            rows = frame.iloc[first:last]
+
+            sums = rows[f'{series}_sum'].to_numpy(dtype=float)
+            counts = rows[f'{series}_count'].to_numpy(dtype=float)
+            minima = rows[f'{series}_min'].to_numpy(dtype=float)
+            maxima = rows[f'{series}_max'].to_numpy(dtype=float)
+            ds = rows['bucket'].to_numpy()
+
+            if len(rows) > width_px:
+                # Min/max-preserving reduction to one point per pixel column
+                pixel = ((ds - start.to_datetime64()) / (end - start) * width_px).astype(np.int64)
+                pixel = np.clip(pixel, 0, width_px - 1)
+                sums = np.bincount(pixel, weights=sums, minlength=width_px)
+                counts = np.bincount(pixel, weights=counts, minlength=width_px)
+                low = np.full(width_px, np.inf)
+                high = np.full(width_px, -np.inf)
+                np.fmin.at(low, pixel, minima)
+                np.fmax.at(high, pixel, maxima)
+                keep = counts > 0
+                offsets = ((end - start).value * np.arange(width_px) // width_px).astype('timedelta64[ns]')
+                ds = (start.to_datetime64() + offsets)[keep]
+                sums, counts, minima, maxima = sums[keep], counts[keep], low[keep], high[keep]
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(counts > 0, sums / counts, np.nan)
+        result = pd.DataFrame({'ds': pd.to_datetime(ds), 'mean': mean, 'min': minima, 'max': maxima})
+        result.attrs['level'] = level
+        return result
+
+
+def build_from_csv(path):
+    """Clean a raw traffic extract and build the full pyramid from it."""
+    from preprocessing import load_clean_traffic
+
+    store = RollupStore()
+    return store, store.build(load_clean_traffic(pd.read_csv(path)))
+
+
+if __name__ == "__main__":
+    """
+    Build the rollup pyramid from the extracted training data and time a zoom
+    """
+    import os
+    import time
+    from config import TRAINING_DATA_MONTHS
+
+    print("=" * 70)
+    print("🗂️  PROJECT ECOFLOW - TRAFFIC ROLLUPS")
+    print("=" * 70)
+
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Training data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the training data")
+        exit(1)
+
+    store, counts = build_from_csv(data_path)
+    print(f"\n✅ Buckets per level: {counts}")
+
+    device = store.devices()[0]
+    end = store.time_range(device)[1]
+    for span in (pd.Timedelta(days=365), pd.Timedelta(days=30), pd.Timedelta(days=1), pd.Timedelta(hours=1)):
+        start = time.perf_counter()
+        chart = store.query(device, end - span, end)
+        print(f"   {str(span):>20}: level {chart.attrs['level']:>5}, {len(chart):4d} points "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
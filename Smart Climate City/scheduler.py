@@ -0,0 +1,324 @@
+"""
+Forecast Publishing Scheduler for Project EcoFlow
+Every quarter hour, computes the next PUBLISH_HORIZON_HOURS of total/TR1/TR2
+forecasts for every registered traffic device (and PM10/PM2.5 for every air
+quality device with a forecast table) in one batch, and publishes them as a
+single versioned .npz file that replaces the previous one atomically.
+Values are clipped at zero and capped like format_prediction() does, so
+consumers of the file see the same numbers as the dashboard.
+Signal controllers, signage and the dashboard read the latest forecasts
+with one file read instead of running the models per viewer.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    PUBLISHED_FORECAST_PATH,
+    PUBLISH_HORIZON_HOURS,
+    PUBLISH_INTERVAL_MINUTES,
+    PUBLISH_DELAY_SECONDS,
+    MODEL_PATH,
+    MODEL_REGISTRY_PATH,
+    FORECAST_TABLE_PATH,
+    AQ_FORECAST_TABLE_PATH,
+    AQ_POLLUTANTS,
+    TRAINING_DATA_MONTHS
+)
+from metrics import timed, increment, write_prometheus
+
+SERIES = ('total', 'tr1', 'tr2')
+COLUMNS = ('yhat', 'yhat_lower', 'yhat_upper')
+FLEET_TRAFFIC_PATH = f'data_cache/fleet_traffic_{TRAINING_DATA_MONTHS}m.csv'  # Written by data_extraction.py
+
+
+def default_forecasters(registry_path=MODEL_REGISTRY_PATH, fleet_path=FLEET_TRAFFIC_PATH):
+    """
+    The registered traffic forecasters: device IMEI -> object with
+    forecast_frame(series, future). Per device, the best available source wins:
+    1. The materialized forecast table (no Prophet import), for its device
+    2. The model published to the registry (fleet.py), else the promoted model
+    3. A seasonal baseline fitted on the fleet extract
+    """
+    forecasters = {}
+    if os.path.exists(fleet_path):
+        from baseline import fit_fleet_predictors
+        forecasters.update(fit_fleet_predictors(pd.read_csv(fleet_path, dtype={'imei': str})))
+
+    from registry import load_registry
+    published = load_registry(registry_path).get('models', {})
+    if published or os.path.exists(MODEL_PATH):
+        from model import TrafficPredictor
+
+        for device, entry in published.items():
+            predictor = TrafficPredictor()
+            if os.path.exists(entry['path']) and predictor.load_model(entry['path']):
+                forecasters[str(device)] = predictor
+        predictor = TrafficPredictor()
+        if os.path.exists(MODEL_PATH) and predictor.load_model(MODEL_PATH) and str(predictor.device_imei) not in published:
+            forecasters[str(predictor.device_imei)] = predictor
+
+    from forecast_table import ForecastTable
+
+    table = ForecastTable()
+    if table.is_current() and table.load(FORECAST_TABLE_PATH):
+        forecasters[table.device_imei] = table
+    return forecasters
+
+
+def default_aq_forecaster():
+    """The fleet air quality forecaster, or None without a forecast table."""
+    from aq_model import AirQualityForecaster
+
+    forecaster = AirQualityForecaster()
+    return forecaster if forecaster.load(AQ_FORECAST_TABLE_PATH) else None
+
+
+def cycle_origin(now=None, interval_minutes=PUBLISH_INTERVAL_MINUTES):
+    """Start of the publishing interval that contains `now`."""
+    return pd.Timestamp(now or datetime.now()).floor(f'{interval_minutes}min')
+
+
+def _has_directions(forecaster):
+    return bool(getattr(forecaster, 'use_directions', False))
+
+
+def clip_forecast(yhat, lower, upper, cap=None):
+    """
+    format_prediction() bounds on arrays: everything within [0, cap] (cap =
+    the model's data-derived cap, never above MAX_REASONABLE_15MIN) and the
+    bounds widened to contain the point forecast.
+    """
+    from model import MAX_REASONABLE_15MIN
+
+    cap = min(cap, MAX_REASONABLE_15MIN) if cap else MAX_REASONABLE_15MIN
+    yhat, lower, upper = (np.clip(np.asarray(v, dtype=np.float32), 0, cap) for v in (yhat, lower, upper))
+    return yhat, np.minimum(lower, yhat), np.maximum(upper, yhat)
+
+
+def build_publication(forecasters, aq_forecaster=None, origin=None, hours=PUBLISH_HORIZON_HOURS):
+    """
+    Compute one publication: every device, series and horizon slot.
+
+    Parameters:
+    - forecasters: dict of device -> traffic forecaster (default_forecasters())
+    - aq_forecaster: AirQualityForecaster or None
+    - origin: First forecast slot (default: the current interval start)
+    - hours: Forecast horizon
+
+    Returns:
+    - dict of arrays for publish(); traffic arrays are
+      <series>_<column> with shape (devices, slots), NaN where a device has
+      no model for the series, clipped and capped by clip_forecast()
+    """
+    origin = cycle_origin() if origin is None else pd.Timestamp(origin)
+    slots = hours * 60 // 15
+    future = pd.DataFrame({'ds': pd.date_range(origin, periods=slots, freq='15min')})
+    devices = sorted(forecasters)
+
+    arrays = {f'{s}_{c}': np.full((len(devices), slots), np.nan, dtype=np.float32) for s in SERIES for c in COLUMNS}
+    with timed('publish.traffic', devices=len(devices)):
+        for row, device in enumerate(devices):
+            forecaster = forecasters[device]
+            for series in SERIES if _has_directions(forecaster) else SERIES[:1]:
+                try:
+                    forecast = forecaster.forecast_frame(series, future)
+                except Exception as e:
+                    increment('errors', stage='publish.forecast')
+                    print(f"   ❌ {device}/{series}: {e}")
+                    continue
+                values = clip_forecast(*(forecast[column].to_numpy() for column in COLUMNS),
+                                       cap=getattr(forecaster, 'cap_15min', None))
+                for column, value in zip(COLUMNS, values):
+                    arrays[f'{series}_{column}'][row] = value
+
+    publication = {
+        'origin': np.int64(origin.value),
+        'slot_minutes': np.int64(15),
+        'devices': np.array(devices, dtype=str),
+        **arrays
+    }
+
+    aq_devices = []
+    if aq_forecaster is not None:
+        aq_devices = list(aq_forecaster.devices)
+        with timed('publish.air_quality', devices=len(aq_devices)):
+            for pollutant in AQ_POLLUTANTS:
+                for column in COLUMNS:
+                    publication[f'{pollutant}_{column}'] = np.full((len(aq_devices), slots), np.nan, dtype=np.float32)
+                for row, device in enumerate(aq_devices):
+                    forecast = aq_forecaster.forecast_frame(pollutant, device, future)
+                    for column in COLUMNS:
+                        publication[f'{pollutant}_{column}'][row] = forecast[column].to_numpy(dtype=np.float32)
+    publication['aq_devices'] = np.array(aq_devices, dtype=str)
+    return publication
+
+
+def read_version(path=PUBLISHED_FORECAST_PATH):
+    """Version and origin of the published forecasts ((0, None) if none yet)."""
+    if not os.path.exists(path):
+        return 0, None
+    with np.load(path) as data:
+        return int(data['version']), pd.Timestamp(int(data['origin']))
+
+
+def publish(publication, path=PUBLISHED_FORECAST_PATH):
+    """
+    Stamp a publication with the next version and replace the published
+    file atomically (readers see either the old or the new version).
+
+    Returns:
+    - The new version number
+    """
+    version = read_version(path)[0] + 1
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **publication, version=np.int64(version), created=np.array(datetime.now().isoformat()))
+    os.replace(tmp_path, path)
+    increment('forecasts_published')
+    return version
+
+
+def run_once(forecasters=None, aq_forecaster=None, now=None, path=PUBLISHED_FORECAST_PATH, force=False):
+    """
+    One publishing cycle. Skipped if the current interval is already published.
+
+    Returns:
+    - Published version, or None if skipped
+    """
+    origin = cycle_origin(now)
+    if not force and read_version(path)[1] == origin:
+        increment('publish_skipped')
+        return None
+    if forecasters is None:
+        forecasters = default_forecasters()
+        aq_forecaster = default_aq_forecaster() if aq_forecaster is None else aq_forecaster
+    with timed('publish.cycle'):
+        version = publish(build_publication(forecasters, aq_forecaster, origin), path)
+    return version
+
+
+def run_forever(interval_minutes=PUBLISH_INTERVAL_MINUTES, delay_seconds=PUBLISH_DELAY_SECONDS,
+                path=PUBLISHED_FORECAST_PATH, max_cycles=None):
+    """
+    Publish every interval, shortly after each boundary. Models are loaded
+    once and reloaded when the model, forecast table or fleet extract files
+    change; a failed cycle is logged and retried at the next boundary.
+    """
+    def model_mtimes():
+        return tuple(os.path.getmtime(p) if os.path.exists(p) else None
+                     for p in (MODEL_PATH, MODEL_REGISTRY_PATH, FORECAST_TABLE_PATH, AQ_FORECAST_TABLE_PATH,
+                               FLEET_TRAFFIC_PATH))
+
+    loaded_mtimes, forecasters, aq_forecaster = None, None, None
+    cycles = 0
+    while max_cycles is None or cycles < max_cycles:
+        if model_mtimes() != loaded_mtimes:
+            loaded_mtimes = model_mtimes()
+            forecasters, aq_forecaster = default_forecasters(), default_aq_forecaster()
+            print(f"🔄 Loaded {len(forecasters)} traffic and "
+                  f"{len(aq_forecaster.devices) if aq_forecaster else 0} air quality devices")
+        try:
+            started = time.perf_counter()
+            version = run_once(forecasters, aq_forecaster, path=path)
+            if version is not None:
+                print(f"📤 {datetime.now():%H:%M:%S} published v{version} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            increment('errors', stage='publish.cycle')
+            print(f"❌ Publishing failed: {e}")
+        write_prometheus()
+        cycles += 1
+
+        next_run = cycle_origin(interval_minutes=interval_minutes) + timedelta(minutes=interval_minutes,
+                                                                              seconds=delay_seconds)
+        time.sleep(max((next_run - pd.Timestamp(datetime.now())).total_seconds(), 1))
+
+
+class PublishedForecasts:
+    """
+    Read side: the latest publication, loaded with one file read and
+    reloaded only when its version changes.
+    """
+
+    def __init__(self, path=PUBLISHED_FORECAST_PATH):
+        self.path = path
+        self.version = 0
+        self.origin = None
+        self.slot = timedelta(minutes=15)
+        self.values = {}
+        self.devices = {}
+        self.aq_devices = {}
+        self.mtime = None
+
+    def refresh(self):
+        """Reload if a newer publication exists. Returns True if data is available."""
+        if not os.path.exists(self.path):
+            return False
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return True
+        with timed('published.load'), np.load(self.path) as data:
+            self.version = int(data['version'])
+            self.origin = pd.Timestamp(int(data['origin']))
+            self.slot = timedelta(minutes=int(data['slot_minutes']))
+            self.devices = {str(d): i for i, d in enumerate(data['devices'])}
+            self.aq_devices = {str(d): i for i, d in enumerate(data['aq_devices'])}
+            self.values = {key: data[key] for key in data.files if key.startswith(SERIES + tuple(AQ_POLLUTANTS))}
+        self.mtime = mtime
+        return True
+
+    def is_stale(self, now=None, max_age_minutes=2 * PUBLISH_INTERVAL_MINUTES):
+        """True if nothing is published or the latest origin is older than max_age_minutes."""
+        if self.origin is None:
+            return True
+        return pd.Timestamp(now or datetime.now()) - self.origin > timedelta(minutes=max_age_minutes)
+
+    def lookup(self, device, series='total', minutes_ahead=15, now=None):
+        """
+        Forecast for one device N minutes from now.
+
+        Parameters:
+        - device: Traffic device IMEI (or air quality device for 'pm10'/'pm25')
+        - series: 'total', 'tr1', 'tr2', 'pm10' or 'pm25'
+
+        Returns:
+        - (yhat, yhat_lower, yhat_upper) in vehicles per 15 minutes (µg/m³ for
+          air quality), or None if the device, series or time is not covered
+        """
+        if not self.refresh():
+            return None
+        index = self.aq_devices if series in AQ_POLLUTANTS else self.devices
+        row = index.get(str(device))
+        target = pd.Timestamp(now or datetime.now()) + timedelta(minutes=minutes_ahead)
+        slot = int((target - self.origin) // self.slot)
+        if row is None or f'{series}_yhat' not in self.values or not 0 <= slot < self.values[f'{series}_yhat'].shape[1]:
+            increment('fallbacks', path='published_miss')
+            return None
+        values = tuple(float(self.values[f'{series}_{column}'][row, slot]) for column in COLUMNS)
+        return None if np.isnan(values[0]) else values
+
+
+if __name__ == "__main__":
+    """
+    Run the publishing scheduler (pass --once for a single cycle)
+    """
+    import sys
+
+    print("=" * 70)
+    print("📤 PROJECT ECOFLOW - FORECAST PUBLISHER")
+    print("=" * 70)
+
+    if sys.argv[1:] == ['--once']:
+        forecasters = default_forecasters()
+        if not forecasters:
+            print("\n❌ No trained model or forecast table found. Run model.py first.")
+            exit(1)
+        version = run_once(forecasters, default_aq_forecaster(), force=True)
+        reader = PublishedForecasts()
+        device = next(iter(forecasters))
+        print(f"\n✅ Published v{version}; next 15 minutes for {device}: {reader.lookup(device)}")
+    else:
+        run_forever()
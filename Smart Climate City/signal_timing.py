@@ -0,0 +1,139 @@
+"""
+Signal Timing Optimizer for Project EcoFlow
+Direction-aware green splits and cycle lengths from the TR1/TR2 forecasts,
+using Webster's method for a two-phase junction (one phase per direction):
+- Flow ratio per direction y = q / s (q = forecast flow, s = saturation flow)
+- Optimal cycle C = (1.5 L + 5) / (1 - Y), with L the lost time and Y = y1 + y2,
+  clamped to the allowed cycle range (maximum cycle when oversaturated)
+- Effective green C - L shared in proportion to y, respecting the minimum green
+Everything is plain numpy broadcasting, so a whole network and all forecast
+horizons are optimized in one call.
+"""
+
+import numpy as np
+import pandas as pd
+from config import (
+    SIGNAL_SATURATION_FLOW_VPH,
+    SIGNAL_LOST_TIME_PER_PHASE_S,
+    SIGNAL_MIN_GREEN_S,
+    SIGNAL_MIN_CYCLE_S,
+    SIGNAL_MAX_CYCLE_S,
+    SIGNAL_MAX_FLOW_RATIO
+)
+from metrics import timed
+
+PHASES = 2
+
+
+def webster_timing(flow_1, flow_2, saturation_flow=SIGNAL_SATURATION_FLOW_VPH,
+                   lost_time_per_phase=SIGNAL_LOST_TIME_PER_PHASE_S, min_green=SIGNAL_MIN_GREEN_S,
+                   min_cycle=SIGNAL_MIN_CYCLE_S, max_cycle=SIGNAL_MAX_CYCLE_S,
+                   max_flow_ratio=SIGNAL_MAX_FLOW_RATIO):
+    """
+    Webster cycle length and green split for two-phase junctions.
+
+    Parameters:
+    - flow_1, flow_2: Forecast flow per direction (vehicles/hr), any
+      broadcastable shapes, e.g. (intersections, horizons)
+    - saturation_flow: Saturation flow (vehicles/hr of green), scalar or
+      broadcastable to (..., 2) for per-direction values
+    - lost_time_per_phase: Lost time per phase (seconds)
+    - min_green: Minimum green per direction (seconds)
+    - min_cycle, max_cycle: Allowed cycle range (seconds)
+    - max_flow_ratio: Y at or above which the junction runs the maximum cycle
+
+    Returns:
+    - dict of arrays with the broadcast shape of the flows: cycle, green_1,
+      green_2 (whole seconds), flow_ratio (Y), saturation_1, saturation_2
+      (degree of saturation x = q C / (s g)) and oversaturated (bool)
+    """
+    flows = np.stack(np.broadcast_arrays(np.asarray(flow_1, dtype=float), np.asarray(flow_2, dtype=float)), axis=-1)
+    flows = np.maximum(np.nan_to_num(flows, nan=0.0), 0.0)
+    saturation = np.broadcast_to(np.asarray(saturation_flow, dtype=float), flows.shape)
+
+    ratios = flows / saturation
+    total_ratio = ratios.sum(axis=-1)
+    lost_time = PHASES * lost_time_per_phase
+    oversaturated = total_ratio >= max_flow_ratio
+
+    cycle = (1.5 * lost_time + 5) / (1 - np.minimum(total_ratio, max_flow_ratio))
+    cycle = np.where(oversaturated, max_cycle, cycle)
+    cycle = np.ceil(np.clip(cycle, max(min_cycle, lost_time + PHASES * min_green), max_cycle))
+
+    effective = cycle - lost_time
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = np.where(total_ratio > 0, ratios[..., 0] / total_ratio, 0.5)
+    green_1 = np.round(np.clip(effective * share, min_green, effective - min_green))
+    green_2 = effective - green_1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        degree_1 = flows[..., 0] * cycle / (saturation[..., 0] * green_1)
+        degree_2 = flows[..., 1] * cycle / (saturation[..., 1] * green_2)
+    return {
+        'cycle': cycle,
+        'green_1': green_1,
+        'green_2': green_2,
+        'flow_ratio': total_ratio,
+        'saturation_1': degree_1,
+        'saturation_2': degree_2,
+        'oversaturated': oversaturated
+    }
+
+
+def optimize_network(predictions, **params):
+    """
+    Batch API: signal plans for every intersection and forecast horizon.
+
+    Parameters:
+    - predictions: dict of intersection -> list of prediction dicts (one per
+      horizon) as returned by TrafficPredictor.get_current_prediction(
+      include_directions=True); direction_1/direction_2 are vehicles/min
+    - params: Passed through to webster_timing()
+
+    Returns:
+    - DataFrame with intersection, minutes_ahead, timestamp, flow_1, flow_2
+      (vehicles/hr) and the webster_timing() columns
+    """
+    rows = [(name, prediction) for name, horizon in predictions.items() for prediction in horizon
+            if prediction and 'direction_1' in prediction and 'direction_2' in prediction]
+    frame = pd.DataFrame({
+        'intersection': [name for name, _ in rows],
+        'minutes_ahead': [p.get('target_minutes_ahead') for _, p in rows],
+        'timestamp': [p.get('timestamp') for _, p in rows],
+        'flow_1': np.array([p['direction_1'] for _, p in rows], dtype=float) * 60,
+        'flow_2': np.array([p['direction_2'] for _, p in rows], dtype=float) * 60
+    })
+    with timed('signal.optimize', plans=len(frame)):
+        plans = webster_timing(frame['flow_1'].to_numpy(), frame['flow_2'].to_numpy(), **params)
+    for key, values in plans.items():
+        frame[key] = values
+    return frame
+
+
+if __name__ == "__main__":
+    """
+    Time a network-wide re-optimisation and show a few example plans
+    """
+    import time
+
+    print("=" * 70)
+    print("🚦 PROJECT ECOFLOW - SIGNAL TIMING OPTIMIZER")
+    print("=" * 70)
+
+    examples = [(300, 300), (900, 300), (1200, 400), (50, 20), (900, 800)]
+    print("\n📋 Example plans (vehicles/hr -> seconds):")
+    for flow_1, flow_2 in examples:
+        plan = webster_timing(flow_1, flow_2)
+        print(f"   TR1 {flow_1:5d} | TR2 {flow_2:5d} -> cycle {plan['cycle']:.0f}s, "
+              f"green {plan['green_1']:.0f}s / {plan['green_2']:.0f}s, "
+              f"x = {plan['saturation_1']:.2f} / {plan['saturation_2']:.2f}"
+              f"{'  ⚠️ oversaturated' if plan['oversaturated'] else ''}")
+
+    rng = np.random.default_rng(0)
+    shape = (500, 16)  # Intersections x 15-minute horizons (4 hours)
+    flows_1, flows_2 = rng.gamma(2, 250, shape), rng.gamma(2, 200, shape)
+    start = time.perf_counter()
+    plans = webster_timing(flows_1, flows_2)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"\n✅ {shape[0]} intersections x {shape[1]} horizons optimized in {elapsed:.1f} ms "
+          f"({plans['oversaturated'].mean():.1%} oversaturated)")
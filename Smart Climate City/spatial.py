@@ -0,0 +1,282 @@
+"""
+Spatial Pollution Interpolation for Project EcoFlow
+Builds a PM10 surface over the city from the air quality sensors using
+inverse distance weighting (IDW). Neighbour search runs once per grid on a
+KD-tree; after that a surface is a weighted sum over K neighbours per cell,
+cached per time window and patched incrementally when one sensor updates.
+"""
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from config import (
+    SPATIAL_NEIGHBOURS,
+    SPATIAL_POWER,
+    SPATIAL_MAX_DISTANCE_KM,
+    SPATIAL_GRID_RESOLUTION_M,
+    SPATIAL_GRID_MARGIN_KM,
+    SPATIAL_WINDOW_MINUTES,
+    SPATIAL_CACHE_WINDOWS
+)
+from metrics import timed, increment
+
+EARTH_RADIUS_KM = 6371.0
+MIN_DISTANCE_KM = 1e-3  # A cell on top of a sensor takes the sensor's value
+
+# WHO-based PM10 bands (same cut-offs as logic.calculate_health_impact) -> RGBA
+PM10_COLORS = (
+    (20, '#22c55e99'),
+    (40, '#eab30899'),
+    (50, '#f9731699'),
+    (100, '#dc262699'),
+    (np.inf, '#7e22ce99')
+)
+
+
+def _nearest(points, queries, k):
+    """
+    k nearest points for every query: (distances, indices), each (n, k).
+    Uses scipy's cKDTree when installed, otherwise a chunked brute-force
+    search (fine for the few dozen sensors of one city).
+    """
+    k = min(k, len(points))
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        increment('fallbacks', path='spatial_brute_force')
+        distances = np.empty((len(queries), k))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        for i in range(0, len(queries), 4096):
+            block = np.linalg.norm(queries[i:i + 4096, None, :] - points[None, :, :], axis=2)
+            nearest = np.argsort(block, axis=1)[:, :k]
+            indices[i:i + 4096] = nearest
+            distances[i:i + 4096] = np.take_along_axis(block, nearest, axis=1)
+        return distances, indices
+
+    distances, indices = cKDTree(points).query(queries, k=k)
+    return distances.reshape(len(queries), k), indices.reshape(len(queries), k)
+
+
+def pm10_color(values):
+    """Map PM10 values to RGBA hex colors (NaN -> None)."""
+    values = np.asarray(values, dtype=float)
+    limits = np.array([limit for limit, _ in PM10_COLORS])
+    colors = np.array([color for _, color in PM10_COLORS], dtype=object)
+    result = colors[np.minimum(np.searchsorted(limits, values), len(limits) - 1)]
+    result[~np.isfinite(values)] = None
+    return result
+
+
+class PollutionSurface:
+    """
+    IDW surface over a fixed set of sensor locations.
+
+    Geometry (sensor positions, grid, neighbour indices and raw weights) is
+    computed once. Each time window keeps the sensor values and the
+    finished grid; update_sensor() only recomputes the cells that have the
+    sensor among their neighbours.
+    """
+
+    def __init__(self, latitudes, longitudes, sensor_ids=None, k=SPATIAL_NEIGHBOURS, power=SPATIAL_POWER,
+                 max_distance_km=SPATIAL_MAX_DISTANCE_KM, resolution_m=SPATIAL_GRID_RESOLUTION_M,
+                 margin_km=SPATIAL_GRID_MARGIN_KM, max_windows=SPATIAL_CACHE_WINDOWS):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        if len(self.latitudes) == 0:
+            raise ValueError("PollutionSurface needs at least one sensor")
+        self.sensor_ids = [str(s) for s in (sensor_ids if sensor_ids is not None else range(len(self.latitudes)))]
+        self.sensor_index = {sensor: i for i, sensor in enumerate(self.sensor_ids)}
+        self.k = k
+        self.power = power
+        self.max_distance_km = max_distance_km
+        self.max_windows = max_windows
+        self.windows = OrderedDict()  # window start -> {'values': per-sensor array, 'grid': per-cell array}
+
+        # Local equirectangular projection around the sensor centroid (km)
+        self.lat0 = float(self.latitudes.mean())
+        self.lon0 = float(self.longitudes.mean())
+        self.sensor_xy = self.project(self.latitudes, self.longitudes)
+
+        with timed('spatial.grid', sensors=len(self.sensor_ids)):
+            self._build_grid(resolution_m, margin_km)
+
+    def project(self, latitudes, longitudes):
+        """Latitude/longitude in degrees -> (n, 2) kilometres from the centroid."""
+        lat = np.radians(np.asarray(latitudes, dtype=float))
+        lon = np.radians(np.asarray(longitudes, dtype=float))
+        x = EARTH_RADIUS_KM * (lon - np.radians(self.lon0)) * np.cos(np.radians(self.lat0))
+        y = EARTH_RADIUS_KM * (lat - np.radians(self.lat0))
+        return np.column_stack([x, y])
+
+    def _weights(self, queries):
+        """Neighbour indices and raw IDW weights for (n, 2) projected points."""
+        distances, indices = _nearest(self.sensor_xy, queries, self.k)
+        weights = 1.0 / np.maximum(distances, MIN_DISTANCE_KM) ** self.power
+        # Points far from every sensor stay empty instead of extrapolating
+        weights[distances > self.max_distance_km] = 0.0
+        return indices, weights
+
+    def _build_grid(self, resolution_m, margin_km):
+        step_lat = np.degrees(resolution_m / 1000.0 / EARTH_RADIUS_KM)
+        step_lon = step_lat / np.cos(np.radians(self.lat0))
+        margin_lat = np.degrees(margin_km / EARTH_RADIUS_KM)
+        margin_lon = margin_lat / np.cos(np.radians(self.lat0))
+
+        self.grid_latitudes = np.arange(self.latitudes.min() - margin_lat, self.latitudes.max() + margin_lat, step_lat)
+        self.grid_longitudes = np.arange(self.longitudes.min() - margin_lon, self.longitudes.max() + margin_lon, step_lon)
+        self.shape = (len(self.grid_latitudes), len(self.grid_longitudes))
+        cell_lat, cell_lon = np.meshgrid(self.grid_latitudes, self.grid_longitudes, indexing='ij')
+        self.cell_latitudes, self.cell_longitudes = cell_lat.ravel(), cell_lon.ravel()
+
+        self.cell_indices, self.cell_weights = self._weights(self.project(self.cell_latitudes, self.cell_longitudes))
+
+        # Inverted index: cells that have sensor j among their neighbours
+        flat = self.cell_indices.ravel()
+        order = np.argsort(flat, kind='stable')
+        boundaries = np.searchsorted(flat[order], np.arange(len(self.sensor_ids) + 1))
+        cells = order // self.cell_indices.shape[1]
+        self.sensor_cells = [np.unique(cells[boundaries[j]:boundaries[j + 1]]) for j in range(len(self.sensor_ids))]
+
+    @staticmethod
+    def _blend(values, indices, weights):
+        """Weighted mean over neighbours, ignoring sensors without a value."""
+        neighbour_values = values[indices]
+        valid = np.isfinite(neighbour_values) & (weights > 0)
+        w = np.where(valid, weights, 0.0)
+        total = w.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, (w * np.where(valid, neighbour_values, 0.0)).sum(axis=1) / total, np.nan)
+
+    def window_key(self, timestamp, window_minutes=SPATIAL_WINDOW_MINUTES):
+        """Start of the time window a timestamp belongs to."""
+        return pd.Timestamp(timestamp).floor(f'{window_minutes}min')
+
+    def set_values(self, window, values):
+        """
+        Build (or rebuild) the surface for one time window.
+
+        Parameters:
+        - window: Window key (e.g. from window_key())
+        - values: PM10 per sensor - an array in sensor order or a dict of sensor id -> value
+
+        Returns:
+        - 2D grid of interpolated PM10 (NaN far from every sensor)
+        """
+        if isinstance(values, dict):
+            array = np.full(len(self.sensor_ids), np.nan)
+            for sensor, value in values.items():
+                if str(sensor) in self.sensor_index:
+                    array[self.sensor_index[str(sensor)]] = value
+            values = array
+        values = np.asarray(values, dtype=float).copy()
+
+        with timed('spatial.surface', cells=len(self.cell_weights)):
+            grid = self._blend(values, self.cell_indices, self.cell_weights)
+        self.windows[window] = {'values': values, 'grid': grid}
+        self.windows.move_to_end(window)
+        while len(self.windows) > self.max_windows:
+            self.windows.popitem(last=False)
+        return grid.reshape(self.shape)
+
+    def update_sensor(self, window, sensor, value):
+        """
+        New reading for one sensor: only the cells that use it are recomputed.
+
+        Returns:
+        - Number of cells recomputed (0 if the window is not cached yet)
+        """
+        entry = self.windows.get(window)
+        j = self.sensor_index.get(str(sensor))
+        if entry is None or j is None:
+            increment('cache_misses', cache='spatial_window')
+            return 0
+        entry['values'][j] = value
+        cells = self.sensor_cells[j]
+        entry['grid'][cells] = self._blend(entry['values'], self.cell_indices[cells], self.cell_weights[cells])
+        self.windows.move_to_end(window)
+        increment('cache_hits', cache='spatial_window')
+        return len(cells)
+
+    def grid(self, window):
+        """Cached 2D grid for a window (None if not built)."""
+        entry = self.windows.get(window)
+        return None if entry is None else entry['grid'].reshape(self.shape)
+
+    def exposure(self, window, latitudes, longitudes):
+        """
+        Interpolated PM10 at arbitrary points, e.g. intersections.
+
+        Returns:
+        - Array of PM10 estimates (NaN if the window is missing or the point is
+          beyond SPATIAL_MAX_DISTANCE_KM from every sensor)
+        """
+        entry = self.windows.get(window)
+        if entry is None:
+            return np.full(len(np.atleast_1d(latitudes)), np.nan)
+        indices, weights = self._weights(self.project(np.atleast_1d(latitudes), np.atleast_1d(longitudes)))
+        return self._blend(entry['values'], indices, weights)
+
+    def layer(self, window):
+        """
+        Map layer for st.map: one point per non-empty cell.
+
+        Returns:
+        - DataFrame with lat, lon, pm10, color (None if the window is not built)
+        """
+        entry = self.windows.get(window)
+        if entry is None:
+            return None
+        keep = np.isfinite(entry['grid'])
+        values = entry['grid'][keep]
+        return pd.DataFrame({
+            'lat': self.cell_latitudes[keep],
+            'lon': self.cell_longitudes[keep],
+            'pm10': values,
+            'color': pm10_color(values)
+        })
+
+
+def surface_from_stats(stats, window='latest', value_column='avg_pm10'):
+    """
+    Build a surface from get_air_quality_statistics() output
+    (air_quality_stats.csv: one row per location with latitude/longitude).
+
+    Returns:
+    - PollutionSurface with `window` populated
+    """
+    stats = stats.dropna(subset=['latitude', 'longitude'])
+    sensor_ids = stats['location_name'].fillna('') + '@' + stats['latitude'].round(5).astype(str) + ',' + \
+        stats['longitude'].round(5).astype(str)
+    surface = PollutionSurface(stats['latitude'], stats['longitude'], sensor_ids=sensor_ids.tolist())
+    surface.set_values(window, stats[value_column].to_numpy(dtype=float))
+    return surface
+
+
+if __name__ == "__main__":
+    """
+    Interpolate the per-location PM10 averages onto a grid
+    """
+    import os
+    import time
+
+    print("=" * 70)
+    print("🗺️  PROJECT ECOFLOW - PM10 SURFACE")
+    print("=" * 70)
+
+    stats_path = 'data_cache/air_quality_stats.csv'
+    if not os.path.exists(stats_path):
+        print(f"\n❌ Air quality statistics not found: {stats_path}")
+        print("⚠️  Run data_extraction.py first to extract the air quality data")
+        exit(1)
+
+    stats = pd.read_csv(stats_path)
+    start = time.perf_counter()
+    surface = surface_from_stats(stats)
+    elapsed = time.perf_counter() - start
+    grid = surface.grid('latest')
+    print(f"\n✅ {len(surface.sensor_ids)} sensors -> {surface.shape[0]} x {surface.shape[1]} grid in {elapsed * 1000:.0f} ms")
+    print(f"   PM10 range: {np.nanmin(grid):.1f} - {np.nanmax(grid):.1f} µg/m³")
+
+    start = time.perf_counter()
+    cells = surface.update_sensor('latest', surface.sensor_ids[0], stats['max_pm10'].iloc[0])
+    print(f"   Incremental update of one sensor: {cells:,} cells in {(time.perf_counter() - start) * 1000:.1f} ms")
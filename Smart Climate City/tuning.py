@@ -0,0 +1,241 @@
+"""
+Hyperparameter Search for Project EcoFlow
+Searches the Prophet configuration per device and direction on a holdout
+window, in parallel, using successive halving: every candidate is first fitted
+on a short recent history and only the best third moves on to longer ones.
+Evaluated configs are cached on disk, so repeated searches skip them.
+The winners are written to the model registry.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    PROPHET_PARAMS,
+    TUNING_PARAM_GRID,
+    TUNING_MAX_CANDIDATES,
+    TUNING_HOLDOUT_DAYS,
+    TUNING_RUNG_DAYS,
+    TUNING_ETA,
+    TUNING_WORKERS,
+    TUNING_CACHE_PATH,
+    TUNING_SEED,
+    TRAINING_MODE,
+    FIT_MODES,
+    TRAINING_DATA_MONTHS
+)
+from metrics import timed, increment
+from backtest import SERIES_COLUMNS, data_fingerprint
+
+# Set once per worker process by _init_worker: job key -> 15-minute frame
+_worker_frames = None
+
+
+def candidate_params(grid=TUNING_PARAM_GRID, max_candidates=TUNING_MAX_CANDIDATES, seed=TUNING_SEED):
+    """
+    Expand a parameter grid into candidate configurations.
+
+    Parameters:
+    - grid: dict of parameter name -> list of values
+    - max_candidates: If the full grid is larger, sample this many at random
+    - seed: Random seed for the sample (same seed = same candidates = cache hits)
+
+    Returns:
+    - list of dicts, each merged over PROPHET_PARAMS
+    """
+    names = sorted(grid)
+    combos = list(itertools.product(*(grid[name] for name in names)))
+    if max_candidates and len(combos) > max_candidates:
+        rng = np.random.default_rng(seed)
+        picked = sorted(rng.choice(len(combos), size=max_candidates, replace=False))
+        combos = [combos[i] for i in picked]
+    return [{**PROPHET_PARAMS, **dict(zip(names, values))} for values in combos]
+
+
+def _result_key(fingerprint, series, params, train_days, holdout_days):
+    payload = json.dumps([fingerprint, series, params, train_days, holdout_days, FIT_MODES[TRAINING_MODE]],
+                         sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def load_cache(path=TUNING_CACHE_PATH):
+    """Load evaluated configurations (result key -> holdout MAE)."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(cache, path=TUNING_CACHE_PATH):
+    """Write the results cache atomically."""
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(frames):
+    global _worker_frames
+    _worker_frames = frames
+
+
+def _evaluate(task):
+    """
+    Fit one candidate on the training window and score it on the holdout.
+
+    Returns:
+    - Holdout MAE (inf if the fit failed)
+    """
+    from model import fit_prophet
+
+    job, series, params, train_days, holdout_days = task
+    frame = _worker_frames[job]
+    column = SERIES_COLUMNS[series]
+    holdout_start = frame['ds_15min'].max() - timedelta(days=holdout_days)
+
+    in_holdout = frame['ds_15min'] > holdout_start
+    in_train = ~in_holdout
+    if train_days is not None:
+        in_train &= frame['ds_15min'] > holdout_start - timedelta(days=train_days)
+    train = frame.loc[in_train, ['ds_15min', column]].set_axis(['ds', 'y'], axis=1).dropna()
+    holdout = frame.loc[in_holdout, ['ds_15min', column]].set_axis(['ds', 'y'], axis=1).dropna()
+
+    try:
+        model = fit_prophet(train, params=params, series=series)
+        yhat = model.predict(holdout[['ds']])['yhat'].to_numpy()
+    except Exception as e:
+        print(f"⚠️  Candidate failed ({series}, {params}): {e}")
+        return float('inf')
+    return float(np.mean(np.abs(yhat - holdout['y'].to_numpy())))
+
+
+def tune_fleet(frames, series=('total', 'tr1', 'tr2'), candidates=None, holdout_days=TUNING_HOLDOUT_DAYS,
+               rung_days=TUNING_RUNG_DAYS, eta=TUNING_ETA, workers=TUNING_WORKERS,
+               cache_path=TUNING_CACHE_PATH, register=True):
+    """
+    Tune every (device, series) pair with one shared process pool.
+
+    Parameters:
+    - frames: dict of device_imei -> clean 15-minute frame from preprocessing.load_clean_traffic()
+    - series: Series to tune per device
+    - candidates: Candidate configurations (default: candidate_params())
+    - holdout_days: Days at the end of each series used for scoring
+    - rung_days: Training history per halving rung (None = all history)
+    - eta: Keep the best 1/eta candidates after each rung
+    - workers: Process pool size (None = all cores)
+    - cache_path: Results cache (None disables caching)
+    - register: Write the winners to the model registry
+
+    Returns:
+    - dict of (device_imei, series) -> {'params', 'mae', 'evaluated'}
+    """
+    if candidates is None:
+        candidates = candidate_params()
+    cache = load_cache(cache_path)
+
+    jobs = {}
+    for device_imei, frame in frames.items():
+        fingerprint = data_fingerprint(frame)
+        for name in series:
+            if SERIES_COLUMNS[name] in frame.columns:
+                jobs[(str(device_imei), name)] = {'fingerprint': fingerprint, 'alive': list(candidates),
+                                                  'scores': [], 'evaluated': 0}
+
+    print(f"\n🎛️  Tuning {len(jobs)} device/series pairs x {len(candidates)} candidates "
+          f"(rungs: {', '.join(str(d or 'all') for d in rung_days)} days)...")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=({str(k): v for k, v in frames.items()},)) as pool:
+        rung = 0
+        while rung < len(rung_days):
+            train_days = rung_days[rung]
+            # Gather every uncached evaluation of this rung across all jobs into one batch
+            pending = []
+            for (device_imei, name), job in jobs.items():
+                job['keys'] = [_result_key(job['fingerprint'], name, params, train_days, holdout_days)
+                               for params in job['alive']]
+                for params, key in zip(job['alive'], job['keys']):
+                    if key not in cache:
+                        pending.append((key, (device_imei, name, params, train_days, holdout_days)))
+
+            hits = sum(len(job['keys']) for job in jobs.values()) - len(pending)
+            increment('tuning_cache_hits', amount=hits)
+            print(f"   Rung {rung + 1}: {len(pending)} fits ({hits} cached)")
+
+            with timed('tuning.rung', rung=rung + 1):
+                scores = pool.map(_evaluate, [task for _, task in pending], chunksize=1)
+                for (key, _), score in zip(pending, scores):
+                    cache[key] = score
+            save_cache(cache, cache_path)
+
+            # Successive halving: keep the best 1/eta (the last rung picks the winner)
+            last_rung = rung == len(rung_days) - 1
+            for job in jobs.values():
+                scores = [cache[key] for key in job['keys']]
+                job['evaluated'] += len(scores)
+                keep = 1 if last_rung else max(1, int(np.ceil(len(scores) / eta)))
+                order = np.argsort(scores, kind='stable')[:keep]
+                job['alive'] = [job['alive'][i] for i in order]
+                job['scores'] = [scores[i] for i in order]
+
+            if not last_rung and all(len(job['alive']) == 1 for job in jobs.values()):
+                # Every job is down to one survivor: skip straight to the final rung
+                rung = len(rung_days) - 1
+            else:
+                rung += 1
+
+    results = {}
+    for (device_imei, name), job in jobs.items():
+        params, score = job['alive'][0], job['scores'][0]
+        results[(device_imei, name)] = {'params': params, 'mae': score, 'evaluated': job['evaluated']}
+        print(f"   ✅ {device_imei} {name}: MAE {score:.2f} vehicles/15min - {params}")
+        if register:
+            from registry import register_params
+            register_params(device_imei, name, params, score=score, metric='mae')
+    return results
+
+
+def tune(frame, device_imei, **kwargs):
+    """
+    Tune one device (all three series by default).
+
+    Parameters:
+    - frame: Clean 15-minute frame from preprocessing.load_clean_traffic()
+    - device_imei: Device identifier the winners are registered under
+    - kwargs: Passed through to tune_fleet()
+
+    Returns:
+    - dict of series -> {'params', 'mae', 'evaluated'}
+    """
+    results = tune_fleet({device_imei: frame}, **kwargs)
+    return {name: result for (_, name), result in results.items()}
+
+
+if __name__ == "__main__":
+    """
+    Tune the Prophet configuration for the device in the extracted training data
+    """
+    from preprocessing import load_clean_traffic
+
+    print("=" * 70)
+    print("🎛️  PROJECT ECOFLOW - HYPERPARAMETER SEARCH")
+    print("=" * 70)
+
+    data_path = f'data_cache/german_traffic_{TRAINING_DATA_MONTHS}m.csv'
+    if not os.path.exists(data_path):
+        print(f"\n❌ Training data not found: {data_path}")
+        print("⚠️  Run data_extraction.py first to extract the training data")
+        exit(1)
+
+    df = pd.read_csv(data_path)
+    device_imei = df['imei'].iloc[0] if 'imei' in df.columns else 'unknown'
+    tune(load_clean_traffic(df), device_imei)
+    print("\n💡 Retrain with model.py to use the tuned configuration")